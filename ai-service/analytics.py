@@ -0,0 +1,51 @@
+"""
+Driver performance analytics
+
+Reads the per-driver aggregates in driver_delivery_stats, which a trigger on
+deliveries keeps up to date as deliveries are created, completed or
+cancelled (see the backend migration
+2024_01_01_000003_create_driver_delivery_stats_table). A lookup is one
+primary-key read per driver, independent of delivery history size.
+"""
+import metrics
+
+ANALYTICS_QUERY = """
+    SELECT driver_id, total_deliveries, completed_deliveries, cancelled_deliveries,
+           timed_deliveries, on_time_deliveries, sum_actual_time, sum_distance_km,
+           last_completed_at
+    FROM driver_delivery_stats
+    WHERE driver_id = ANY(%s)
+"""
+
+def parse_driver_id(driver_id):
+    """Return driver_id as an int, or None if it is not a valid id"""
+    try:
+        driver_id = int(driver_id)
+    except (TypeError, ValueError):
+        return None
+    return driver_id if driver_id > 0 else None
+
+def _ratio(numerator, denominator):
+    return float(numerator) / denominator if denominator else None
+
+def format_analytics(row):
+    """Turn a driver_delivery_stats row into the analytics response"""
+    finished = row['completed_deliveries'] + row['cancelled_deliveries']
+    return {
+        'driver_id': row['driver_id'],
+        'total_deliveries': row['total_deliveries'],
+        'completed_deliveries': row['completed_deliveries'],
+        'cancelled_deliveries': row['cancelled_deliveries'],
+        'avg_delivery_time': _ratio(row['sum_actual_time'], row['timed_deliveries']),
+        'completion_rate': _ratio(row['completed_deliveries'], finished),
+        'on_time_rate': _ratio(row['on_time_deliveries'], row['timed_deliveries']),
+        'avg_distance_km': _ratio(row['sum_distance_km'], row['completed_deliveries']),
+        'last_completed_at': row['last_completed_at'].isoformat() if row['last_completed_at'] else None
+    }
+
+def fetch_driver_analytics(conn, driver_ids):
+    """Fetch analytics for many drivers in one query. Returns {driver_id: analytics}."""
+    with metrics.span('db_query'), conn.cursor() as cur:
+        cur.execute(ANALYTICS_QUERY, (list(driver_ids),))
+        rows = cur.fetchall()
+    return {row['driver_id']: format_analytics(row) for row in rows}
@@ -0,0 +1,297 @@
+"""
+Streaming anomaly detection for sensor readings
+
+Every (sensor_id, zone) gets a slot in flat NumPy arrays holding an
+exponentially weighted mean and variance (SENSOR_EWMA_ALPHA) plus a ring
+buffer of its last SENSOR_WINDOW readings. Memory per sensor is constant, so
+hundreds of thousands of sensors fit in one process. A reading is scored
+against the statistics from before it arrived:
+
+    z = |value - mean| / max(std, SENSOR_MIN_STD)
+
+and classified WARNING above SENSOR_WARNING_Z, CRITICAL above
+SENSOR_CRITICAL_Z, NORMAL otherwise. The first SENSOR_WARMUP readings of a
+sensor only train its statistics and are classified NORMAL.
+
+A batch is evaluated with vectorized updates. Readings of the same sensor
+within a batch are applied in arrival order, one round per repeat. An alert
+row is produced when a sensor's status worsens (NORMAL to WARNING, or to
+CRITICAL). Consecutive anomalous readings therefore raise one alert, not one
+per reading.
+
+At most SENSOR_MAX_SLOTS sensors are tracked (about 100 bytes of arrays
+each plus the key). When a new sensor arrives at the cap, the slot of the
+sensor seen least recently is recycled, so ids sent by a misbehaving
+reader cannot grow memory without bound.
+
+Statistics are per process. Under several gunicorn workers, route each
+reader to one worker (or run ingestion with a single worker) so that a
+sensor's readings land in the same detector.
+"""
+import datetime
+import math
+import os
+import threading
+
+import numpy as np
+
+STATUSES = ('NORMAL', 'WARNING', 'CRITICAL')
+NORMAL, WARNING, CRITICAL = range(3)
+
+# sensor_alerts.z_score is DECIMAL(10,2)
+MAX_Z_SCORE = 999999.99
+
+ALERT_COLUMNS = (
+    'sensor_id', 'sensor_type', 'zone', 'value', 'expected_value', 'z_score',
+    'status', 'alert', 'alert_type', 'created_at'
+)
+
+class SensorAnomalyDetector:
+    """EWMA z-score classifier over many sensors in NumPy slot arrays"""
+
+    def __init__(self, alpha=None, window=None, warmup=None, warning_z=None, critical_z=None,
+                 min_std=None, max_slots=None, capacity=1024):
+        self.alpha = float(alpha if alpha is not None else os.getenv('SENSOR_EWMA_ALPHA', '0.05'))
+        self.window = int(window if window is not None else os.getenv('SENSOR_WINDOW', '16'))
+        self.warmup = int(warmup if warmup is not None else os.getenv('SENSOR_WARMUP', '10'))
+        self.warning_z = float(warning_z if warning_z is not None else os.getenv('SENSOR_WARNING_Z', '3'))
+        self.critical_z = float(critical_z if critical_z is not None else os.getenv('SENSOR_CRITICAL_Z', '5'))
+        self.min_std = float(min_std if min_std is not None else os.getenv('SENSOR_MIN_STD', '0.05'))
+        self.max_slots = int(max_slots if max_slots is not None else os.getenv('SENSOR_MAX_SLOTS', '500000'))
+        capacity = min(capacity, self.max_slots)
+        self._slots = {}
+        # Key of each allocated slot, and the batch that last used it
+        self._keys = []
+        self._last_seen = np.zeros(capacity, dtype=np.int64)
+        self._batch = 0
+        self._mean = np.zeros(capacity)
+        self._var = np.zeros(capacity)
+        self._count = np.zeros(capacity, dtype=np.int64)
+        self._status = np.zeros(capacity, dtype=np.int8)
+        self._ring = np.zeros((capacity, self.window), dtype=np.float32)
+        self._lock = threading.Lock()
+        self._stats = {'readings': 0, 'warnings': 0, 'criticals': 0, 'alerts': 0, 'evictions': 0,
+                       'non_finite': 0}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _grow(self, needed):
+        capacity = len(self._mean)
+        while capacity < needed:
+            capacity *= 2
+        capacity = min(capacity, self.max_slots)
+        grown = capacity - len(self._mean)
+        self._last_seen = np.concatenate([self._last_seen, np.zeros(grown, dtype=np.int64)])
+        self._mean = np.concatenate([self._mean, np.zeros(grown)])
+        self._var = np.concatenate([self._var, np.zeros(grown)])
+        self._count = np.concatenate([self._count, np.zeros(grown, dtype=np.int64)])
+        self._status = np.concatenate([self._status, np.zeros(grown, dtype=np.int8)])
+        self._ring = np.concatenate([self._ring, np.zeros((grown, self.window), dtype=np.float32)])
+
+    def _slot_indices(self, keys):
+        slots = self._slots
+        indices = np.empty(len(keys), dtype=np.int64)
+        new_keys = {}
+        for i, key in enumerate(keys):
+            slot = slots.get(key)
+            if slot is None:
+                new_keys.setdefault(key, []).append(i)
+            else:
+                indices[i] = slot
+        if not new_keys:
+            return indices
+
+        allocated = len(self._keys)
+        fresh = min(len(new_keys), self.max_slots - allocated)
+        free = list(range(allocated, allocated + fresh))
+        if fresh < len(new_keys):
+            free += self._evict(len(new_keys) - fresh, indices, new_keys)
+        if allocated + fresh > len(self._mean):
+            self._grow(allocated + fresh)
+        for slot, (key, positions) in zip(free, new_keys.items()):
+            if slot < len(self._keys):
+                self._keys[slot] = key
+            else:
+                self._keys.append(key)
+            slots[key] = slot
+            indices[positions] = slot
+        return indices
+
+    def _evict(self, n, indices, new_keys):
+        """Free the n least recently seen slots not used by the current batch"""
+        allocated = len(self._keys)
+        in_batch = np.ones(len(indices), dtype=bool)
+        for positions in new_keys.values():
+            in_batch[positions] = False
+        last_seen = self._last_seen[:allocated].copy()
+        last_seen[indices[in_batch]] = np.iinfo(np.int64).max
+        if n > allocated - len(np.unique(indices[in_batch])):
+            raise ValueError(f'A batch may reference at most {self.max_slots} distinct sensors')
+        victims = np.argpartition(last_seen, n - 1)[:n] if n < allocated else np.arange(allocated)
+        for slot in victims:
+            del self._slots[self._keys[slot]]
+        self._mean[victims] = 0.0
+        self._var[victims] = 0.0
+        self._count[victims] = 0
+        self._status[victims] = NORMAL
+        self._ring[victims] = 0.0
+        self._stats['evictions'] += n
+        return victims.tolist()
+
+    def evaluate(self, keys, values):
+        """
+        Score and learn from a batch of readings.
+
+        keys are (sensor_id, zone) tuples and values floats, in arrival
+        order. Returns (statuses, z_scores, expected, alerted): status codes
+        per reading, z-scores, the mean each reading was compared against,
+        and a boolean mask of readings that worsened their sensor's status.
+        """
+        values = np.asarray(values, dtype=float)
+        n = len(values)
+        statuses = np.zeros(n, dtype=np.int8)
+        z_scores = np.zeros(n)
+        expected = np.zeros(n)
+        alerted = np.zeros(n, dtype=bool)
+        if n == 0:
+            return statuses, z_scores, expected, alerted
+
+        # A NaN or infinity would poison the sensor's mean and variance for
+        # good; such readings are left NORMAL and not learned from
+        finite = np.isfinite(values)
+        if not finite.all():
+            keep = np.flatnonzero(finite)
+            results = self.evaluate([keys[i] for i in keep], values[keep])
+            for out, result in zip((statuses, z_scores, expected, alerted), results):
+                out[keep] = result
+            with self._lock:
+                self._stats['non_finite'] += n - len(keep)
+            return statuses, z_scores, expected, alerted
+
+        with self._lock:
+            slots = self._slot_indices(keys)
+            self._batch += 1
+            self._last_seen[slots] = self._batch
+            # Rank of each reading among earlier readings of the same sensor
+            order = np.argsort(slots, kind='stable')
+            sorted_slots = slots[order]
+            starts = np.r_[True, sorted_slots[1:] != sorted_slots[:-1]]
+            group_start = np.maximum.accumulate(np.where(starts, np.arange(n), 0))
+            rank = np.empty(n, dtype=np.int64)
+            rank[order] = np.arange(n) - group_start
+
+            for r in range(int(rank.max()) + 1):
+                rows = np.flatnonzero(rank == r)
+                s = slots[rows]
+                x = values[rows]
+                mean, var, count = self._mean[s], self._var[s], self._count[s]
+
+                z = np.abs(x - mean) / np.maximum(np.sqrt(var), self.min_std)
+                z = np.where(count >= self.warmup, z, 0.0)
+                status = np.where(z > self.critical_z, CRITICAL, np.where(z > self.warning_z, WARNING, NORMAL))
+                statuses[rows] = status
+                z_scores[rows] = z
+                expected[rows] = mean
+                alerted[rows] = status > self._status[s]
+                self._status[s] = status
+
+                # West's EWMA update. While 1/(n+1) exceeds alpha it is the exact
+                # running mean and variance, so a new sensor is not scored
+                # against a variance still ramping up from zero
+                weight = np.maximum(self.alpha, 1.0 / (count + 1))
+                diff = x - mean
+                increment = weight * diff
+                self._mean[s] = mean + increment
+                self._var[s] = (1 - weight) * (var + diff * increment)
+                self._ring[s, count % self.window] = x
+                self._count[s] = count + 1
+
+            self._stats['readings'] += n
+            self._stats['warnings'] += int((statuses == WARNING).sum())
+            self._stats['criticals'] += int((statuses == CRITICAL).sum())
+            self._stats['alerts'] += int(alerted.sum())
+        return statuses, z_scores, expected, alerted
+
+    def state(self, sensor_id, zone=None):
+        """Rolling statistics and recent readings of one sensor, or None"""
+        with self._lock:
+            slot = self._slots.get((sensor_id, zone))
+            if slot is None:
+                return None
+            count = int(self._count[slot])
+            recent = self._ring[slot]
+            if count < self.window:
+                recent = recent[:count]
+            else:
+                # Oldest first: the ring's write position holds the oldest value
+                recent = np.roll(recent, -(count % self.window))
+            return {
+                'sensor_id': sensor_id,
+                'zone': zone,
+                'readings': count,
+                'mean': float(self._mean[slot]),
+                'std': float(np.sqrt(self._var[slot])),
+                'status': STATUSES[self._status[slot]],
+                'recent': [round(float(v), 2) for v in recent]
+            }
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['sensors'] = len(self._slots)
+            stats['max_sensors'] = self.max_slots
+            stats['state_bytes'] = (
+                self._mean.nbytes + self._var.nbytes + self._count.nbytes
+                + self._status.nbytes + self._ring.nbytes + self._last_seen.nbytes
+            )
+        return stats
+
+def alert_text(sensor_id, status, value, expected, z_score, unit):
+    """Alert message in the wording of inventory_alerts"""
+    prefix = 'Critical' if status == CRITICAL else 'Anomaly alert'
+    direction = 'above' if value > expected else 'below'
+    unit = f' {unit}' if unit else ''
+    return (f'{prefix}: {sensor_id} read {value:.2f}{unit}, {z_score:.1f} std devs '
+            f'{direction} its rolling mean of {expected:.2f}{unit}')
+
+def classify_sensor_rows(detector, rows, columns):
+    """
+    Fill in the status of sensor_data rows and build alert rows.
+
+    rows are tuples in sensor_data column order. A status sent by the reader
+    is kept; otherwise the computed one is used. Rows without a finite
+    value are left NORMAL and not scored. Returns (rows, alert_rows).
+    """
+    index = {name: i for i, name in enumerate(columns)}
+    sensor_i, zone_i, value_i = index['sensor_id'], index['zone'], index['value']
+    status_i, type_i, unit_i = index['status'], index['sensor_type'], index['unit']
+
+    scored = [i for i, row in enumerate(rows)
+              if row[value_i] is not None and math.isfinite(row[value_i])]
+    statuses, z_scores, expected, alerted = detector.evaluate(
+        [(rows[i][sensor_i], rows[i][zone_i]) for i in scored],
+        [rows[i][value_i] for i in scored]
+    )
+
+    rows = list(rows)
+    for j, i in enumerate(scored):
+        if rows[i][status_i] is None:
+            rows[i] = rows[i][:status_i] + (STATUSES[statuses[j]],) + rows[i][status_i + 1:]
+    for i, row in enumerate(rows):
+        if row[status_i] is None:
+            rows[i] = row[:status_i] + ('NORMAL',) + row[status_i + 1:]
+
+    now = datetime.datetime.now().isoformat()
+    alerts = []
+    for j, i in enumerate(scored):
+        row = rows[i]
+        if alerted[j]:
+            value = float(row[value_i])
+            alerts.append((
+                row[sensor_i], row[type_i], row[zone_i], value,
+                round(float(expected[j]), 2), round(min(float(z_scores[j]), MAX_Z_SCORE), 2), STATUSES[statuses[j]],
+                alert_text(row[sensor_i], statuses[j], value, float(expected[j]), float(z_scores[j]), row[unit_i]),
+                'SENSOR_ANOMALY', now
+            ))
+    return rows, alerts
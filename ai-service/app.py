@@ -1,131 +1,195 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
-import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_absolute_error
-from geopy.distance import geodesic
-import joblib
 import datetime
-import redis
 import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from analytics import fetch_driver_analytics, parse_driver_id
+from cache import ETACache, LazyRedis, connect_redis
+import db
+import metrics
+from db import db_connection
+from forecasting import FORECAST_GRANULARITIES, DemandForecaster
+from ingest import INGEST_TABLES, BufferFull, Ingestor
+from jobs import TRAINING_MODES, TrainingJobs
+from training import enqueue_completed
+from live import LiveETAHub
+from predictor import ETAPredictor
+from routing import DistanceMatrixCache, plan_route
+from spatial import DriverLocations
+from utils import (
+    calculate_distance, generate_proximity_message, validate_coordinates,
+    format_eta_response, MANILA_LANDMARKS
+)
 
 app = Flask(__name__)
 CORS(app)
 
-# Redis connection
-redis_client = redis.Redis(host=os.getenv('REDIS_HOST', 'localhost'), port=6379, decode_responses=True)
-
-# PostgreSQL connection
-def get_db_connection():
-    return psycopg2.connect(
-        host=os.getenv('DB_HOST', 'localhost'),
-        database=os.getenv('DB_NAME', 'logistics_db'),
-        user=os.getenv('DB_USER', 'postgres'),
-        password=os.getenv('DB_PASSWORD', 'password'),
-        cursor_factory=RealDictCursor
-    )
+# Upper bound on deliveries accepted by /predict_eta/batch
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '10000'))
 
-class ETAPredictor:
-    def __init__(self):
-        self.model = None
-        self.is_trained = False
-        
-    def generate_sample_data(self, n_samples=1000):
-        """Generate sample delivery data for training"""
-        np.random.seed(42)
-        
-        # Manila area coordinates
-        lat_range = (14.5, 14.7)
-        lng_range = (120.9, 121.1)
-        
-        data = []
-        for i in range(n_samples):
-            pickup_lat = np.random.uniform(*lat_range)
-            pickup_lng = np.random.uniform(*lng_range)
-            dropoff_lat = np.random.uniform(*lat_range)
-            dropoff_lng = np.random.uniform(*lng_range)
-            
-            # Calculate distance
-            distance = geodesic((pickup_lat, pickup_lng), (dropoff_lat, dropoff_lng)).km
-            
-            # Generate realistic travel time based on distance and time factors
-            hour = np.random.randint(0, 24)
-            weekday = np.random.randint(0, 7)
-            
-            # Base time per km (with traffic factors)
-            base_time_per_km = 3  # minutes
-            traffic_multiplier = 1.5 if 7 <= hour <= 9 or 17 <= hour <= 19 else 1.0  # Rush hour
-            weekend_multiplier = 0.8 if weekday >= 5 else 1.0
-            
-            travel_time = distance * base_time_per_km * traffic_multiplier * weekend_multiplier
-            travel_time += np.random.normal(0, 2)  # Add noise
-            travel_time = max(travel_time, 1)  # Minimum 1 minute
-            
-            data.append({
-                'order_id': f'ORDER_{i+1:04d}',
-                'pickup_lat': pickup_lat,
-                'pickup_lng': pickup_lng,
-                'dropoff_lat': dropoff_lat,
-                'dropoff_lng': dropoff_lng,
-                'distance_km': distance,
-                'hour': hour,
-                'weekday': weekday,
-                'travel_time_minutes': travel_time
-            })
-        
-        return pd.DataFrame(data)
-    
-    def train_model(self):
-        """Train the ETA prediction model"""
-        # Generate sample data
-        df = self.generate_sample_data()
-        
-        # Features and target
-        X = df[['distance_km', 'hour', 'weekday']]
-        y = df['travel_time_minutes']
-        
-        # Split data
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-        
-        # Train model
-        self.model = RandomForestRegressor(n_estimators=100, random_state=42)
-        self.model.fit(X_train, y_train)
-        
-        # Evaluate
-        predictions = self.model.predict(X_test)
-        mae = mean_absolute_error(y_test, predictions)
-        
-        # Save model
-        joblib.dump(self.model, 'model.pkl')
-        self.is_trained = True
-        
-        return {
-            'mae': mae,
-            'samples_trained': len(df),
-            'test_samples': len(X_test)
-        }
-    
-    def predict_eta(self, current_lat, current_lng, dropoff_lat, dropoff_lng):
-        """Predict ETA for delivery"""
-        if not self.is_trained:
-            return None
-            
-        distance = geodesic((current_lat, current_lng), (dropoff_lat, dropoff_lng)).km
-        hour = datetime.datetime.now().hour
-        weekday = datetime.datetime.now().weekday()
-        
-        features = [[distance, hour, weekday]]
-        eta_minutes = self.model.predict(features)[0]
-        
-        return max(eta_minutes, 1)  # Minimum 1 minute
+# Redis connection, created (and the redis package imported) on first use
+def create_redis_client():
+    return LazyRedis(connect_redis)
+
+redis_client = create_redis_client()
+
+# ETA cache (falls back to an in-process LRU when Redis is unreachable)
+eta_cache = ETACache(redis_client)
 
 # Initialize predictor
-predictor = ETAPredictor()
+predictor = ETAPredictor(redis_client=redis_client)
+
+# Live ETA updates pushed to subscribers of tracked deliveries
+live_hub = LiveETAHub(redis_client)
+
+# Upper bound on one /stream connection; clients reconnect transparently
+LIVE_STREAM_MAX_SECONDS = float(os.getenv('LIVE_ETA_STREAM_MAX_SECONDS', '300'))
+
+# Pairwise stop distances for /predict_route, pre-seeded with the depots
+route_matrix_cache = DistanceMatrixCache()
+route_matrix_cache.warm(MANILA_LANDMARKS.values())
+MAX_ROUTE_STOPS = int(os.getenv('MAX_ROUTE_STOPS', '50'))
+# Upper bound on the dwell time added at each stop
+MAX_ROUTE_SERVICE_MINUTES = float(os.getenv('MAX_ROUTE_SERVICE_MINUTES', '240'))
+
+# Spatial index of live driver positions for /nearest_drivers
+driver_locations = DriverLocations(redis_client)
+
+# Upper bound on k for /nearest_drivers; distance-nearest candidates scored
+# per requested driver when ranking by ETA without a radius
+MAX_NEAREST_DRIVERS = int(os.getenv('MAX_NEAREST_DRIVERS', '100'))
+# Upper bound on radius_km, so a radius query cannot turn into a full-index scan
+MAX_NEAREST_RADIUS_KM = float(os.getenv('MAX_NEAREST_RADIUS_KM', '25'))
+NEAREST_CANDIDATE_FACTOR = 3
+
+# Buffered COPY ingestion of RFID scans and sensor readings
+ingestor = Ingestor()
+
+# Per-product demand forecasters, one per sales granularity, created on first use
+forecasters = {}
+MAX_FORECAST_PRODUCTS = int(os.getenv('MAX_FORECAST_PRODUCTS', '10000'))
+
+def get_forecaster(granularity):
+    forecaster = forecasters.get(granularity)
+    if forecaster is None:
+        forecaster = forecasters.setdefault(granularity, DemandForecaster(db_connection, granularity))
+    return forecaster
+
+# Background training; finished models are swapped into the predictor
+def create_training_jobs():
+    return TrainingJobs(on_finished=lambda results: predictor.load(results['version']))
+
+training_jobs = create_training_jobs()
+
+def load_model():
+    """Load the latest published model, if any"""
+    if predictor.load():
+        print(f"Loaded existing model (version {predictor.version})")
+    else:
+        print("No existing model found. Train model using /train_model endpoint")
+
+def create_app():
+    """
+    Application factory for WSGI servers
+
+    Loads the model once; with gunicorn's preload_app this happens in the
+    master before forking, so workers share the mapped model pages
+    copy-on-write. Per-process clients are re-created in init_worker.
+    """
+    load_model()
+    return app
+
+def init_worker():
+    """Re-create Redis, database and training clients in a freshly forked worker
+
+    Also starts the driver location listener; threads do not survive fork.
+    """
+    global redis_client, training_jobs
+    db.reset_pool()
+    redis_client = create_redis_client()
+    eta_cache.set_redis_client(redis_client)
+    predictor.redis_client = redis_client
+    live_hub.set_redis_client(redis_client)
+    driver_locations.set_redis_client(redis_client)
+    training_jobs = create_training_jobs()
+
+def shutdown():
+    """Release per-process resources on graceful worker exit"""
+    training_jobs.shutdown()
+    driver_locations.stop()
+    ingestor.close()
+    for forecaster in forecasters.values():
+        forecaster.shutdown()
+    redis_client.close()
+    db.close_pool()
+
+metrics.register_counter(
+    'eta_cache_events', 'ETA cache hits, misses, coalesced misses and errors since process start',
+    lambda: {name: value for name, value in eta_cache.stats().items()
+             if name in ('hits', 'misses', 'coalesced', 'errors')},
+    label='event'
+)
+metrics.register_gauge(
+    'eta_db_pool', 'Database pool connections in use and pool bounds',
+    lambda: {name: value for name, value in (db.pool_stats() or {}).items()
+             if name in ('in_use', 'max_in_use', 'max_size')},
+    label='field'
+)
+metrics.register_counter(
+    'eta_db_pool_timeouts', 'Requests that timed out waiting for a pooled connection',
+    lambda: (db.pool_stats() or {}).get('timeouts')
+)
+
+metrics.register_gauge(
+    'ingest_buffered_rows', 'Rows waiting in the ingest buffer per table',
+    lambda: {kind: writer.stats()['buffered_rows'] for kind, writer in ingestor.writers.items()},
+    label='kind'
+)
+metrics.register_counter(
+    'ingest_rows_written', 'Rows written by COPY since process start per table',
+    lambda: {kind: writer.stats()['rows_written'] for kind, writer in ingestor.writers.items()},
+    label='kind'
+)
+metrics.register_counter(
+    'ingest_rows_rejected', 'Rows rejected because the ingest buffer was full per table',
+    lambda: {kind: writer.stats()['rows_rejected'] for kind, writer in ingestor.writers.items()},
+    label='kind'
+)
+metrics.register_counter(
+    'ingest_flush_failures', 'Failed COPY flushes per table; their rows are requeued',
+    lambda: {kind: writer.stats()['flush_failures'] for kind, writer in ingestor.writers.items()},
+    label='kind'
+)
+metrics.register_counter(
+    'sensor_alerts_dropped', 'Sensor alert rows dropped because the alert buffer was full',
+    lambda: ingestor.stats()['alerts_dropped']
+)
+
+metrics.register_counter(
+    'sensor_anomaly_events', 'Sensor readings scored, anomalies and alerts raised since process start',
+    lambda: {name: value for name, value in ingestor.detector.stats().items()
+             if name in ('readings', 'warnings', 'criticals', 'alerts')},
+    label='event'
+)
+metrics.register_gauge(
+    'sensor_anomaly_sensors', 'Sensors tracked by the anomaly detector',
+    lambda: ingestor.detector.stats()['sensors']
+)
+
+@app.before_request
+def start_request_timer():
+    g.metrics_token = metrics.start_request(request.endpoint)
+
+@app.after_request
+def record_request_latency(response):
+    metrics.finish_request(g.pop('metrics_token', None), request.method, response.status_code)
+    return response
+
+@app.before_request
+def reload_model():
+    """Pick up models published by training workers"""
+    predictor.maybe_reload()
 
 @app.route('/')
 def index():
@@ -141,8 +205,26 @@ def index():
         <p>Use the API endpoints:</p>
         <ul>
             <li>POST /predict_eta - Predict delivery time</li>
-            <li>POST /train_model - Train the model</li>
+            <li>POST /predict_eta/batch - Predict delivery times for many orders</li>
+            <li>POST /train_model - Start a training job (mode: full or incremental)</li>
+            <li>POST /deliveries/completed - Queue completed deliveries for incremental updates</li>
+            <li>GET /train_model/&lt;job_id&gt; - Training job status</li>
+            <li>POST /driver_analytics - Driver performance analytics</li>
+            <li>POST /driver_analytics/bulk - Analytics for many drivers</li>
             <li>GET /health - Health status</li>
+            <li>GET /cache_stats - ETA cache statistics</li>
+            <li>GET /db_pool_stats - Database pool statistics</li>
+            <li>GET /metrics - Prometheus latency metrics</li>
+            <li>POST /deliveries/&lt;id&gt;/location - Driver location ping</li>
+            <li>GET /deliveries/&lt;id&gt;/stream - Live ETA updates (Server-Sent Events)</li>
+            <li>GET /live_stats - Live tracking statistics</li>
+            <li>POST /drivers/&lt;id&gt;/location - Driver position update</li>
+            <li>POST /nearest_drivers - Drivers near a pickup ranked by ETA</li>
+            <li>POST /predict_route - Ordered multi-stop route with cumulative ETAs</li>
+            <li>POST /ingest/rfid, /ingest/sensor - Bulk NDJSON ingestion</li>
+            <li>GET /ingest_stats - Ingestion throughput and flush latency</li>
+            <li>GET /sensors/&lt;id&gt;/state - Rolling sensor statistics and status</li>
+            <li>POST /forecast_demand/bulk - Demand forecasts and reorder points</li>
         </ul>
     </body>
     </html>
@@ -151,26 +233,79 @@ def index():
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'model_trained': predictor.is_trained})
+    return jsonify({
+        'status': 'healthy',
+        'model_trained': predictor.is_trained,
+        'model_version': predictor.version,
+        'model_mae': predictor.metadata.get('mae'),
+        'prediction_mode': predictor.prediction_mode,
+        'model_drift_ratio': predictor.metadata.get('drift_ratio'),
+        'lookup_max_error': predictor.metadata.get('lookup_max_error'),
+        'metrics_enabled': metrics.METRICS_ENABLED
+    })
 
 @app.route('/train_model', methods=['POST'])
 def train_model():
-    """Train the ETA prediction model"""
+    """Start a background job that trains a new ETA model version"""
     try:
-        results = predictor.train_model()
+        data = request.get_json(silent=True) or {}
+        mode = data.get('mode', 'full')
+        if mode not in TRAINING_MODES:
+            return jsonify({'success': False, 'error': f"mode must be one of {', '.join(TRAINING_MODES)}"}), 400
+        job_id = training_jobs.submit(
+            sources=data.get('sources'),
+            max_rows=data.get('max_rows'),
+            mode=mode
+        )
         return jsonify({
             'success': True,
-            'message': 'Model trained successfully',
-            'results': results
-        })
+            'message': 'Training job started',
+            'job_id': job_id,
+            'status_url': f'/train_model/{job_id}'
+        }), 202
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/train_model/<job_id>', methods=['GET'])
+def train_model_status(job_id):
+    """Report the status of a training job"""
+    try:
+        status = training_jobs.status(job_id)
+        if status is None:
+            return jsonify({'error': 'Unknown job id'}), 404
+        status['serving_version'] = predictor.version
+        return jsonify(status)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def compute_eta_response(current_lat, current_lng, dropoff_lat, dropoff_lng, hour, weekday):
+    """
+    Distance, model ETA and proximity message for one route
+
+    This is the value cached per route; eta_response adds the request's
+    timestamp, so a cache hit does not replay the first caller's.
+    """
+    with metrics.span('distance'):
+        distance = calculate_distance(current_lat, current_lng, dropoff_lat, dropoff_lng)
+    eta = predictor.predict_eta(
+        current_lat, current_lng, dropoff_lat, dropoff_lng,
+        distance=distance, hour=hour, weekday=weekday
+    )
+
+    # Generate proximity-based message
+    message = generate_proximity_message(distance, eta)
+
+    return {'eta_minutes': eta, 'distance_km': distance, 'message': message}
+
+def eta_response(value, now):
+    """Response body for a computed or cached ETA value"""
+    return format_eta_response(value['eta_minutes'], value['distance_km'], value['message'], now.isoformat())
+
 @app.route('/predict_eta', methods=['POST'])
 def predict_eta():
     """Predict ETA for delivery"""
     try:
-        data = request.json
+        data = request.json or {}
         
         if not predictor.is_trained:
             return jsonify({'error': 'Model not trained yet. Call /train_model first.'}), 400
@@ -178,46 +313,435 @@ def predict_eta():
         required_fields = ['current_lat', 'current_lng', 'dropoff_lat', 'dropoff_lng']
         if not all(field in data for field in required_fields):
             return jsonify({'error': 'Missing required fields'}), 400
+        for lat_field, lng_field in (('current_lat', 'current_lng'), ('dropoff_lat', 'dropoff_lng')):
+            is_valid, error = validate_coordinates(data[lat_field], data[lng_field])
+            if not is_valid:
+                return jsonify({'error': error}), 400
         
-        eta = predictor.predict_eta(
-            data['current_lat'],
-            data['current_lng'],
-            data['dropoff_lat'],
-            data['dropoff_lng']
+        now = datetime.datetime.now()
+        hour, weekday = now.hour, now.weekday()
+        cache_key = eta_cache.make_key(
+            data['current_lat'], data['current_lng'],
+            data['dropoff_lat'], data['dropoff_lng'],
+            hour, weekday, predictor.version
         )
+
+        compute = lambda: compute_eta_response(
+            data['current_lat'], data['current_lng'],
+            data['dropoff_lat'], data['dropoff_lng'],
+            hour, weekday
+        )
+
+        # Read-through cache: a hit returns before any distance or model work
+        cache_data, _ = eta_cache.get_or_compute(cache_key, compute)
         
-        # Generate proximity-based message
-        distance = geodesic(
-            (data['current_lat'], data['current_lng']), 
-            (data['dropoff_lat'], data['dropoff_lng'])
-        ).km
-        
-        if distance < 0.5:  # Less than 500m
-            message = "Delivery arriving very soon!"
-        elif distance < 2:  # Less than 2km
-            message = "Delivery nearby, preparing for arrival"
-        elif eta < 5:
-            message = "Arriving soon!"
-        elif eta < 15:
-            message = "On the way - arriving shortly"
-        else:
-            message = "Delivery in progress"
-        
-        # Cache result in Redis
-        cache_key = f"eta:{data['current_lat']}:{data['current_lng']}:{data['dropoff_lat']}:{data['dropoff_lng']}"
-        cache_data = {
-            'eta_minutes': round(eta, 2),
-            'message': message,
-            'distance_km': round(distance, 2),
-            'timestamp': datetime.datetime.now().isoformat()
-        }
-        redis_client.setex(cache_key, 300, json.dumps(cache_data))  # Cache for 5 minutes
-        
-        return jsonify(cache_data)
+        return jsonify(eta_response(cache_data, now))
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """ETA cache hit/miss/latency counters"""
+    return jsonify(eta_cache.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Latency histograms and counters in Prometheus text format"""
+    if not metrics.METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled (METRICS_ENABLED=0)'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/db_pool_stats', methods=['GET'])
+def db_pool_stats():
+    """Database connection pool utilization and wait times"""
+    return jsonify(db.pool_stats() or {'status': 'pool not initialized'})
+
+@app.route('/predict_eta/batch', methods=['POST'])
+def predict_eta_batch():
+    """Predict ETAs for many deliveries in one request"""
+    try:
+        data = request.json or {}
+
+        if not predictor.is_trained:
+            return jsonify({'error': 'Model not trained yet. Call /train_model first.'}), 400
+
+        deliveries = data.get('deliveries')
+        if not isinstance(deliveries, list):
+            return jsonify({'error': 'deliveries must be a list'}), 400
+        if len(deliveries) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'Batch size exceeds limit of {MAX_BATCH_SIZE}'}), 400
+
+        # Validate each item; invalid ones are reported back instead of failing the batch
+        required_fields = ['current_lat', 'current_lng', 'dropoff_lat', 'dropoff_lng']
+        results = [None] * len(deliveries)
+        valid_indices = []
+        coords = []
+        for i, item in enumerate(deliveries):
+            if not isinstance(item, dict) or not all(field in item for field in required_fields):
+                results[i] = {'index': i, 'error': 'Missing required fields'}
+                continue
+
+            error = None
+            for lat_field, lng_field in (('current_lat', 'current_lng'), ('dropoff_lat', 'dropoff_lng')):
+                is_valid, error = validate_coordinates(item[lat_field], item[lng_field])
+                if not is_valid:
+                    break
+            if error:
+                results[i] = {'index': i, 'error': error}
+                continue
+
+            valid_indices.append(i)
+            coords.append([float(item[field]) for field in required_fields])
+
+        if coords:
+            coords = np.asarray(coords)
+            etas, distances = predictor.predict_eta_batch(
+                coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3]
+            )
+            timestamp = datetime.datetime.now().isoformat()
+            for i, eta, distance in zip(valid_indices, etas, distances):
+                result = format_eta_response(
+                    eta, distance, generate_proximity_message(distance, eta), timestamp
+                )
+                result['index'] = i
+                results[i] = result
+
+        return jsonify({
+            'results': results,
+            'count': len(results),
+            'errors': len(results) - len(valid_indices)
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/deliveries/completed', methods=['POST'])
+def deliveries_completed():
+    """Queue completed deliveries for the next incremental model update"""
+    try:
+        from redis.exceptions import RedisError
+
+        data = request.json or {}
+        deliveries = data.get('deliveries')
+        if not isinstance(deliveries, list) or not deliveries:
+            return jsonify({'error': 'deliveries must be a non-empty list'}), 400
+        if len(deliveries) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'Batch size exceeds limit of {MAX_BATCH_SIZE}'}), 400
+
+        coordinate_fields = ['pickup_lat', 'pickup_lng', 'dropoff_lat', 'dropoff_lng']
+        for i, item in enumerate(deliveries):
+            if not isinstance(item, dict) or not all(field in item for field in coordinate_fields + ['pickup_time']):
+                return jsonify({'error': f'Delivery {i} needs coordinates and pickup_time'}), 400
+            if 'dropoff_time' not in item and 'travel_time_minutes' not in item:
+                return jsonify({'error': f'Delivery {i} needs dropoff_time or travel_time_minutes'}), 400
+
+        try:
+            queued = enqueue_completed(redis_client, deliveries)
+        except RedisError:
+            return jsonify({'error': 'Update queue unavailable (Redis unreachable)'}), 503
+        return jsonify({'queued': len(deliveries), 'queue_length': queued})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/deliveries/<delivery_id>/location', methods=['POST'])
+def delivery_location(delivery_id):
+    """Driver location ping; recomputes and pushes the ETA only when it can have changed"""
+    try:
+        data = request.json or {}
+
+        if not predictor.is_trained:
+            return jsonify({'error': 'Model not trained yet. Call /train_model first.'}), 400
+        if len(delivery_id) > 64:
+            return jsonify({'error': 'delivery_id too long'}), 400
+        if 'current_lat' not in data or 'current_lng' not in data:
+            return jsonify({'error': 'current_lat and current_lng required'}), 400
+
+        is_valid, error = validate_coordinates(data['current_lat'], data['current_lng'])
+        if not is_valid:
+            return jsonify({'error': error}), 400
+        dropoff = None
+        if 'dropoff_lat' in data or 'dropoff_lng' in data:
+            is_valid, error = validate_coordinates(data.get('dropoff_lat'), data.get('dropoff_lng'))
+            if not is_valid:
+                return jsonify({'error': error}), 400
+            dropoff = (data['dropoff_lat'], data['dropoff_lng'])
+
+        if data.get('driver_id') is not None:
+            driver_locations.update(str(data['driver_id']), float(data['current_lat']), float(data['current_lng']))
+
+        now = datetime.datetime.now()
+        version = predictor.version
+
+        def compute(lat, lng, dropoff_lat, dropoff_lng, hour, weekday):
+            cache_key = eta_cache.make_key(lat, lng, dropoff_lat, dropoff_lng, hour, weekday, version)
+            value, _ = eta_cache.get_or_compute(cache_key, lambda: compute_eta_response(
+                lat, lng, dropoff_lat, dropoff_lng, hour, weekday
+            ))
+            return eta_response(value, now)
+
+        update, recomputed = live_hub.ping(
+            delivery_id, float(data['current_lat']), float(data['current_lng']), dropoff,
+            now, version, lambda a, b: calculate_distance(a[0], a[1], b[0], b[1]), compute
+        )
+        return jsonify({'recomputed': recomputed, 'eta': update})
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/deliveries/<delivery_id>/stream', methods=['GET'])
+def delivery_stream(delivery_id):
+    """Server-Sent Events stream of ETA updates for a delivery"""
+    # Each stream holds a worker thread; refuse beyond the per-worker cap so
+    # the other routes keep threads to run on
+    if not live_hub.open_stream():
+        response = jsonify({'error': 'Too many live streams on this worker, retry shortly'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    def events():
+        # Reconnect quickly after the server closes the stream
+        yield 'retry: 2000\n\n'
+        latest = live_hub.latest(delivery_id)
+        if latest is not None:
+            yield f'event: eta\ndata: {json.dumps(latest)}\n\n'
+        for event, data in live_hub.subscribe(delivery_id, LIVE_STREAM_MAX_SECONDS):
+            if event is None:
+                yield ': keepalive\n\n'
+            else:
+                yield f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs when the server closes the response, even if the stream never started
+    response.call_on_close(live_hub.close_stream)
+    return response
+
+@app.route('/live_stats', methods=['GET'])
+def live_stats():
+    """Live tracking ping, recompute and fan-out counters"""
+    stats = live_hub.stats()
+    stats['driver_index'] = driver_locations.stats()
+    stats['route_matrix_cache'] = route_matrix_cache.stats()
+    return jsonify(stats)
+
+@app.route('/drivers/<driver_id>/location', methods=['POST', 'DELETE'])
+def driver_location(driver_id):
+    """Upsert a driver's live position, or DELETE to take the driver off the index"""
+    try:
+        if request.method == 'DELETE':
+            return jsonify({'driver_id': driver_id, 'removed': driver_locations.remove(driver_id)})
+
+        data = request.json or {}
+        if 'lat' not in data or 'lng' not in data:
+            return jsonify({'error': 'lat and lng required'}), 400
+        is_valid, error = validate_coordinates(data['lat'], data['lng'])
+        if not is_valid:
+            return jsonify({'error': error}), 400
+
+        driver_locations.update(driver_id, float(data['lat']), float(data['lng']))
+        return jsonify({'driver_id': driver_id, 'updated': True})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/nearest_drivers', methods=['POST'])
+def nearest_drivers():
+    """Drivers near a pickup, ranked by predicted ETA to it"""
+    try:
+        data = request.json or {}
+
+        if not predictor.is_trained:
+            return jsonify({'error': 'Model not trained yet. Call /train_model first.'}), 400
+        if 'pickup_lat' not in data or 'pickup_lng' not in data:
+            return jsonify({'error': 'pickup_lat and pickup_lng required'}), 400
+        is_valid, error = validate_coordinates(data['pickup_lat'], data['pickup_lng'])
+        if not is_valid:
+            return jsonify({'error': error}), 400
+
+        pickup_lat, pickup_lng = float(data['pickup_lat']), float(data['pickup_lng'])
+        try:
+            k = int(data.get('k', 10))
+        except (TypeError, ValueError, OverflowError):
+            k = None
+        if k is None or not 1 <= k <= MAX_NEAREST_DRIVERS:
+            return jsonify({'error': f'k must be an integer between 1 and {MAX_NEAREST_DRIVERS}'}), 400
+        radius_km = data.get('radius_km')
+        if radius_km is not None:
+            try:
+                radius_km = float(radius_km)
+            except (TypeError, ValueError):
+                radius_km = float('nan')
+            # NaN fails both comparisons
+            if not 0 < radius_km <= MAX_NEAREST_RADIUS_KM:
+                return jsonify({'error': f'radius_km must be a number greater than 0 and at most {MAX_NEAREST_RADIUS_KM:g}'}), 400
+
+        with metrics.span('spatial_query'):
+            if radius_km is not None:
+                # Every driver inside the radius competes on ETA
+                candidates = driver_locations.index.within(pickup_lat, pickup_lng, radius_km)
+            else:
+                candidates = driver_locations.index.nearest(
+                    pickup_lat, pickup_lng, k * NEAREST_CANDIDATE_FACTOR
+                )
+        driver_ids, lats, lngs, distances = candidates
+
+        drivers = []
+        if driver_ids:
+            etas, _ = predictor.predict_eta_batch(
+                lats, lngs, np.full(len(lats), pickup_lat), np.full(len(lngs), pickup_lng),
+                distances=distances
+            )
+            for i in np.argsort(etas, kind='stable')[:k]:
+                drivers.append({
+                    'driver_id': driver_ids[i],
+                    'lat': float(lats[i]),
+                    'lng': float(lngs[i]),
+                    'distance_km': round(float(distances[i]), 3),
+                    'eta_minutes': round(float(etas[i]), 2)
+                })
+
+        return jsonify({'drivers': drivers, 'candidates': len(driver_ids)})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/predict_route', methods=['POST'])
+def predict_route():
+    """Order a multi-stop run and predict cumulative ETAs for every stop"""
+    try:
+        data = request.json or {}
+
+        if not predictor.is_trained:
+            return jsonify({'error': 'Model not trained yet. Call /train_model first.'}), 400
+
+        start = data.get('start')
+        stops = data.get('stops')
+        if not isinstance(start, dict) or not isinstance(stops, list) or not stops:
+            return jsonify({'error': 'start and a non-empty stops list required'}), 400
+        if len(stops) > MAX_ROUTE_STOPS:
+            return jsonify({'error': f'At most {MAX_ROUTE_STOPS} stops per route'}), 400
+
+        points = []
+        for i, point in enumerate([start] + stops):
+            if not isinstance(point, dict) or 'lat' not in point or 'lng' not in point:
+                return jsonify({'error': f'Point {i} needs lat and lng'}), 400
+            is_valid, error = validate_coordinates(point['lat'], point['lng'])
+            if not is_valid:
+                return jsonify({'error': f'Point {i}: {error}'}), 400
+            points.append((float(point['lat']), float(point['lng'])))
+
+        optimize = data.get('optimize', True)
+        if not isinstance(optimize, bool):
+            return jsonify({'error': 'optimize must be true or false'}), 400
+        service_minutes = data.get('service_minutes', 0)
+        try:
+            # Booleans are ints to Python but not valid durations
+            service_minutes = float('nan') if isinstance(service_minutes, bool) else float(service_minutes)
+        except (TypeError, ValueError):
+            service_minutes = float('nan')
+        # NaN fails both comparisons
+        if not 0 <= service_minutes <= MAX_ROUTE_SERVICE_MINUTES:
+            return jsonify({'error': f'service_minutes must be a number between 0 and {MAX_ROUTE_SERVICE_MINUTES:g}'}), 400
+
+        route = plan_route(
+            predictor, points[0], points[1:], route_matrix_cache,
+            optimize=optimize, service_minutes=service_minutes
+        )
+        for leg in route['legs']:
+            stop = stops[leg['stop_index']]
+            if 'id' in stop:
+                leg['stop_id'] = stop['id']
+            leg['message'] = generate_proximity_message(leg['leg_distance_km'], leg['leg_eta_minutes'])
+        route['model_version'] = predictor.version
+        return jsonify(route)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/ingest/<kind>', methods=['POST'])
+def ingest(kind):
+    """Buffer a newline-delimited JSON batch of RFID scans or sensor readings"""
+    try:
+        if kind not in INGEST_TABLES:
+            return jsonify({'error': f'Unknown ingest kind; use one of {", ".join(INGEST_TABLES)}'}), 404
+        try:
+            queued = ingestor.submit(kind, request.get_data(cache=False))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except BufferFull as e:
+            response = jsonify({'error': str(e)})
+            response.headers['Retry-After'] = '1'
+            return response, 429
+        return jsonify({'queued': queued, 'table': INGEST_TABLES[kind][0]}), 202
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/ingest_stats', methods=['GET'])
+def ingest_stats():
+    """Ingest buffer, throughput and COPY flush latency per table"""
+    return jsonify(ingestor.stats())
+
+@app.route('/forecast_demand/bulk', methods=['POST'])
+def forecast_demand_bulk():
+    """Demand forecasts and reorder points for many products"""
+    try:
+        data = request.json or {}
+        product_ids = data.get('product_ids')
+        if not isinstance(product_ids, list) or not product_ids:
+            return jsonify({'error': 'product_ids must be a non-empty list'}), 400
+        if len(product_ids) > MAX_FORECAST_PRODUCTS:
+            return jsonify({'error': f'At most {MAX_FORECAST_PRODUCTS} products per request'}), 400
+
+        granularity = data.get('granularity', 'week')
+        if granularity not in FORECAST_GRANULARITIES:
+            return jsonify({'error': f"granularity must be one of {', '.join(FORECAST_GRANULARITIES)}"}), 400
+        try:
+            horizon = int(data.get('horizon', 4))
+            lead_time = int(data.get('lead_time', 2))
+        except (TypeError, ValueError, OverflowError):
+            horizon = lead_time = None
+        if horizon is None or not 1 <= horizon <= 52 or not 1 <= lead_time <= 52:
+            return jsonify({'error': 'horizon and lead_time must be integers between 1 and 52 periods'}), 400
+        try:
+            service_level = float(data.get('service_level', 0.95))
+        except (TypeError, ValueError):
+            service_level = float('nan')
+        # NaN fails both comparisons
+        if not 0.5 <= service_level < 1:
+            return jsonify({'error': 'service_level must be a number in [0.5, 1)'}), 400
+
+        # Served from the saved models; refitting runs as a background job
+        forecaster = get_forecaster(granularity)
+        refresh = forecaster.schedule_refresh(training_jobs, force=bool(data.get('refresh', False)))
+        forecasts, missing = forecaster.forecast(
+            [str(product_id) for product_id in product_ids],
+            horizon=horizon, lead_time=lead_time, service_level=service_level
+        )
+        return jsonify({
+            'granularity': granularity,
+            'forecasts': forecasts,
+            'missing': missing,
+            'refresh': refresh
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/sensors/<sensor_id>/state', methods=['GET'])
+def sensor_state(sensor_id):
+    """Rolling statistics the anomaly detector keeps for a sensor"""
+    state = ingestor.detector.state(sensor_id, request.args.get('zone'))
+    if state is None:
+        return jsonify({'error': 'No readings for this sensor and zone in this worker'}), 404
+    return jsonify(state)
+
 @app.route('/driver_analytics', methods=['POST'])
 def driver_analytics():
     """Analyze driver performance for profiling"""
@@ -227,32 +751,55 @@ def driver_analytics():
         
         if not driver_id:
             return jsonify({'error': 'driver_id required'}), 400
+        driver_id = parse_driver_id(driver_id)
+        if driver_id is None:
+            return jsonify({'error': 'driver_id must be a positive integer'}), 400
+        
+        with db_connection() as conn:
+            analytics = fetch_driver_analytics(conn, [driver_id])
         
-        # This would normally pull from database
-        # For now, generate sample analytics
-        analytics = {
-            'driver_id': driver_id,
-            'avg_delivery_time': np.random.uniform(15, 45),
-            'completion_rate': np.random.uniform(0.8, 0.99),
-            'customer_rating': np.random.uniform(3.5, 5.0),
-            'total_deliveries': np.random.randint(50, 500),
-            'violations_count': np.random.randint(0, 5),
-            'last_drug_test': 'negative',
-            'credential_status': 'valid'
-        }
+        if driver_id not in analytics:
+            return jsonify({'error': 'No deliveries recorded for driver'}), 404
         
-        return jsonify(analytics)
+        return jsonify(analytics[driver_id])
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-if __name__ == '__main__':
-    # Try to load existing model
+@app.route('/driver_analytics/bulk', methods=['POST'])
+def driver_analytics_bulk():
+    """Analytics for many drivers in one query"""
     try:
-        predictor.model = joblib.load('model.pkl')
-        predictor.is_trained = True
-        print("Loaded existing model")
-    except FileNotFoundError:
-        print("No existing model found. Train model using /train_model endpoint")
+        data = request.json or {}
+        driver_ids = data.get('driver_ids')
+        
+        if not isinstance(driver_ids, list) or not driver_ids:
+            return jsonify({'error': 'driver_ids must be a non-empty list'}), 400
+        if len(driver_ids) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'Batch size exceeds limit of {MAX_BATCH_SIZE}'}), 400
+        
+        parsed = [parse_driver_id(driver_id) for driver_id in driver_ids]
+        invalid = [driver_id for driver_id, parsed_id in zip(driver_ids, parsed) if parsed_id is None]
+        valid = sorted({parsed_id for parsed_id in parsed if parsed_id is not None})
+        
+        analytics = {}
+        if valid:
+            with db_connection() as conn:
+                analytics = fetch_driver_analytics(conn, valid)
+        
+        return jsonify({
+            'drivers': [analytics[driver_id] for driver_id in valid if driver_id in analytics],
+            'missing': [driver_id for driver_id in valid if driver_id not in analytics],
+            'invalid': invalid
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+if __name__ == '__main__':
+    # Development server; production runs `gunicorn -c gunicorn.conf.py wsgi:app`
+    load_model()
+    driver_locations.start()
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '5000')),
+            debug=os.getenv('FLASK_DEBUG', '1') == '1')
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the ETA service hot paths
+
+    python benchmark.py                         # full run, JSON to stdout
+    python benchmark.py --quick -o run.json     # smaller sizes, write a file
+    python benchmark.py --baseline main.json --threshold 0.2
+    python benchmark.py --startup               # cold-start metrics only
+
+Measures distance throughput, synthetic data generation, training wall time
+and peak memory, single and batched prediction latency percentiles, bulk
+ingestion throughput, and end-to-end HTTP throughput through the Flask test client. Redis and
+Postgres are replaced with in-memory fakes, so no services are needed.
+
+Cold start is measured in fresh interpreters: the time to `import app`, the
+time to the first /health response through the test client, and (when
+gunicorn is installed) the time from launching gunicorn to the first /health
+answered over HTTP. The results also carry the slowest imports reported by
+`python -X importtime -c "import app"`.
+
+With --baseline, every metric is compared against the same metric of a
+previous run and the process exits with status 1 if any degraded by more
+than --threshold (a fraction, default 0.2).
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Run in a fresh interpreter; prints seconds to import app and to the first /health
+_STARTUP_PROBE = """
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app().test_client().get('/health')
+print(imported - start, time.perf_counter() - start, flush=True)
+"""
+
+class FakeRedis:
+    """The subset of redis.Redis used by ETACache and the app, backed by a dict"""
+
+    def __init__(self):
+        self._data = {}
+
+    def ping(self):
+        return True
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def setex(self, key, ttl, value):
+        self._data[key] = (time.monotonic() + ttl, value)
+
+    def close(self):
+        pass
+
+class FakeCursor:
+    """Answers the driver analytics query from a dict of driver_delivery_stats rows"""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        driver_ids = params[0] if params else []
+        self._result = [self._rows[driver_id] for driver_id in driver_ids if driver_id in self._rows]
+
+    def fetchall(self):
+        return self._result
+
+    def copy_expert(self, sql, file):
+        # Consume the stream so COPY encoding cost is included
+        file.read()
+
+class FakeConnection:
+    closed = 0
+
+    def __init__(self, rows):
+        self._rows = rows
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self._rows)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+class FakePool:
+    """Stands in for db.ConnectionPool so db_connection() hands out fake connections"""
+
+    def __init__(self, n_drivers=1000, seed=0):
+        rng = np.random.default_rng(seed)
+        self.pid = os.getpid()
+        self.rows = {}
+        for driver_id in range(1, n_drivers + 1):
+            completed = int(rng.integers(10, 500))
+            timed = completed - int(rng.integers(0, 5))
+            self.rows[driver_id] = {
+                'driver_id': driver_id,
+                'total_deliveries': completed + int(rng.integers(0, 20)),
+                'completed_deliveries': completed,
+                'cancelled_deliveries': int(rng.integers(0, 10)),
+                'timed_deliveries': timed,
+                'on_time_deliveries': int(timed * rng.uniform(0.6, 1.0)),
+                'sum_actual_time': int(timed * rng.uniform(15, 45)),
+                'sum_distance_km': float(completed * rng.uniform(3, 12)),
+                'last_completed_at': datetime.datetime(2024, 1, 1)
+            }
+
+    def getconn(self):
+        return FakeConnection(self.rows)
+
+    def putconn(self, conn, close=False):
+        pass
+
+    def closeall(self):
+        pass
+
+    def stats(self):
+        return {}
+
+def _percentiles(samples_s):
+    samples_ms = np.asarray(samples_s) * 1000
+    return {
+        'p50_ms': float(np.percentile(samples_ms, 50)),
+        'p95_ms': float(np.percentile(samples_ms, 95)),
+        'p99_ms': float(np.percentile(samples_ms, 99))
+    }
+
+def _time_calls(fn, n):
+    timings = np.empty(n)
+    for i in range(n):
+        start = time.perf_counter()
+        fn(i)
+        timings[i] = time.perf_counter() - start
+    return timings
+
+def _random_coords(n, seed=0):
+    from utils import MANILA_LAT_RANGE, MANILA_LNG_RANGE
+
+    rng = np.random.default_rng(seed)
+    return np.column_stack([
+        rng.uniform(*MANILA_LAT_RANGE, n), rng.uniform(*MANILA_LNG_RANGE, n),
+        rng.uniform(*MANILA_LAT_RANGE, n), rng.uniform(*MANILA_LNG_RANGE, n)
+    ])
+
+def bench_distance(results, quick):
+    from utils import calculate_distance, calculate_distances
+
+    n_scalar = 20_000 if quick else 100_000
+    coords = _random_coords(n_scalar)
+    rows = coords.tolist()
+    start = time.perf_counter()
+    for lat1, lng1, lat2, lng2 in rows:
+        calculate_distance(lat1, lng1, lat2, lng2)
+    results['distance_scalar_calls_per_s'] = (n_scalar / (time.perf_counter() - start), 'higher')
+
+    n_vector = 1_000_000
+    coords = _random_coords(n_vector)
+    start = time.perf_counter()
+    calculate_distances(coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3])
+    results['distance_vectorized_rows_per_s'] = (n_vector / (time.perf_counter() - start), 'higher')
+
+def bench_sample_data(results, quick):
+    from predictor import ETAPredictor
+
+    predictor = ETAPredictor()
+    sizes = (1_000, 100_000) if quick else (1_000, 100_000, 1_000_000)
+    for n in sizes:
+        start = time.perf_counter()
+        predictor.generate_sample_data(n)
+        results[f'sample_data_{n}_rows_per_s'] = (n / (time.perf_counter() - start), 'higher')
+
+def _train_child(conn, model_dir, samples):
+    os.environ['TRAINING_SYNTHETIC_SAMPLES'] = str(samples)
+    from predictor import ETAPredictor
+
+    rss_start_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    ETAPredictor(model_dir=model_dir).train_model(sources=['synthetic'])
+    wall = time.perf_counter() - start
+    conn.send((wall, rss_start_kb, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+    conn.close()
+
+def bench_training(results, quick, model_dir):
+    """Train in a forked child so its peak RSS is not masked by earlier benchmarks"""
+    samples = 2_000 if quick else 20_000
+    ctx = multiprocessing.get_context('fork')
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_train_child, args=(child_conn, model_dir, samples))
+    process.start()
+    wall, rss_start_kb, rss_peak_kb = parent_conn.recv()
+    process.join()
+    results[f'train_{samples}_wall_s'] = (wall, 'lower')
+    results[f'train_{samples}_peak_rss_growth_mb'] = ((rss_peak_kb - rss_start_kb) / 1024, 'lower')
+
+def bench_predict(results, quick, predictor):
+    n = 2_000 if quick else 10_000
+    coords = _random_coords(n, seed=1)
+    rows = coords.tolist()
+
+    timings = _time_calls(lambda i: predictor.predict_eta(*rows[i], hour=8, weekday=1), n)
+    for name, value in _percentiles(timings).items():
+        results[f'predict_single_{name}'] = (value, 'lower')
+
+    batch_size = 1_000
+    n_batches = 20 if quick else 100
+    batch = coords[:batch_size]
+    timings = _time_calls(
+        lambda i: predictor.predict_eta_batch(batch[:, 0], batch[:, 1], batch[:, 2], batch[:, 3]),
+        n_batches
+    )
+    for name, value in _percentiles(timings).items():
+        results[f'predict_batch_{batch_size}_{name}'] = (value, 'lower')
+
+def bench_ingest(results, quick, app_module):
+    """NDJSON parse, buffer and COPY encoding throughput for RFID scans"""
+    from ingest import BulkWriter, INGEST_TABLES
+
+    n_batches = 20 if quick else 100
+    batch_size = 1_000
+    body = '\n'.join(
+        json.dumps({'product_id': f'PROD{i % 500:03d}', 'rfid_tag': f'RFID{i}', 'zone': 'Zone A',
+                    'action': 'SCAN', 'device_id': 'READER001'})
+        for i in range(batch_size)
+    )
+    table, columns, _ = INGEST_TABLES['rfid']
+    writer = BulkWriter(table, columns, batch_rows=5_000, flush_interval=0.05,
+                        max_buffer_rows=n_batches * batch_size, block_timeout=5)
+    ingestor = app_module.ingestor
+    start = time.perf_counter()
+    for _ in range(n_batches):
+        writer.submit(ingestor.parse('rfid', body))
+    writer.close(timeout=30)
+    stats = writer.stats()
+    if stats['rows_written'] != n_batches * batch_size:
+        raise RuntimeError(f"ingest wrote {stats['rows_written']} of {n_batches * batch_size} rows")
+    results['ingest_rfid_rows_per_s'] = (stats['rows_written'] / (time.perf_counter() - start), 'higher')
+    results['ingest_flush_avg_ms'] = (stats['avg_flush_ms'], 'lower')
+
+def _throughput(client, method, path, payloads, duration):
+    """Requests per second for payloads cycled over duration seconds"""
+    count = errors = 0
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        response = client.open(path, method=method, json=payloads[count % len(payloads)])
+        errors += response.status_code >= 400
+        count += 1
+    if errors:
+        raise RuntimeError(f'{errors} of {count} requests to {path} failed')
+    return count / (time.perf_counter() - start)
+
+def bench_http(results, quick, app_module):
+    client = app_module.app.test_client()
+    duration = 1.0 if quick else 3.0
+    fields = ('current_lat', 'current_lng', 'dropoff_lat', 'dropoff_lng')
+    # Enough distinct routes that every request in the run misses the cache
+    single = [dict(zip(fields, c)) for c in _random_coords(50_000, seed=2).tolist()]
+
+    results['http_health_req_per_s'] = (_throughput(client, 'GET', '/health', [None], duration), 'higher')
+    results['http_predict_eta_miss_req_per_s'] = (
+        _throughput(client, 'POST', '/predict_eta', single, duration), 'higher'
+    )
+    results['http_predict_eta_hit_req_per_s'] = (
+        _throughput(client, 'POST', '/predict_eta', single[:1], duration), 'higher'
+    )
+    results['http_predict_eta_batch_100_req_per_s'] = (
+        _throughput(client, 'POST', '/predict_eta/batch', [{'deliveries': single[:100]}], duration),
+        'higher'
+    )
+    results['http_driver_analytics_bulk_100_req_per_s'] = (
+        _throughput(client, 'POST', '/driver_analytics/bulk',
+                    [{'driver_ids': list(range(1, 101))}], duration),
+        'higher'
+    )
+
+def import_profile(top=10):
+    """The slowest direct imports of app by cumulative time, from python -X importtime"""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=SERVICE_DIR, capture_output=True, text=True, check=True
+    )
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        # Nesting is shown by two spaces per level after the separator's space
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            entries.append({'module': name.strip(), 'cumulative_ms': int(cumulative_us) / 1000})
+    entries.sort(key=lambda entry: entry['cumulative_ms'], reverse=True)
+    return entries[:top]
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _gunicorn_first_health(timeout=60):
+    """Seconds from launching a one-worker gunicorn to its first /health response"""
+    port = _free_port()
+    env = dict(os.environ, PORT=str(port), GUNICORN_WORKERS='1')
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+        cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                if process.poll() is not None:
+                    raise RuntimeError('gunicorn exited before serving /health')
+                time.sleep(0.01)
+        raise RuntimeError(f'gunicorn did not serve /health within {timeout}s')
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+def bench_startup(results, quick):
+    """Cold start in fresh interpreters; returns the import profile"""
+    runs = 3 if quick else 7
+    imports, first_health = [], []
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, '-c', _STARTUP_PROBE], cwd=SERVICE_DIR, capture_output=True, text=True, check=True
+        )
+        imported, health = map(float, proc.stdout.split()[-2:])
+        imports.append(imported)
+        first_health.append(health)
+    # The minimum is the least disturbed by other load on the machine
+    results['startup_import_app_s'] = (min(imports), 'lower')
+    results['startup_first_health_s'] = (min(first_health), 'lower')
+
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        results['startup_gunicorn_first_health_s'] = (
+            min(_gunicorn_first_health() for _ in range(1 if quick else 3)), 'lower'
+        )
+    return import_profile()
+
+def run(quick=False, startup_only=False):
+    model_dir = tempfile.mkdtemp(prefix='eta-bench-')
+    # Must be set before the service modules read it at import time
+    os.environ['MODEL_DIR'] = model_dir
+
+    metrics = {}
+    info = {}
+    if startup_only:
+        try:
+            info['startup_imports'] = bench_startup(metrics, quick)
+        finally:
+            shutil.rmtree(model_dir, ignore_errors=True)
+        return _results(metrics, quick, info)
+
+    import db
+    import app as app_module
+
+    try:
+        bench_distance(metrics, quick)
+        bench_sample_data(metrics, quick)
+        bench_training(metrics, quick, model_dir)
+
+        # Serve the model the training benchmark published, with fake backends
+        app_module.predictor.load()
+        app_module.eta_cache.set_redis_client(FakeRedis())
+        db._pool = FakePool()
+
+        bench_predict(metrics, quick, app_module.predictor)
+        bench_ingest(metrics, quick, app_module)
+        bench_http(metrics, quick, app_module)
+        # Cold start with the trained model in MODEL_DIR, as a new worker would load it
+        info['startup_imports'] = bench_startup(metrics, quick)
+    finally:
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+    info['inference_engine'] = app_module.predictor.inference_engine
+    info['prediction_mode'] = app_module.predictor.prediction_mode
+    return _results(metrics, quick, info)
+
+def _results(metrics, quick, info):
+    return {
+        'created_at': datetime.datetime.now().isoformat(),
+        'quick': quick,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        **info,
+        'metrics': {
+            name: {'value': round(float(value), 6), 'better': better}
+            for name, (value, better) in metrics.items()
+        }
+    }
+
+def compare(current, baseline, threshold):
+    """Return a list of (name, baseline, current, change) for metrics that regressed"""
+    regressions = []
+    for name, metric in current['metrics'].items():
+        previous = baseline.get('metrics', {}).get(name)
+        if previous is None or not previous['value']:
+            continue
+        change = (metric['value'] - previous['value']) / previous['value']
+        worse = -change if metric['better'] == 'higher' else change
+        if worse > threshold:
+            regressions.append((name, previous['value'], metric['value'], change))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='smaller sizes for a fast run')
+    parser.add_argument('-o', '--output', help='write results JSON to this file')
+    parser.add_argument('--baseline', help='results JSON of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed relative degradation per metric (default 0.2)')
+    parser.add_argument('--startup', action='store_true', help='only measure cold start')
+    args = parser.parse_args(argv)
+
+    results = run(quick=args.quick, startup_only=args.startup)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after, change in regressions:
+            print(f'REGRESSION {name}: {before:.4g} -> {after:.4g} ({change:+.1%})', file=sys.stderr)
+        if regressions:
+            return 1
+        print(f'No metric degraded by more than {args.threshold:.0%}', file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
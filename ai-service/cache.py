@@ -0,0 +1,283 @@
+"""
+Read-through ETA cache
+
+Keys are built from coordinates snapped to a grid (ETA_CACHE_GRID_DEG,
+default 0.001 degrees, roughly 110 m) plus the hour and weekday buckets the
+model uses, so GPS pings a few metres apart share an entry. Entries live in
+Redis when it is reachable and in an in-process LRU otherwise. Concurrent
+misses for the same key within a process are coalesced so only one caller
+computes the value.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+class LRUCache:
+    """Thread-safe in-process LRU with per-entry TTL"""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def setex(self, key, ttl, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+class _Flight:
+    """A computation in progress that other callers can wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+def redis_settings():
+    """Connection settings shared by every Redis client of the service"""
+    return {
+        'host': os.getenv('REDIS_HOST', 'localhost'),
+        'port': int(os.getenv('REDIS_PORT', '6379')),
+        'db': int(os.getenv('REDIS_DB', '0')),
+        'password': os.getenv('REDIS_PASSWORD') or None
+    }
+
+def default_redis_url():
+    settings = redis_settings()
+    auth = f":{settings['password']}@" if settings['password'] else ''
+    return f"redis://{auth}{settings['host']}:{settings['port']}/{settings['db']}"
+
+def connect_redis(timeout=None):
+    """
+    Build the service's Redis client; the redis package is imported here
+
+    Fails fast (REDIS_TIMEOUT, no retries) because callers fall back to
+    local memory. Batch jobs pass a longer timeout.
+    """
+    import redis
+    from redis.backoff import NoBackoff
+    from redis.retry import Retry
+
+    timeout = float(timeout if timeout is not None else os.getenv('REDIS_TIMEOUT', '0.5'))
+    return redis.Redis(
+        **redis_settings(), decode_responses=True,
+        socket_connect_timeout=timeout, socket_timeout=timeout,
+        retry=Retry(NoBackoff(), 0)
+    )
+
+class LazyRedis:
+    """
+    Stands in for a Redis client and creates it on first use
+
+    factory() builds the real client; attribute access is forwarded to it.
+    Constructing the proxy imports nothing, so importing the app does not
+    pay for the redis package.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
+class RedisBacked:
+    """
+    Redis access with a local fallback
+
+    Reachability is checked with a ping on first use and, after a failure,
+    at most once per retry_interval seconds; in between callers go straight
+    to their local fallback instead of waiting on socket timeouts.
+    Subclasses provide _count(name).
+    """
+
+    def _init_redis(self, redis_client, retry_interval=30):
+        self.redis_client = redis_client
+        self.retry_interval = retry_interval
+        self._redis_ok = None
+        self._redis_checked_at = 0.0
+
+    def set_redis_client(self, redis_client):
+        """Swap the Redis client, e.g. after a worker fork"""
+        self.redis_client = redis_client
+        self._redis_ok = None
+
+    @property
+    def backend(self):
+        return 'redis' if self._use_redis() else 'local'
+
+    def _use_redis(self):
+        if self.redis_client is None:
+            return False
+        now = time.monotonic()
+        if self._redis_ok is None or (not self._redis_ok and now - self._redis_checked_at > self.retry_interval):
+            self._redis_checked_at = now
+            try:
+                self.redis_client.ping()
+                self._redis_ok = True
+            except Exception:
+                self._redis_ok = False
+        return self._redis_ok
+
+    def _redis_failed(self):
+        self._redis_ok = False
+        self._redis_checked_at = time.monotonic()
+        self._count('errors')
+
+class ETACache(RedisBacked):
+    """Read-through cache for ETA predictions with hit/miss/latency counters"""
+
+    def __init__(self, redis_client=None, ttl=None, grid_deg=None,
+                 max_local_entries=None, retry_interval=30):
+        self._init_redis(redis_client, retry_interval)
+        self.ttl = int(ttl if ttl is not None else os.getenv('ETA_CACHE_TTL', '300'))
+        self.grid_deg = float(grid_deg if grid_deg is not None else os.getenv('ETA_CACHE_GRID_DEG', '0.001'))
+        self.local = LRUCache(int(max_local_entries if max_local_entries is not None
+                                  else os.getenv('ETA_CACHE_LOCAL_SIZE', '10000')))
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'errors': 0,
+            'hit_latency_ms_total': 0.0,
+            'miss_latency_ms_total': 0.0
+        }
+
+    def _snap(self, value):
+        return int(round(float(value) / self.grid_deg))
+
+    def make_key(self, current_lat, current_lng, dropoff_lat, dropoff_lng, hour, weekday,
+                 model_version=None):
+        """Build a cache key from grid-snapped coordinates and time buckets"""
+        return 'eta:{}:{}:{}:{}:{}:{}:{}'.format(
+            model_version, hour, weekday,
+            self._snap(current_lat), self._snap(current_lng),
+            self._snap(dropoff_lat), self._snap(dropoff_lng)
+        )
+
+    def get(self, key):
+        """Return the cached value for key or None"""
+        with metrics.span('cache_get'):
+            if self._use_redis():
+                try:
+                    raw = self.redis_client.get(key)
+                    return json.loads(raw) if raw is not None else None
+                except Exception:
+                    self._redis_failed()
+            return self.local.get(key)
+
+    def set(self, key, value):
+        """Store value under key for the configured TTL"""
+        with metrics.span('cache_set'):
+            if self._use_redis():
+                try:
+                    self.redis_client.setex(key, self.ttl, json.dumps(value))
+                    return
+                except Exception:
+                    self._redis_failed()
+            self.local.setex(key, self.ttl, value)
+
+    def get_or_compute(self, key, compute):
+        """
+        Return (value, hit) for key, calling compute() on a miss.
+
+        Only one caller per key computes at a time; others wait for its result.
+        """
+        start = time.perf_counter()
+        value = self.get(key)
+        if value is not None:
+            self._record('hit', start)
+            return value, True
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+
+        if not leader:
+            flight.event.wait()
+            self._count('coalesced')
+            if flight.error is not None:
+                raise flight.error
+            self._record('hit', start)
+            return flight.value, True
+
+        try:
+            value = compute()
+            flight.value = value
+            self.set(key, value)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.event.set()
+
+        self._record('miss', start)
+        return value, False
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _record(self, outcome, start):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        counter, latency = {
+            'hit': ('hits', 'hit_latency_ms_total'),
+            'miss': ('misses', 'miss_latency_ms_total')
+        }[outcome]
+        with self._stats_lock:
+            self._stats[counter] += 1
+            self._stats[latency] += elapsed_ms
+
+    def stats(self):
+        """Return a snapshot of cache counters"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['avg_hit_latency_ms'] = stats['hit_latency_ms_total'] / stats['hits'] if stats['hits'] else 0.0
+        stats['avg_miss_latency_ms'] = stats['miss_latency_ms_total'] / stats['misses'] if stats['misses'] else 0.0
+        stats['backend'] = self.backend
+        stats['local_entries'] = len(self.local)
+        return stats
@@ -0,0 +1,195 @@
+"""
+PostgreSQL access for the AI service
+
+Connections come from a per-process psycopg2 ThreadedConnectionPool, created
+lazily on first use and re-created if the process has forked since. Use the
+db_connection() context manager:
+
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            ...
+
+Checkout blocks up to DB_POOL_TIMEOUT seconds when all DB_POOL_MAX
+connections are in use. Connections idle for longer than
+DB_POOL_HEALTHCHECK_INTERVAL seconds are pinged before being handed out and
+replaced if dead. pool_stats() reports utilization and wait times.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+
+import metrics
+
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTHCHECK_INTERVAL', '30'))
+
+def _connect_kwargs():
+    return {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'database': os.getenv('DB_NAME', 'logistics_db'),
+        'user': os.getenv('DB_USER', 'postgres'),
+        'password': os.getenv('DB_PASSWORD', 'password'),
+        'cursor_factory': RealDictCursor
+    }
+
+def get_db_connection():
+    """Open a dedicated, unpooled connection (caller closes it)"""
+    return psycopg2.connect(**_connect_kwargs())
+
+class PoolTimeout(Exception):
+    """No pooled connection became available within DB_POOL_TIMEOUT"""
+
+class ConnectionPool:
+    """ThreadedConnectionPool with blocking checkout, health checks and metrics"""
+
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                 healthcheck_interval=DB_POOL_HEALTHCHECK_INTERVAL):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self.pid = os.getpid()
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **_connect_kwargs())
+        # ThreadedConnectionPool raises when exhausted; the semaphore makes
+        # callers wait for a free connection instead
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'healthcheck_failures': 0,
+            'in_use': 0,
+            'max_in_use': 0,
+            'wait_ms_total': 0.0,
+            'wait_ms_max': 0.0
+        }
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeout(f'No database connection available within {self.timeout}s')
+        waited_ms = (time.perf_counter() - start) * 1000
+
+        try:
+            conn = self._pool.getconn()
+            if not self._healthy(conn):
+                with self._lock:
+                    self._stats['healthcheck_failures'] += 1
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            self._stats['max_in_use'] = max(self._stats['max_in_use'], self._stats['in_use'])
+            self._stats['wait_ms_total'] += waited_ms
+            self._stats['wait_ms_max'] = max(self._stats['wait_ms_max'], waited_ms)
+        return conn
+
+    def putconn(self, conn, close=False):
+        try:
+            if not close and not conn.closed:
+                # Never hand a connection with an open transaction to the next caller
+                conn.rollback()
+            self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn, close=close or bool(conn.closed))
+        except psycopg2.Error:
+            self._pool.putconn(conn, close=True)
+        finally:
+            with self._lock:
+                self._stats['in_use'] -= 1
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['min_size'] = self.minconn
+        stats['max_size'] = self.maxconn
+        stats['utilization'] = stats['in_use'] / self.maxconn
+        stats['avg_wait_ms'] = stats['wait_ms_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return this process's pool, creating it on first use or after a fork"""
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                # Connections inherited across fork belong to the parent;
+                # drop the reference without closing them
+                _pool = ConnectionPool()
+    return _pool
+
+def reset_pool():
+    """Forget the current pool so the next checkout builds a fresh one"""
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+def close_pool():
+    """Close every pooled connection of this process"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+def pool_stats():
+    """Pool metrics, or None if no pool has been created in this process"""
+    pool = _pool
+    if pool is None or pool.pid != os.getpid():
+        return None
+    return pool.stats()
+
+@contextmanager
+def db_connection():
+    """Check out a pooled connection; commits on success, rolls back on error"""
+    with metrics.span('db_checkout'):
+        pool = get_pool()
+        conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+        conn.commit()
+    except psycopg2.InterfaceError:
+        broken = True
+        raise
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=broken)
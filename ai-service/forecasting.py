@@ -0,0 +1,502 @@
+"""
+Demand forecasting over the sales table
+
+Each product gets a Holt linear-trend exponential smoothing model fitted to
+its weekly (or monthly) sales. A refresh is two grouped queries:
+
+1. a watermark per product: its last period with sales and its total
+   quantity sold
+2. the sales history of only those products whose watermark changed since
+   their model was fitted; late rows for the current week change the total
+   and therefore also trigger a refit
+
+Stale products are split into chunks of FORECAST_CHUNK_SIZE and fitted in a
+process pool of FORECAST_PROCESSES workers (default: all cores). Within a
+chunk the series are aligned into one matrix, and every product and every
+(alpha, beta) grid point is fitted together with NumPy, one time step at a
+time. The best grid point per product is chosen by one-step-ahead error.
+
+Fitted states (level, trend, residual sigma, watermark) live in flat arrays
+keyed by product, like the driver index. They are saved to
+MODEL_DIR/forecast-<granularity>.npz, so other gunicorn workers and
+restarts reuse them instead of refitting. Reorder points combine the
+forecast demand over the lead time with a safety stock of
+z(service level) * sigma * sqrt(lead time).
+
+Refreshes run as background jobs (refresh_forecasts, submitted through
+jobs.TrainingJobs), never in a request thread. Serving processes only load
+the saved file; its mtime tells every worker when the models were last
+refreshed.
+"""
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+import multiprocessing
+
+import numpy as np
+
+from model_store import MODEL_DIR
+
+FORECAST_GRANULARITIES = ('week', 'month')
+FORECAST_CHUNK_SIZE = int(os.getenv('FORECAST_CHUNK_SIZE', '2000'))
+FORECAST_HISTORY_PERIODS = int(os.getenv('FORECAST_HISTORY_PERIODS', '104'))
+FORECAST_REFRESH_SECONDS = float(os.getenv('FORECAST_REFRESH_SECONDS', '300'))
+
+# Smoothing parameter grid searched per product
+ALPHAS = np.array([0.1, 0.2, 0.3, 0.5, 0.7, 0.9])
+BETAS = np.array([0.0, 0.05, 0.1, 0.2, 0.3])
+
+# Sales periods as integers: ISO weeks since 1970-01-05 (a Monday), or months
+# since year 0. sales.year is the calendar year stored next to month, so the
+# ISO year is one higher for week 1 in late December and one lower for weeks
+# 52/53 in early January
+ISO_YEAR_SQL = "year + CASE WHEN month = 12 AND week = 1 THEN 1 WHEN month = 1 AND week >= 52 THEN -1 ELSE 0 END"
+PERIOD_SQL = {
+    'week': f"(to_date(({ISO_YEAR_SQL})::text || '-' || week::text, 'IYYY-IW') - DATE '1970-01-05') / 7",
+    'month': "year * 12 + month - 1"
+}
+PERIOD_FILTER = {'week': 'week IS NOT NULL', 'month': 'month IS NOT NULL'}
+
+WATERMARK_QUERY = """
+    SELECT product_id, MAX({period}) AS last_period, SUM(quantity_sold) AS total_quantity
+    FROM sales
+    WHERE {filter}
+    GROUP BY product_id
+"""
+
+HISTORY_QUERY = """
+    SELECT product_id, array_agg(period ORDER BY period), array_agg(quantity ORDER BY period)
+    FROM (
+        SELECT product_id, {period} AS period, SUM(quantity_sold) AS quantity
+        FROM sales
+        WHERE {filter} AND product_id = ANY(%s) AND {period} > %s
+        GROUP BY 1, 2
+    ) per_period
+    GROUP BY product_id
+"""
+
+INVENTORY_QUERY = """
+    SELECT DISTINCT ON (product_id) product_id, product_name, stock, min_threshold, zone
+    FROM inventory_alerts
+    WHERE product_id = ANY(%s)
+    ORDER BY product_id, updated_at DESC
+"""
+
+def fit_holt(series):
+    """
+    Fit Holt's linear method to a (products, periods) matrix.
+
+    NaN marks periods before a product's first sale. Returns (level, trend,
+    sigma, alpha, beta, observations), one entry per product, with the state
+    as of the last period.
+    """
+    series = np.asarray(series, dtype=float)
+    n_products, n_periods = series.shape
+    alphas, betas = np.meshgrid(ALPHAS, BETAS, indexing='ij')
+    alphas, betas = alphas.ravel(), betas.ravel()
+    shape = (n_products, len(alphas))
+
+    level = np.zeros(shape)
+    trend = np.zeros(shape)
+    sse = np.zeros(shape)
+    errors = np.zeros(n_products)
+    started = np.zeros(n_products, dtype=bool)
+
+    for t in range(n_periods):
+        y = series[:, t]
+        observed = ~np.isnan(y)
+        first = observed & ~started
+        update = observed & started
+        if first.any():
+            level[first] = y[first, None]
+            trend[first] = 0.0
+            started |= first
+        if update.any():
+            yu = y[update, None]
+            prev_level, prev_trend = level[update], trend[update]
+            forecast = prev_level + prev_trend
+            sse[update] += (yu - forecast) ** 2
+            new_level = alphas * yu + (1 - alphas) * forecast
+            trend[update] = betas * (new_level - prev_level) + (1 - betas) * prev_trend
+            level[update] = new_level
+            errors[update] += 1
+
+    best = np.argmin(sse, axis=1)
+    rows = np.arange(n_products)
+    observations = np.sum(~np.isnan(series), axis=1)
+    sigma = np.sqrt(sse[rows, best] / np.maximum(errors, 1))
+
+    level, trend = level[rows, best], trend[rows, best]
+    # Too short for a trend: forecast the mean and use the spread as sigma
+    short = observations < 4
+    if short.any():
+        values = np.nan_to_num(series[short])
+        counts = np.maximum(observations[short], 1)
+        mean = values.sum(axis=1) / counts
+        level[short] = mean
+        trend[short] = 0.0
+        sigma[short] = np.sqrt(((values - mean[:, None]) ** 2 * ~np.isnan(series[short])).sum(axis=1) / counts)
+    return level, trend, sigma, alphas[best], betas[best], observations
+
+def fit_chunk(product_ids, periods, quantities, end_period, history):
+    """
+    Process pool entry point: fit one chunk of products.
+
+    periods and quantities are per-product arrays of the periods with sales.
+    Periods without sales up to end_period count as zero demand.
+    """
+    start_period = end_period - history + 1
+    series = np.full((len(product_ids), history), np.nan)
+    for row, (p, q) in enumerate(zip(periods, quantities)):
+        p = np.asarray(p, dtype=np.int64)
+        keep = p >= start_period
+        p, q = p[keep], np.asarray(q, dtype=float)[keep]
+        if len(p) == 0:
+            continue
+        first = p.min() - start_period
+        series[row, first:] = 0.0
+        series[row, p - start_period] = q
+    return (product_ids,) + fit_holt(series)
+
+class ForecastModels:
+    """Fitted per-product states in flat arrays, keyed by product_id"""
+
+    FIELDS = ('level', 'trend', 'sigma', 'alpha', 'beta', 'observations',
+              'end_period', 'last_period', 'total_quantity')
+
+    def __init__(self, capacity=1024):
+        self._slots = {}
+        self._ids = []
+        self.arrays = {name: np.zeros(capacity) for name in self.FIELDS}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def slot(self, product_id):
+        return self._slots.get(product_id)
+
+    def _slot_for(self, product_id):
+        slot = self._slots.get(product_id)
+        if slot is None:
+            slot = self._slots[product_id] = len(self._ids)
+            self._ids.append(product_id)
+            capacity = len(self.arrays['level'])
+            if slot >= capacity:
+                for name, values in self.arrays.items():
+                    self.arrays[name] = np.concatenate([values, np.zeros(capacity)])
+        return slot
+
+    def advance(self, end_period):
+        """Roll states fitted up to an earlier period forward through periods without sales"""
+        n = len(self._ids)
+        a = self.arrays
+        gap = end_period - a['end_period'][:n]
+        # Beyond the history window every state has decayed to the zero-demand path
+        for step in range(min(int(gap.max()), FORECAST_HISTORY_PERIODS) if n else 0):
+            rows = np.flatnonzero(gap > step)
+            level, trend = a['level'][rows], a['trend'][rows]
+            alpha, beta = a['alpha'][rows], a['beta'][rows]
+            # Holt update with an observed demand of zero
+            new_level = (1 - alpha) * (level + trend)
+            a['trend'][rows] = beta * (new_level - level) + (1 - beta) * trend
+            a['level'][rows] = new_level
+        a['end_period'][:n] = np.maximum(a['end_period'][:n], end_period)
+
+    def stale(self, watermarks):
+        """Product ids whose (last_period, total_quantity) differs from the fitted one"""
+        stale = []
+        last, total = self.arrays['last_period'], self.arrays['total_quantity']
+        for product_id, last_period, total_quantity in watermarks:
+            slot = self._slots.get(product_id)
+            if slot is None or last[slot] != last_period or total[slot] != float(total_quantity):
+                stale.append(product_id)
+        return stale
+
+    def store(self, product_ids, values):
+        """values maps each field to an array aligned with product_ids"""
+        slots = np.array([self._slot_for(product_id) for product_id in product_ids], dtype=np.int64)
+        for name, column in values.items():
+            self.arrays[name][slots] = column
+
+    def save(self, path):
+        n = len(self._ids)
+        tmp_path = f'{path}.tmp-{uuid.uuid4().hex}.npz'
+        try:
+            np.savez(tmp_path, product_ids=np.array(self._ids, dtype=object),
+                     **{name: values[:n] for name, values in self.arrays.items()})
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def copy(self):
+        models = ForecastModels(capacity=1)
+        models._slots = dict(self._slots)
+        models._ids = list(self._ids)
+        models.arrays = {name: values.copy() for name, values in self.arrays.items()}
+        return models
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=True) as data:
+            product_ids = list(data['product_ids'])
+            models = cls(capacity=max(len(product_ids), 1))
+            models._ids = product_ids
+            models._slots = {product_id: slot for slot, product_id in enumerate(product_ids)}
+            for name in cls.FIELDS:
+                models.arrays[name][:len(product_ids)] = data[name]
+        return models
+
+def refresh_forecasts(granularity='week', model_dir=None, force=False):
+    """Job entry point: refit stale products and save the models for serving processes"""
+    from db import db_connection
+
+    forecaster = DemandForecaster(db_connection, granularity, model_dir=model_dir)
+    try:
+        return forecaster.refresh(force=force)
+    finally:
+        forecaster.shutdown()
+
+class DemandForecaster:
+    """
+    Refreshes per-product forecast models from sales and answers bulk forecasts
+
+    refresh() does the fitting and runs inside a job. Serving processes call
+    schedule_refresh() and forecast(), which read the latest saved models.
+    The models are replaced as a whole, never modified in place, so a
+    forecast keeps a consistent set even while newer ones are loaded.
+    """
+
+    def __init__(self, connection, granularity='week', model_dir=None, processes=None,
+                 chunk_size=FORECAST_CHUNK_SIZE, history=FORECAST_HISTORY_PERIODS,
+                 refresh_seconds=FORECAST_REFRESH_SECONDS):
+        if granularity not in FORECAST_GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(FORECAST_GRANULARITIES)}")
+        self.connection = connection
+        self.granularity = granularity
+        self.path = os.path.join(model_dir or MODEL_DIR, f'forecast-{granularity}.npz')
+        self.processes = int(processes or os.getenv('FORECAST_PROCESSES') or os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.history = history
+        self.refresh_seconds = refresh_seconds
+        self.models = ForecastModels()
+        self._loaded_mtime = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._models_lock = threading.Lock()
+        self._job_lock = threading.Lock()
+        self._job_id = None
+        self._submitted_at = None
+        self.last_refresh = {}
+
+    def _format(self, query):
+        return query.format(period=PERIOD_SQL[self.granularity], filter=PERIOD_FILTER[self.granularity])
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes, mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def _saved_mtime(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def _load_saved(self):
+        """Adopt models a refresh job saved since we last looked. Returns the current models."""
+        mtime = self._saved_mtime()
+        with self._models_lock:
+            if mtime is not None and (self._loaded_mtime is None or mtime > self._loaded_mtime):
+                self.models = ForecastModels.load(self.path)
+                self._loaded_mtime = mtime
+            return self.models
+
+    def _watermarks(self):
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(self._format(WATERMARK_QUERY))
+                return [(row['product_id'], int(row['last_period']), row['total_quantity'])
+                        for row in cur.fetchall()]
+
+    def _histories(self, product_ids, start_period):
+        from psycopg2.extensions import cursor as TupleCursor
+
+        with self.connection() as conn:
+            with conn.cursor(cursor_factory=TupleCursor) as cur:
+                cur.execute(self._format(HISTORY_QUERY), (list(product_ids), start_period - 1))
+                return cur.fetchall()
+
+    def _fit(self, histories, end_period):
+        chunks = [histories[i:i + self.chunk_size] for i in range(0, len(histories), self.chunk_size)]
+        args = [
+            ([h[0] for h in chunk], [h[1] for h in chunk], [h[2] for h in chunk], end_period, self.history)
+            for chunk in chunks
+        ]
+        if len(chunks) <= 1 or self.processes <= 1:
+            return [fit_chunk(*a) for a in args]
+        return list(self._pool().map(fit_chunk, *zip(*args)))
+
+    def refresh(self, force=False):
+        """
+        Refit the products whose sales changed and save the models. Skipped
+        when the saved models are younger than refresh_seconds unless force
+        is set. Returns a summary dict.
+        """
+        with self._lock:
+            mtime = self._saved_mtime()
+            if not force and mtime is not None and time.time() - mtime < self.refresh_seconds:
+                return {'skipped': True, 'age_seconds': round(time.time() - mtime, 1)}
+            start = time.perf_counter()
+            # Fit into a copy; readers keep using the current models until the swap
+            models = self._load_saved().copy()
+
+            watermarks = self._watermarks()
+            end_period = max((last for _, last, _ in watermarks), default=None)
+            stale = models.stale(watermarks)
+            query_seconds = time.perf_counter() - start
+            advanced = (end_period is not None and len(models)
+                        and end_period > models.arrays['end_period'][:len(models)].min())
+            if end_period is not None:
+                models.advance(end_period)
+
+            if stale:
+                found = {row[0]: row for row in self._histories(stale, end_period - self.history + 1)}
+                # Products whose sales all predate the history window fit as zero demand
+                histories = [found.get(product_id, (product_id, [], [])) for product_id in stale]
+                by_product = {product_id: (last, total) for product_id, last, total in watermarks}
+                for product_ids, level, trend, sigma, alpha, beta, observations in self._fit(histories, end_period):
+                    models.store(product_ids, {
+                        'level': level, 'trend': trend, 'sigma': sigma, 'alpha': alpha, 'beta': beta,
+                        'observations': observations,
+                        'end_period': np.full(len(product_ids), end_period),
+                        'last_period': [by_product[p][0] for p in product_ids],
+                        'total_quantity': [float(by_product[p][1]) for p in product_ids]
+                    })
+            if stale or advanced or mtime is None:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                models.save(self.path)
+            else:
+                # Nothing changed; mark the models as fresh for every worker
+                os.utime(self.path)
+            with self._models_lock:
+                self.models = models
+                self._loaded_mtime = self._saved_mtime()
+
+            self.last_refresh = {
+                'products': len(watermarks),
+                'refit': len(stale),
+                'end_period': end_period,
+                'query_seconds': round(query_seconds, 3),
+                'seconds': round(time.perf_counter() - start, 3)
+            }
+            return self.last_refresh
+
+    def schedule_refresh(self, jobs, force=False):
+        """
+        Load newly saved models and queue a refresh job when they are stale
+
+        jobs is a jobs.TrainingJobs. A job is queued when the saved models
+        are older than refresh_seconds (or force is set) and this process
+        has no refresh pending; after a failed job the next one waits
+        refresh_seconds unless forced. Returns the refresh status.
+        """
+        self._load_saved()
+        with self._job_lock:
+            status = jobs.status(self._job_id) if self._job_id is not None else None
+            pending = status is not None and status['status'] in ('queued', 'started', 'deferred', 'scheduled')
+            mtime = self._saved_mtime()
+            age = time.time() - mtime if mtime is not None else None
+            now = time.monotonic()
+            due = age is None or age >= self.refresh_seconds
+            backoff = self._submitted_at is not None and now - self._submitted_at < self.refresh_seconds
+            if not pending and (force or (due and not backoff)):
+                self._job_id = jobs.submit_forecast_refresh(self.granularity, force=force)
+                self._submitted_at = now
+                status = {'job_id': self._job_id, 'status': 'queued'}
+            refresh = {'models_age_seconds': round(age, 1) if age is not None else None}
+            if status is not None:
+                refresh.update(job_id=status['job_id'], status=status['status'])
+                if 'error' in status:
+                    refresh['error'] = status['error']
+            return refresh
+
+    def _inventory(self, product_ids):
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(INVENTORY_QUERY, (list(product_ids),))
+                return {row['product_id']: row for row in cur.fetchall()}
+
+    def forecast(self, product_ids, horizon=4, lead_time=2, service_level=0.95):
+        """
+        Forecasts and reorder points for product_ids.
+
+        Returns (forecasts, missing): a list of per-product dicts and the ids
+        without sales history.
+        """
+        z = NormalDist().inv_cdf(service_level)
+        steps = np.arange(1, max(horizon, lead_time) + 1)
+        with self._models_lock:
+            models = self.models
+        arrays = models.arrays
+        inventory = self._inventory(product_ids)
+
+        forecasts, missing = [], []
+        for product_id in product_ids:
+            slot = models.slot(product_id)
+            if slot is None:
+                missing.append(product_id)
+                continue
+            # States are as of the refresh's end period, which may lie past
+            # the product's own last sale
+            path = np.maximum(arrays['level'][slot] + arrays['trend'][slot] * steps, 0)
+            sigma = float(arrays['sigma'][slot])
+            lead_demand = float(path[:lead_time].sum())
+            safety_stock = z * sigma * math.sqrt(lead_time)
+            reorder_point = int(math.ceil(lead_demand + safety_stock))
+            entry = {
+                'product_id': product_id,
+                'forecast': [round(float(v), 2) for v in path[:horizon]],
+                'lead_time_demand': round(lead_demand, 2),
+                'safety_stock': round(safety_stock, 2),
+                'reorder_point': reorder_point,
+                'model': {
+                    'alpha': float(arrays['alpha'][slot]),
+                    'beta': float(arrays['beta'][slot]),
+                    'sigma': round(sigma, 3),
+                    'observations': int(arrays['observations'][slot])
+                }
+            }
+            item = inventory.get(product_id)
+            if item is not None:
+                entry.update({
+                    'product_name': item['product_name'],
+                    'zone': item['zone'],
+                    'stock': item['stock'],
+                    'min_threshold': item['min_threshold'],
+                    'threshold_change': reorder_point - (item['min_threshold'] or 0),
+                    'reorder_now': item['stock'] <= reorder_point
+                })
+            forecasts.append(entry)
+        return forecasts, missing
+
+    def stats(self):
+        with self._models_lock:
+            models = self.models
+        return {
+            'granularity': self.granularity,
+            'products': len(models),
+            'processes': self.processes,
+            'last_refresh': self.last_refresh
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,37 @@
+"""
+Gunicorn configuration for the AI service
+
+The app is preloaded in the master so the model is loaded once and shared
+copy-on-write by the forked workers; each worker then re-creates its own
+Redis and training clients. Tune with GUNICORN_WORKERS, GUNICORN_THREADS,
+GUNICORN_TIMEOUT and PORT.
+
+Every open /deliveries/<id>/stream connection occupies one thread for up to
+LIVE_ETA_STREAM_MAX_SECONDS. Each worker serves at most LIVE_ETA_MAX_STREAMS
+of them (default: half of GUNICORN_THREADS) and answers 503 beyond that, so
+size GUNICORN_THREADS as expected subscribers per worker plus the threads
+needed for ordinary requests.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+preload_app = True
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+def post_fork(server, worker):
+    import app
+    app.init_worker()
+
+def worker_exit(server, worker):
+    import app
+    app.shutdown()
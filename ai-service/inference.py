@@ -0,0 +1,58 @@
+"""
+Low-latency inference for tree ensembles
+
+FlatForest evaluates the flat node arrays written by model_store directly,
+without sklearn's per-call input validation and joblib dispatch. All trees
+are walked together: each step gathers the current node of every
+(row, tree) pair with NumPy fancy indexing, so a single-row prediction costs
+about max_depth small vectorized steps instead of one Python-level call per
+estimator. The walk stops as soon as every pair has reached a leaf.
+
+Inputs are cast to float32 before comparison, exactly as sklearn's trees do,
+so predictions match RandomForestRegressor.predict to float rounding.
+"""
+import numpy as np
+
+# Maximum tolerated |flat - sklearn| difference when verifying a model
+PARITY_TOLERANCE = 1e-6
+
+class FlatForest:
+    """Averaging tree ensemble over contiguous node arrays"""
+
+    def __init__(self, forest, max_depth=None):
+        self.feature = forest['feature']
+        self.threshold = forest['threshold']
+        self.left = forest['left']
+        self.right = forest['right']
+        self.value = forest['value']
+        self.roots = np.asarray(forest['roots'], dtype=np.int64)
+        self.n_trees = len(self.roots)
+        # Every walk ends at a leaf within max_depth steps; without the
+        # metadata fall back to the node count, the walk exits early anyway
+        self.max_depth = int(max_depth) if max_depth is not None else len(self.value)
+
+    def predict(self, X):
+        """Predict for an (n_samples, n_features) array"""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        n = X.shape[0]
+
+        rows = np.repeat(np.arange(n), self.n_trees)
+        nodes = np.tile(self.roots, n)
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            next_nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+            if np.array_equal(next_nodes, nodes):
+                break
+            nodes = next_nodes
+
+        return self.value[nodes].reshape(n, self.n_trees).mean(axis=1)
+
+    def predict_one(self, features):
+        """Predict a single row given as a sequence of feature values"""
+        return float(self.predict(np.asarray(features, dtype=np.float32).reshape(1, -1))[0])
+
+def max_parity_error(engine, model, X):
+    """Largest absolute difference between the flat engine and the sklearn model on X"""
+    return float(np.max(np.abs(engine.predict(np.asarray(X)) - model.predict(X))))
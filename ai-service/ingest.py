@@ -0,0 +1,412 @@
+"""
+Bulk ingestion of RFID scans and sensor readings
+
+Readers post newline-delimited JSON to /ingest/<kind>. The parsed rows go
+into an in-memory buffer per table. A background flusher writes the buffer to
+Postgres with one COPY ... FROM STDIN over a pooled connection once it holds
+INGEST_BATCH_ROWS rows, or INGEST_FLUSH_INTERVAL seconds after the oldest
+buffered row arrived. At thousands of events per second that is a few
+statements per second instead of one INSERT per event.
+
+The buffer is capped at INGEST_MAX_BUFFER_ROWS. A batch that does not fit
+waits up to INGEST_BLOCK_TIMEOUT seconds for the flusher to make room, then
+is rejected with BufferFull so the caller can retry later (HTTP 429). A
+failed COPY puts its rows back at the front of the buffer for the next
+flush. They may push the buffer past the cap by up to one batch, which
+holds off new batches until the database recovers.
+
+Buffers are per process: rows accepted by a gunicorn worker are written by
+that worker's flusher, and unflushed rows are lost if the worker is killed
+without a graceful shutdown (close() flushes).
+"""
+import collections
+import datetime
+import io
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import metrics
+from anomaly import ALERT_COLUMNS, SensorAnomalyDetector, classify_sensor_rows
+from db import db_connection
+
+INGEST_BATCH_ROWS = int(os.getenv('INGEST_BATCH_ROWS', '5000'))
+INGEST_FLUSH_INTERVAL = float(os.getenv('INGEST_FLUSH_INTERVAL', '1'))
+INGEST_MAX_BUFFER_ROWS = int(os.getenv('INGEST_MAX_BUFFER_ROWS', '100000'))
+INGEST_BLOCK_TIMEOUT = float(os.getenv('INGEST_BLOCK_TIMEOUT', '0.5'))
+
+logger = logging.getLogger(__name__)
+
+# Window over which the sustained write rate is reported
+RATE_WINDOW_SECONDS = 60
+
+RFID_ACTIONS = ('SCAN', 'MOVE', 'PICK', 'PLACE')
+SENSOR_STATUSES = ('NORMAL', 'WARNING', 'CRITICAL')
+
+# COPY text format: backslash, tab and line breaks are escaped, NULL is \N
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+class BufferFull(Exception):
+    """The ingest buffer stayed full for longer than INGEST_BLOCK_TIMEOUT"""
+
+def _text(record, field, max_length, required=False, default=None):
+    value = record.get(field, default)
+    if value is None:
+        if required:
+            raise ValueError(f'{field} is required')
+        return None
+    value = str(value)
+    if len(value) > max_length:
+        raise ValueError(f'{field} is longer than {max_length} characters')
+    return value
+
+def _timestamp(record, now):
+    """
+    Local naive time, like the columns' DEFAULT CURRENT_TIMESTAMP
+
+    Epoch seconds and ISO strings with an offset are converted to the
+    service's local time zone, which should match the database's TimeZone;
+    a TIMESTAMP column would otherwise drop the offset.
+    """
+    value = record.get('timestamp')
+    if value is None:
+        return now
+    if isinstance(value, (int, float)):
+        try:
+            return datetime.datetime.fromtimestamp(value).isoformat()
+        except (OverflowError, OSError):
+            raise ValueError('timestamp out of range') from None
+    parsed = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat()
+
+def parse_rfid(record, now):
+    """One rfid_logs row from a scan event"""
+    action = _text(record, 'action', 50, default='SCAN').upper()
+    if action not in RFID_ACTIONS:
+        raise ValueError(f'action must be one of {", ".join(RFID_ACTIONS)}')
+    return (
+        _text(record, 'product_id', 100, required=True),
+        _text(record, 'rfid_tag', 100),
+        _text(record, 'location', 100),
+        _text(record, 'zone', 100),
+        action,
+        _timestamp(record, now),
+        _text(record, 'device_id', 100),
+        _text(record, 'employee_id', 100)
+    )
+
+def parse_sensor(record, now):
+    """One sensor_data row from a reading"""
+    # Left empty for the anomaly detector to fill in when the reader sends none
+    status = _text(record, 'status', 50)
+    if status is not None:
+        status = status.upper()
+        if status not in SENSOR_STATUSES:
+            raise ValueError(f'status must be one of {", ".join(SENSOR_STATUSES)}')
+    value = record.get('value')
+    if value is not None:
+        value = float(value)
+        if not math.isfinite(value):
+            raise ValueError('value must be a finite number')
+        value = round(value, 2)  # DECIMAL(10,2)
+        if abs(value) >= 1e8:
+            raise ValueError('value out of range')
+    sensor_type = _text(record, 'sensor_type', 50)
+    return (
+        _text(record, 'sensor_id', 100, required=True),
+        sensor_type.upper() if sensor_type is not None else None,
+        _text(record, 'zone', 100),
+        value,
+        _text(record, 'unit', 20),
+        status,
+        _timestamp(record, now)
+    )
+
+# kind -> (table, columns, row parser)
+INGEST_TABLES = {
+    'rfid': (
+        'rfid_logs',
+        ('product_id', 'rfid_tag', 'location', 'zone', 'action', 'timestamp', 'device_id', 'employee_id'),
+        parse_rfid
+    ),
+    'sensor': (
+        'sensor_data',
+        ('sensor_id', 'sensor_type', 'zone', 'value', 'unit', 'status', 'timestamp'),
+        parse_sensor
+    )
+}
+
+def encode_copy_rows(rows):
+    """Rows as COPY text format (tab-separated, \\N for NULL)"""
+    lines = []
+    for row in rows:
+        lines.append('\t'.join(
+            '\\N' if value is None else str(value).translate(_COPY_ESCAPES) for value in row
+        ))
+    lines.append('')
+    return '\n'.join(lines)
+
+class BulkWriter:
+    """Buffers rows for one table and writes them with COPY from a background thread"""
+
+    def __init__(self, table, columns, batch_rows=INGEST_BATCH_ROWS, flush_interval=INGEST_FLUSH_INTERVAL,
+                 max_buffer_rows=INGEST_MAX_BUFFER_ROWS, block_timeout=INGEST_BLOCK_TIMEOUT,
+                 connection=db_connection):
+        self.table = table
+        self.columns = tuple(columns)
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.max_buffer_rows = max_buffer_rows
+        self.block_timeout = block_timeout
+        self.connection = connection
+        self._copy_sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+        self._buffer = collections.deque()
+        self._oldest = None
+        self._cond = threading.Condition()
+        self._flusher = None
+        self._pid = None
+        self._closed = False
+        # (monotonic time, rows) per successful flush inside RATE_WINDOW_SECONDS
+        self._recent = collections.deque()
+        self._stats = {
+            'rows_accepted': 0,
+            'rows_written': 0,
+            'rows_rejected': 0,
+            'batches_rejected': 0,
+            'flushes': 0,
+            'flush_failures': 0,
+            'flush_ms_total': 0.0,
+            'flush_ms_max': 0.0,
+            'last_flush_ms': None,
+            'last_flush_rows': 0
+        }
+
+    def _ensure_flusher(self):
+        """Start the flusher in this process (threads do not survive fork)"""
+        if self._flusher is not None and self._pid == os.getpid() and self._flusher.is_alive():
+            return
+        if self._pid != os.getpid():
+            # Rows buffered by the parent are the parent's to write
+            self._buffer.clear()
+            self._oldest = None
+            self._pid = os.getpid()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._run, name=f'ingest-{self.table}', daemon=True)
+        self._flusher.start()
+
+    def submit(self, rows, transform=None):
+        """
+        Queue rows for the next COPY.
+
+        Waits up to block_timeout for buffer space; raises BufferFull if the
+        batch still does not fit. A batch larger than the whole buffer is
+        always rejected. transform(rows), if given, runs once the batch has
+        room and its result is queued, so a rejected batch is never
+        transformed.
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+        deadline = time.monotonic() + self.block_timeout
+        with self._cond:
+            self._ensure_flusher()
+            while len(self._buffer) + len(rows) > self.max_buffer_rows:
+                remaining = deadline - time.monotonic()
+                if len(rows) > self.max_buffer_rows or remaining <= 0:
+                    self._stats['rows_rejected'] += len(rows)
+                    self._stats['batches_rejected'] += 1
+                    raise BufferFull(
+                        f'{self.table} ingest buffer is full ({len(self._buffer)} of {self.max_buffer_rows} rows)'
+                    )
+                self._cond.notify_all()
+                self._cond.wait(remaining)
+            if transform is not None:
+                rows = transform(rows)
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.extend(rows)
+            self._stats['rows_accepted'] += len(rows)
+            if len(self._buffer) >= self.batch_rows:
+                self._cond.notify_all()
+            return len(rows)
+
+    def _take_batch(self):
+        """Wait for a full batch or the flush interval, then pop up to batch_rows rows"""
+        with self._cond:
+            while not self._closed:
+                if len(self._buffer) >= self.batch_rows:
+                    break
+                if self._buffer and time.monotonic() - self._oldest >= self.flush_interval:
+                    break
+                timeout = self.flush_interval
+                if self._buffer:
+                    timeout = max(self.flush_interval - (time.monotonic() - self._oldest), 0)
+                self._cond.wait(timeout)
+            n = min(len(self._buffer), self.batch_rows)
+            batch = [self._buffer.popleft() for _ in range(n)]
+            self._oldest = time.monotonic() if self._buffer else None
+            # Space was freed for producers waiting in submit()
+            self._cond.notify_all()
+            return batch
+
+    def _requeue(self, batch):
+        with self._cond:
+            self._buffer.extendleft(reversed(batch))
+            self._oldest = time.monotonic()
+
+    def write(self, rows):
+        """COPY rows into the table over a pooled connection"""
+        data = io.StringIO(encode_copy_rows(rows))
+        with metrics.span('ingest_copy'):
+            with self.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.copy_expert(self._copy_sql, data)
+
+    def flush_once(self):
+        """Write one batch; returns the number of rows written"""
+        batch = self._take_batch()
+        if not batch:
+            return 0
+        start = time.perf_counter()
+        try:
+            self.write(batch)
+        except Exception as e:
+            logger.error('COPY into %s failed, %d rows requeued: %s', self.table, len(batch), e)
+            self._requeue(batch)
+            with self._cond:
+                self._stats['flush_failures'] += 1
+                # Back off instead of retrying a dead database in a tight loop
+                if not self._closed:
+                    self._cond.wait(self.flush_interval)
+            return 0
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        now = time.monotonic()
+        with self._cond:
+            self._stats['flushes'] += 1
+            self._stats['rows_written'] += len(batch)
+            self._stats['flush_ms_total'] += elapsed_ms
+            self._stats['flush_ms_max'] = max(self._stats['flush_ms_max'], elapsed_ms)
+            self._stats['last_flush_ms'] = elapsed_ms
+            self._stats['last_flush_rows'] = len(batch)
+            self._recent.append((now, len(batch)))
+            while self._recent and now - self._recent[0][0] > RATE_WINDOW_SECONDS:
+                self._recent.popleft()
+        return len(batch)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed and not self._buffer:
+                    return
+                failures = self._stats['flush_failures']
+            self.flush_once()
+            with self._cond:
+                if self._closed and self._stats['flush_failures'] > failures:
+                    # Shutting down against a failing database; give up on the rest
+                    return
+
+    def close(self, timeout=10):
+        """Write out what is buffered and stop the flusher"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._flusher is not None and self._pid == os.getpid():
+            self._flusher.join(timeout)
+        self._flusher = None
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            stats = dict(self._stats)
+            stats['buffered_rows'] = len(self._buffer)
+            recent = [(t, n) for t, n in self._recent if now - t <= RATE_WINDOW_SECONDS]
+        stats['max_buffer_rows'] = self.max_buffer_rows
+        stats['buffer_utilization'] = stats['buffered_rows'] / self.max_buffer_rows
+        stats['avg_flush_ms'] = stats['flush_ms_total'] / stats['flushes'] if stats['flushes'] else 0.0
+        stats[f'rows_per_s_{RATE_WINDOW_SECONDS}s'] = sum(n for _, n in recent) / RATE_WINDOW_SECONDS
+        return stats
+
+class Ingestor:
+    """
+    Parses NDJSON batches and routes them to one BulkWriter per table
+
+    Sensor readings are classified by a SensorAnomalyDetector once the
+    buffer has room for them, just before they are queued; the alerts it
+    raises are written to sensor_alerts by their own BulkWriter.
+    """
+
+    def __init__(self, connection=db_connection, detector=None, **writer_options):
+        self.writers = {
+            kind: BulkWriter(table, columns, connection=connection, **writer_options)
+            for kind, (table, columns, _) in INGEST_TABLES.items()
+        }
+        self.writers['alerts'] = BulkWriter('sensor_alerts', ALERT_COLUMNS, connection=connection, **writer_options)
+        self.detector = detector or SensorAnomalyDetector()
+        self._lock = threading.Lock()
+        self._stats = {'alerts_dropped': 0}
+
+    def parse(self, kind, body):
+        """
+        Rows for kind from an NDJSON body (bytes or str).
+
+        Blank lines are skipped. Raises ValueError naming the first bad line;
+        nothing from a batch with a bad line is queued.
+        """
+        parse_row = INGEST_TABLES[kind][2]
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        now = datetime.datetime.now().isoformat()
+        rows = []
+        for line_number, line in enumerate(body.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError('expected a JSON object')
+                rows.append(parse_row(record, now))
+            except (ValueError, TypeError, OverflowError) as e:
+                raise ValueError(f'Line {line_number}: {e}') from None
+        return rows
+
+    def submit(self, kind, body):
+        """Parse and buffer an NDJSON batch; returns the number of rows queued"""
+        rows = self.parse(kind, body)
+        if kind != 'sensor':
+            return self.writers[kind].submit(rows)
+
+        # Score only a batch the buffer accepts: a rejected batch is retried
+        # by the reader and must not train the detector twice
+        alerts = []
+
+        def classify(rows):
+            rows, batch_alerts = classify_sensor_rows(self.detector, rows, INGEST_TABLES['sensor'][1])
+            alerts.extend(batch_alerts)
+            return rows
+
+        queued = self.writers[kind].submit(rows, transform=classify)
+        if alerts:
+            try:
+                self.writers['alerts'].submit(alerts)
+            except BufferFull as e:
+                # The readings are stored with their status; only the alert rows are lost
+                with self._lock:
+                    self._stats['alerts_dropped'] += len(alerts)
+                logger.error('Dropped %d sensor alerts: %s', len(alerts), e)
+        return queued
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+    def stats(self):
+        stats = {kind: writer.stats() for kind, writer in self.writers.items()}
+        stats['anomaly'] = self.detector.stats()
+        with self._lock:
+            stats.update(self._stats)
+        return stats
@@ -0,0 +1,148 @@
+"""
+Background training jobs
+
+Training runs outside the request thread, either on an rq worker
+(`rq worker training`) when Redis is reachable or in a local process pool
+otherwise (TRAINING_BACKEND=rq|process|auto). Jobs either retrain from
+scratch or incrementally update the latest version (mode='incremental').
+A finished job publishes a new versioned artifact through model_store; serving processes pick it up with
+ETAPredictor.maybe_reload. Demand forecast refreshes run on the same
+backend and save their models for DemandForecaster to load.
+"""
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+from cache import LazyRedis, connect_redis, default_redis_url
+from forecasting import refresh_forecasts
+from predictor import ETAPredictor
+
+QUEUE_NAME = 'training'
+JOB_TIMEOUT = int(os.getenv('TRAINING_JOB_TIMEOUT', '3600'))
+
+TRAINING_MODES = ('full', 'incremental')
+
+def train_and_publish(sources=None, max_rows=None, model_dir=None, mode='full'):
+    """Job entry point: fit a model (from scratch or incrementally) and publish it as a new version"""
+    # The job reads whole queue chunks, so it gets a longer timeout than the cache
+    redis_client = LazyRedis(lambda: connect_redis(timeout=os.getenv('TRAINING_REDIS_TIMEOUT', '30')))
+    predictor = ETAPredictor(model_dir=model_dir, redis_client=redis_client)
+    try:
+        if mode == 'incremental':
+            return predictor.update_model(sources=sources, max_rows=max_rows)
+        return predictor.train_model(sources=sources, max_rows=max_rows)
+    finally:
+        redis_client.close()
+
+class TrainingJobs:
+    """Submit training jobs and report their status"""
+
+    def __init__(self, redis_url=None, backend=None, model_dir=None, on_finished=None):
+        self.redis_url = redis_url or default_redis_url()
+        self.requested_backend = backend or os.getenv('TRAINING_BACKEND', 'auto')
+        self.model_dir = model_dir
+        self.on_finished = on_finished
+        self._queue = None
+        self._backend = None
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _rq_queue(self):
+        if self._queue is None:
+            import redis
+            from rq import Queue
+            connection = redis.Redis.from_url(self.redis_url, socket_connect_timeout=0.5)
+            connection.ping()
+            self._queue = Queue(QUEUE_NAME, connection=connection)
+        return self._queue
+
+    def _process_pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=int(os.getenv('TRAINING_PROCESSES', '1')),
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            if self.requested_backend in ('rq', 'process'):
+                self._backend = self.requested_backend
+            else:
+                try:
+                    self._rq_queue()
+                    self._backend = 'rq'
+                except Exception:
+                    self._backend = 'process'
+        return self._backend
+
+    def _enqueue(self, func, kwargs, on_finished=None):
+        if self.backend == 'rq':
+            job = self._rq_queue().enqueue(func, kwargs=kwargs, job_timeout=JOB_TIMEOUT)
+            return job.id
+
+        job_id = uuid.uuid4().hex
+        future = self._process_pool().submit(func, **kwargs)
+        with self._lock:
+            self._futures[job_id] = future
+        if on_finished is not None:
+            future.add_done_callback(
+                lambda future: on_finished(future.result()) if future.exception() is None else None
+            )
+        return job_id
+
+    def submit(self, sources=None, max_rows=None, mode='full'):
+        """Queue a training job and return its id"""
+        if mode not in TRAINING_MODES:
+            raise ValueError(f"mode must be one of {', '.join(TRAINING_MODES)}")
+        kwargs = {'sources': sources, 'max_rows': max_rows, 'model_dir': self.model_dir, 'mode': mode}
+        return self._enqueue(train_and_publish, kwargs, self.on_finished)
+
+    def submit_forecast_refresh(self, granularity, force=False):
+        """Queue a demand forecast refresh and return its id"""
+        kwargs = {'granularity': granularity, 'model_dir': self.model_dir, 'force': force}
+        return self._enqueue(refresh_forecasts, kwargs)
+
+    def status(self, job_id):
+        """Return a status dict for job_id, or None if unknown"""
+        with self._lock:
+            future = self._futures.get(job_id)
+
+        if future is not None:
+            if future.running():
+                return {'job_id': job_id, 'status': 'started'}
+            if not future.done():
+                return {'job_id': job_id, 'status': 'queued'}
+            error = future.exception()
+            if error is not None:
+                return {'job_id': job_id, 'status': 'failed', 'error': str(error)}
+            return {'job_id': job_id, 'status': 'finished', 'results': future.result()}
+
+        if self.backend != 'rq':
+            return None
+
+        from rq.exceptions import NoSuchJobError
+        from rq.job import Job
+        try:
+            job = Job.fetch(job_id, connection=self._rq_queue().connection)
+        except NoSuchJobError:
+            return None
+
+        status = job.get_status()
+        status = getattr(status, 'value', status)
+        response = {'job_id': job_id, 'status': status}
+        if status == 'finished':
+            response['results'] = job.result
+        elif status == 'failed':
+            lines = (job.exc_info or '').strip().splitlines()
+            response['error'] = lines[-1] if lines else 'Training failed'
+        return response
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,238 @@
+"""
+Live ETA updates for tracked deliveries
+
+Drivers post location pings for a delivery id; clients subscribe to the
+delivery over Server-Sent Events. A ping only triggers an ETA recompute when
+the driver has moved more than LIVE_ETA_MIN_MOVE_M metres since the last
+computed position, the hour/weekday bucket has changed, or the serving model
+version has changed; every other ping is acknowledged without touching the
+model. Each recompute is pushed to subscribers as an 'eta' event, or as a
+'proximity' event when the proximity message changes (e.g. "nearby" to
+"arriving very soon").
+
+Per-delivery state and fan-out go through Redis (a JSON key per delivery and
+a pub/sub channel), so pings and subscribers may land on different gunicorn
+workers. Without Redis both fall back to this process.
+
+An open stream holds one gthread worker thread. At most
+LIVE_ETA_MAX_STREAMS streams are served per worker (default: half of
+GUNICORN_THREADS), so the remaining threads stay free for the other routes;
+further subscribers are turned away until a stream closes.
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+from cache import LRUCache, RedisBacked
+
+STATE_PREFIX = 'eta:live:state:'
+CHANNEL_PREFIX = 'eta:live:events:'
+
+class LiveETAHub(RedisBacked):
+    """Tracks delivery positions, decides when to recompute and fans out updates"""
+
+    def __init__(self, redis_client=None, min_move_m=None, state_ttl=None,
+                 keepalive=None, max_streams=None, max_local_deliveries=10000):
+        self._init_redis(redis_client)
+        self.min_move_m = float(min_move_m if min_move_m is not None else os.getenv('LIVE_ETA_MIN_MOVE_M', '100'))
+        self.state_ttl = int(state_ttl if state_ttl is not None else os.getenv('LIVE_ETA_STATE_TTL', '7200'))
+        self.keepalive = float(keepalive if keepalive is not None else os.getenv('LIVE_ETA_KEEPALIVE', '15'))
+        if max_streams is None:
+            max_streams = os.getenv('LIVE_ETA_MAX_STREAMS') or max(int(os.getenv('GUNICORN_THREADS', '4')) // 2, 1)
+        self.max_streams = int(max_streams)
+        self.local_state = LRUCache(max_local_deliveries)
+        self._subscribers = {}
+        self._open_streams = 0
+        self._lock = threading.Lock()
+        self._stats = {'pings': 0, 'recomputes': 0, 'skipped': 0, 'events_published': 0, 'errors': 0,
+                       'streams_rejected': 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    def _load_state(self, delivery_id):
+        if self._use_redis():
+            try:
+                raw = self.redis_client.get(STATE_PREFIX + delivery_id)
+                return json.loads(raw) if raw is not None else None
+            except Exception:
+                self._redis_failed()
+        return self.local_state.get(delivery_id)
+
+    def _save_state(self, delivery_id, state):
+        if self._use_redis():
+            try:
+                self.redis_client.setex(STATE_PREFIX + delivery_id, self.state_ttl, json.dumps(state))
+                return
+            except Exception:
+                self._redis_failed()
+        self.local_state.setex(delivery_id, self.state_ttl, state)
+
+    def needs_recompute(self, state, dropoff, hour, weekday, model_version, moved_km):
+        """True when the cached ETA of state no longer describes this ping"""
+        if state is None:
+            return True
+        return (
+            moved_km * 1000 > self.min_move_m
+            or [hour, weekday] != state['bucket']
+            or dropoff != state['dropoff']
+            or model_version != state['model_version']
+        )
+
+    def ping(self, delivery_id, lat, lng, dropoff, now, model_version, distance, compute):
+        """
+        Record a driver location ping.
+
+        dropoff is (lat, lng) or None to keep the tracked one. distance(a, b)
+        returns km between two (lat, lng) points and compute(lat, lng,
+        dropoff_lat, dropoff_lng, hour, weekday) the ETA response. Returns
+        (update, recomputed); update is the latest ETA response.
+        """
+        self._count('pings')
+        state = self._load_state(delivery_id)
+        if dropoff is None:
+            if state is None:
+                raise ValueError('dropoff_lat and dropoff_lng are required on the first ping')
+            dropoff = state['dropoff']
+        dropoff = [float(dropoff[0]), float(dropoff[1])]
+        hour, weekday = now.hour, now.weekday()
+
+        moved_km = distance(state['position'], (lat, lng)) if state is not None else 0.0
+        if not self.needs_recompute(state, dropoff, hour, weekday, model_version, moved_km):
+            self._count('skipped')
+            return state['update'], False
+
+        update = dict(compute(lat, lng, dropoff[0], dropoff[1], hour, weekday))
+        update['delivery_id'] = delivery_id
+        previous_message = state['update']['message'] if state is not None else None
+        self._save_state(delivery_id, {
+            'position': [lat, lng],
+            'dropoff': dropoff,
+            'bucket': [hour, weekday],
+            'model_version': model_version,
+            'update': update
+        })
+        self._count('recomputes')
+
+        event = 'proximity' if previous_message is not None and update['message'] != previous_message else 'eta'
+        if event == 'proximity':
+            update = dict(update, previous_message=previous_message)
+        self.publish(delivery_id, event, update)
+        return update, True
+
+    def latest(self, delivery_id):
+        """Latest ETA response for a delivery, or None if it is not tracked"""
+        state = self._load_state(delivery_id)
+        return state['update'] if state is not None else None
+
+    def publish(self, delivery_id, event, data):
+        """Send an event to subscribers in every worker"""
+        message = json.dumps({'event': event, 'data': data})
+        if self._use_redis():
+            try:
+                self.redis_client.publish(CHANNEL_PREFIX + delivery_id, message)
+            except Exception:
+                self._redis_failed()
+        # Subscribers that could not reach Redis listen on local queues
+        with self._lock:
+            local = list(self._subscribers.get(delivery_id, ()))
+        for q in local:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # A stalled client misses updates rather than blocking pings
+                pass
+        self._count('events_published')
+
+    def open_stream(self):
+        """Reserve a stream slot; False when max_streams are already open"""
+        with self._lock:
+            if self._open_streams >= self.max_streams:
+                self._stats['streams_rejected'] += 1
+                return False
+            self._open_streams += 1
+            return True
+
+    def close_stream(self):
+        with self._lock:
+            self._open_streams -= 1
+
+    def _local_subscribe(self, delivery_id):
+        q = queue.Queue(maxsize=100)
+        with self._lock:
+            self._subscribers.setdefault(delivery_id, set()).add(q)
+        return q
+
+    def _local_unsubscribe(self, delivery_id, q):
+        with self._lock:
+            subscribers = self._subscribers.get(delivery_id)
+            if subscribers is not None:
+                subscribers.discard(q)
+                if not subscribers:
+                    del self._subscribers[delivery_id]
+
+    def subscribe(self, delivery_id, max_seconds=None):
+        """
+        Yield (event, data) tuples for a delivery as they are published.
+
+        (None, None) is yielded every keepalive seconds without events so
+        the caller can write a heartbeat. Ends after max_seconds so
+        long-lived streams release their server thread; EventSource clients
+        reconnect automatically.
+        """
+        deadline = time.monotonic() + max_seconds if max_seconds else None
+        pubsub = None
+        if self._use_redis():
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL_PREFIX + delivery_id)
+            except Exception:
+                self._redis_failed()
+                pubsub = None
+        local = self._local_subscribe(delivery_id) if pubsub is None else None
+
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                timeout = self.keepalive
+                if deadline is not None:
+                    timeout = max(min(timeout, deadline - time.monotonic()), 0)
+                if pubsub is not None:
+                    try:
+                        message = pubsub.get_message(timeout=timeout)
+                    except Exception:
+                        # End the stream; the client reconnects and resubscribes
+                        self._redis_failed()
+                        return
+                    raw = message['data'] if message is not None else None
+                else:
+                    try:
+                        raw = local.get(timeout=timeout)
+                    except queue.Empty:
+                        raw = None
+                if raw is None:
+                    yield None, None
+                    continue
+                payload = json.loads(raw)
+                yield payload['event'], payload['data']
+        finally:
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            else:
+                self._local_unsubscribe(delivery_id, local)
+
+    def stats(self):
+        """Ping, recompute and fan-out counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['local_subscribers'] = sum(len(s) for s in self._subscribers.values())
+            stats['open_streams'] = self._open_streams
+            stats['max_streams'] = self.max_streams
+        stats['backend'] = self.backend
+        stats['recompute_rate'] = stats['recomputes'] / stats['pings'] if stats['pings'] else 0.0
+        return stats
@@ -0,0 +1,61 @@
+"""
+Precomputed ETA lookup table
+
+The model's only inputs are distance_km, hour and weekday, so its whole
+input space fits in a dense 24 x 7 x D table over a fine distance grid.
+LookupTable answers by linear interpolation along distance, which makes a
+prediction a couple of array reads regardless of forest size. Distances
+beyond the grid are left to the model.
+"""
+import numpy as np
+
+HOURS = 24
+WEEKDAYS = 7
+
+class LookupTable:
+    """ETA predictions on an hour x weekday x distance grid"""
+
+    def __init__(self, table, distance_step):
+        self.table = table
+        self.distance_step = float(distance_step)
+        self.max_distance = (table.shape[2] - 1) * self.distance_step
+
+    @classmethod
+    def build(cls, predict, max_distance=50.0, distance_step=0.05):
+        """Evaluate predict(X) over the full grid in one batched call"""
+        distances = np.arange(0, max_distance + distance_step / 2, distance_step)
+        hours, weekdays, grid_distances = np.meshgrid(
+            np.arange(HOURS), np.arange(WEEKDAYS), distances, indexing='ij'
+        )
+        X = np.column_stack([grid_distances.ravel(), hours.ravel(), weekdays.ravel()])
+        table = np.asarray(predict(X), dtype=np.float32).reshape(HOURS, WEEKDAYS, len(distances))
+        return cls(table, distance_step)
+
+    def covers(self, distance):
+        """Boolean mask of distances inside the grid"""
+        distance = np.asarray(distance, dtype=float)
+        return (distance >= 0) & (distance <= self.max_distance)
+
+    def predict(self, X):
+        """Interpolate predictions for an (n_samples, 3) array of in-range rows"""
+        X = np.asarray(X, dtype=float)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        position = X[:, 0] / self.distance_step
+        lower = np.clip(np.floor(position).astype(np.int64), 0, self.table.shape[2] - 2)
+        frac = position - lower
+        hour = X[:, 1].astype(np.int64)
+        weekday = X[:, 2].astype(np.int64)
+
+        below = self.table[hour, weekday, lower]
+        above = self.table[hour, weekday, lower + 1]
+        return below + (above - below) * frac
+
+    def error_against(self, predict, X):
+        """Max and mean absolute interpolation error versus predict on in-range rows of X"""
+        X = np.asarray(X, dtype=float)
+        X = X[self.covers(X[:, 0])]
+        if len(X) == 0:
+            return {'max_error': None, 'mean_error': None, 'rows': 0}
+        error = np.abs(self.predict(X) - np.asarray(predict(X)))
+        return {'max_error': float(error.max()), 'mean_error': float(error.mean()), 'rows': int(len(X))}
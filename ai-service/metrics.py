@@ -0,0 +1,172 @@
+"""
+Latency instrumentation
+
+Request latency is recorded per endpoint and hot-path stages (distance,
+inference, cache I/O, DB queries) per endpoint and stage, in fixed-bucket
+histograms rendered in the Prometheus text format by render().
+
+    with metrics.span('inference'):
+        ...
+
+The endpoint label comes from a context variable that the Flask app sets for
+each request; work outside a request is labelled 'none'. Setting
+METRICS_ENABLED=0 turns every span into a shared no-op context manager and
+the request hooks into early returns.
+
+Values that only grow (cache hits, rows written, errors) are exported as
+Prometheus counters named <name>_total so rate() applies; levels (buffered
+rows, connections in use) as gauges.
+
+Histograms and counters are per process: under gunicorn each worker
+reports its own requests, so scrape every worker or sum across them.
+"""
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+
+# Seconds; spans of interest range from ~10 us (lookup) to seconds (DB)
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+_endpoint = contextvars.ContextVar('metrics_endpoint', default='none')
+_NOOP = nullcontext()
+
+class Histogram:
+    """Cumulative-bucket latency histogram keyed by a tuple of label values"""
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # [per-bucket counts..., +Inf count, sum]
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            label_text = ','.join(
+                f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels)
+            )
+            prefix = label_text + ',' if label_text else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {series[-1]}')
+            lines.append(f'{self.name}_count{{{label_text}}} {cumulative}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+REQUEST_LATENCY = Histogram(
+    'eta_request_duration_seconds', 'Request latency by endpoint', ('endpoint', 'method', 'status')
+)
+STAGE_LATENCY = Histogram(
+    'eta_stage_duration_seconds', 'Hot-path stage latency by endpoint', ('endpoint', 'stage')
+)
+
+_collectors = []
+
+def register_gauge(name, help_text, read, label='key'):
+    """Expose read() (a number, or a {label value: number} dict) as a gauge"""
+    _collectors.append((name, help_text, read, label, 'gauge'))
+
+def register_counter(name, help_text, read, label='key'):
+    """Expose read(), a total since process start, as the counter <name>_total"""
+    _collectors.append((name + '_total', help_text, read, label, 'counter'))
+
+class Counter:
+    """Event counter keyed by one label, exported as <name>_total"""
+
+    def __init__(self, name, help_text, label='key'):
+        self._values = {}
+        self._lock = threading.Lock()
+        register_counter(name, help_text, self.values, label)
+
+    def inc(self, key, n=1):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+class _Span:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_LATENCY.observe((_endpoint.get(), self.stage), time.perf_counter() - self.start)
+        return False
+
+def span(stage):
+    """Context manager timing one stage of the current request"""
+    return _Span(stage) if METRICS_ENABLED else _NOOP
+
+def start_request(endpoint):
+    """Label subsequent spans with endpoint; returns a token for finish_request"""
+    if not METRICS_ENABLED:
+        return None
+    return _endpoint.set(endpoint or 'unknown'), time.perf_counter()
+
+def finish_request(token, method, status):
+    """Record the latency of a request started with start_request"""
+    if token is None:
+        return
+    context_token, start = token
+    REQUEST_LATENCY.observe((_endpoint.get(), method, str(status)), time.perf_counter() - start)
+    _endpoint.reset(context_token)
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = REQUEST_LATENCY.render() + STAGE_LATENCY.render()
+    for name, help_text, read, label, kind in _collectors:
+        try:
+            value = read()
+        except Exception:
+            continue
+        if value is None or value == {}:
+            continue
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        if isinstance(value, dict):
+            lines += [f'{name}{{{label}="{_escape(key)}"}} {float(v)}' for key, v in sorted(value.items())]
+        else:
+            lines.append(f'{name} {float(value)}')
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    REQUEST_LATENCY.reset()
+    STAGE_LATENCY.reset()
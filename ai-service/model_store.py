@@ -0,0 +1,233 @@
+"""
+Versioned model artifacts
+
+Each trained model is published as a directory models/model-<version>/:
+
+    metadata.json    version, feature list, training MAE and other results
+    forest/*.npy     the tree ensemble flattened into contiguous node arrays
+                     (feature, threshold, left, right, value, roots)
+    sklearn.joblib   the fitted estimator, stored uncompressed
+    lookup.npy       optional precomputed hour x weekday x distance ETA table
+
+The directory is written under a temporary name and renamed into place, then
+the LATEST pointer file is replaced atomically, so a reader never sees a
+partially written model.
+
+The flat .npy arrays are opened with np.load(mmap_mode='r'): every worker
+maps the same read-only pages instead of deserializing a private copy.
+The sklearn estimator is loaded with joblib's mmap_mode too, but sklearn
+copies tree nodes into private memory on unpickle, so it only benefits
+from the shared page cache on disk reads. joblib (and through the pickle,
+sklearn) is imported only when the estimator is saved or loaded, so a
+worker serving from the flat arrays never pays for it.
+
+`python model_store.py measure [version]` reports load time and RSS growth
+for both paths.
+"""
+import datetime
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+
+import numpy as np
+
+MODEL_DIR = os.getenv('MODEL_DIR', 'models')
+LATEST_POINTER = 'LATEST'
+LEGACY_MODEL_PATH = 'model.pkl'
+FORMAT_VERSION = 1
+
+FOREST_ARRAYS = ('feature', 'threshold', 'left', 'right', 'value', 'roots')
+
+def _atomic_write_text(path, text):
+    tmp_path = f'{path}.tmp-{uuid.uuid4().hex}'
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def new_version():
+    """Return a sortable, unique model version string"""
+    return '{}-{}'.format(datetime.datetime.now().strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:8])
+
+def artifact_dir(version, model_dir=None):
+    return os.path.join(model_dir or MODEL_DIR, f'model-{version}')
+
+def flatten_forest(model):
+    """
+    Flatten a fitted tree ensemble into contiguous node arrays.
+
+    Node indices are global across trees. Leaves point to themselves on both
+    sides, so a walk can run a fixed number of steps without masking.
+    """
+    estimators = getattr(model, 'estimators_', [model])
+    offsets = np.cumsum([0] + [est.tree_.node_count for est in estimators])
+
+    feature, threshold, left, right, value = [], [], [], [], []
+    for offset, est in zip(offsets, estimators):
+        tree = est.tree_
+        node_ids = np.arange(tree.node_count) + offset
+        is_leaf = tree.children_left == -1
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(np.where(is_leaf, 0.0, tree.threshold))
+        left.append(np.where(is_leaf, node_ids, tree.children_left + offset))
+        right.append(np.where(is_leaf, node_ids, tree.children_right + offset))
+        value.append(tree.value.reshape(tree.node_count, -1)[:, 0])
+
+    return {
+        'feature': np.concatenate(feature).astype(np.int32),
+        'threshold': np.concatenate(threshold).astype(np.float64),
+        'left': np.concatenate(left).astype(np.int32),
+        'right': np.concatenate(right).astype(np.int32),
+        'value': np.concatenate(value).astype(np.float64),
+        'roots': offsets[:-1].astype(np.int32)
+    }, max(est.tree_.max_depth for est in estimators)
+
+def save_model(model, metadata=None, model_dir=None, version=None, lookup_table=None):
+    """Write a new model version and point LATEST at it. Returns the version."""
+    import joblib
+
+    model_dir = model_dir or MODEL_DIR
+    os.makedirs(model_dir, exist_ok=True)
+    version = version or new_version()
+
+    forest, max_depth = flatten_forest(model)
+    metadata = dict(metadata or {})
+    metadata.update({
+        'version': version,
+        'created_at': datetime.datetime.now().isoformat(),
+        'format_version': FORMAT_VERSION,
+        'features': list(getattr(model, 'feature_names_in_', ['distance_km', 'hour', 'weekday'])),
+        'n_trees': int(len(forest['roots'])),
+        'n_nodes': int(len(forest['value'])),
+        'max_depth': int(max_depth)
+    })
+    if lookup_table is not None:
+        metadata['lookup_distance_step'] = lookup_table.distance_step
+
+    final_dir = artifact_dir(version, model_dir)
+    tmp_dir = f'{final_dir}.tmp-{uuid.uuid4().hex}'
+    try:
+        os.makedirs(os.path.join(tmp_dir, 'forest'))
+        for name, arr in forest.items():
+            np.save(os.path.join(tmp_dir, 'forest', f'{name}.npy'), np.ascontiguousarray(arr))
+        joblib.dump(model, os.path.join(tmp_dir, 'sklearn.joblib'), compress=0)
+        if lookup_table is not None:
+            np.save(os.path.join(tmp_dir, 'lookup.npy'), lookup_table.table)
+        with open(os.path.join(tmp_dir, 'metadata.json'), 'w') as f:
+            json.dump(metadata, f, default=str, indent=2)
+        os.rename(tmp_dir, final_dir)
+    finally:
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+
+    _atomic_write_text(os.path.join(model_dir, LATEST_POINTER), version)
+    return version
+
+def latest_version(model_dir=None):
+    """Return the version LATEST points at, or None"""
+    try:
+        with open(os.path.join(model_dir or MODEL_DIR, LATEST_POINTER)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def pointer_mtime(model_dir=None):
+    """Modification time of the LATEST pointer, or None if absent"""
+    try:
+        return os.stat(os.path.join(model_dir or MODEL_DIR, LATEST_POINTER)).st_mtime
+    except FileNotFoundError:
+        return None
+
+def load_metadata(version, model_dir=None):
+    try:
+        with open(os.path.join(artifact_dir(version, model_dir), 'metadata.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'version': version}
+
+def load_forest(version, model_dir=None, mmap=True):
+    """Open the flat forest arrays of a version, memory-mapped read-only by default"""
+    forest_dir = os.path.join(artifact_dir(version, model_dir), 'forest')
+    mmap_mode = 'r' if mmap else None
+    return {
+        name: np.load(os.path.join(forest_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+        for name in FOREST_ARRAYS
+    }
+
+def load_lookup(version, metadata, model_dir=None):
+    """Open the lookup table of a version (memory-mapped), or None if it has none"""
+    from lookup import LookupTable
+
+    path = os.path.join(artifact_dir(version, model_dir), 'lookup.npy')
+    if 'lookup_distance_step' not in metadata or not os.path.exists(path):
+        return None
+    return LookupTable(np.load(path, mmap_mode='r'), metadata['lookup_distance_step'])
+
+def load_sklearn_model(version, model_dir=None):
+    """Load the fitted sklearn estimator of a version"""
+    import joblib
+
+    return joblib.load(os.path.join(artifact_dir(version, model_dir), 'sklearn.joblib'), mmap_mode='r')
+
+def load_model(version=None, model_dir=None):
+    """
+    Load a model version (LATEST by default).
+
+    Falls back to the legacy model.pkl when no versioned artifact exists.
+    Returns (model, version) or (None, None).
+    """
+    version = version or latest_version(model_dir)
+    if version is not None:
+        return load_sklearn_model(version, model_dir), version
+    if os.path.exists(LEGACY_MODEL_PATH):
+        import joblib
+
+        return joblib.load(LEGACY_MODEL_PATH), 'legacy'
+    return None, None
+
+def _rss_mb():
+    """Resident set size of this process in MB (Linux)"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+
+def _touch(forest):
+    """Fault in every page of the mapped arrays"""
+    for arr in forest.values():
+        arr.sum()
+    return forest
+
+def measure_load(version=None, model_dir=None):
+    """Time and RSS growth of loading the sklearn pickle versus the mmap'd flat arrays"""
+    version = version or latest_version(model_dir)
+    if version is None:
+        raise ValueError('No published model version')
+    report = {'version': version}
+
+    for name, load in (
+        ('flat_mmap', lambda: load_forest(version, model_dir)),
+        ('flat_mmap_touched', lambda: _touch(load_forest(version, model_dir))),
+        ('sklearn_joblib', lambda: load_sklearn_model(version, model_dir)),
+    ):
+        rss_before = _rss_mb()
+        start = time.perf_counter()
+        loaded = load()
+        report[name] = {
+            'load_seconds': round(time.perf_counter() - start, 4),
+            # Mapped pages count towards RSS once touched but are shared
+            # between workers through the page cache
+            'rss_growth_mb': round(_rss_mb() - rss_before, 2)
+        }
+        del loaded
+    return report
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'measure':
+        print(json.dumps(measure_load(sys.argv[2] if len(sys.argv) > 2 else None), indent=2))
+    else:
+        print('usage: python model_store.py measure [version]')
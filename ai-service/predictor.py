@@ -0,0 +1,505 @@
+"""
+ETA prediction model
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import metrics
+import model_store
+import training
+from inference import FlatForest, PARITY_TOLERANCE, max_parity_error
+from lookup import LookupTable
+from db import db_connection
+from utils import calculate_distance, calculate_distances, generate_delivery_data
+
+# The model and its version are swapped together as one immutable value, so
+# a concurrent prediction sees either the old or the new model, never a mix
+ServingModel = namedtuple('ServingModel', ['model', 'version', 'engine', 'metadata', 'lookup'])
+
+# Rows of the held-out set used to verify the flat engine against sklearn
+PARITY_SAMPLE_ROWS = 2000
+
+logger = logging.getLogger(__name__)
+
+# Predictions the flat engine could not serve, by exception type
+ENGINE_FALLBACKS = metrics.Counter(
+    'eta_engine_fallbacks', 'Predictions that fell back from the flat engine to sklearn', label='error'
+)
+
+def _sklearn_predict(model, features):
+    """Predict with named columns, as the estimator was fitted on a DataFrame"""
+    import pandas as pd
+
+    return model.predict(pd.DataFrame(np.asarray(features), columns=training.FEATURE_COLUMNS))
+
+class ETAPredictor:
+    def __init__(self, model_dir=None, inference_engine=None, prediction_mode=None, redis_client=None):
+        self.model_dir = model_dir
+        # Client for the completed-deliveries queue read by incremental updates
+        self.redis_client = redis_client
+        # 'flat' evaluates the flattened forest directly, 'sklearn' always
+        # goes through RandomForestRegressor.predict
+        self.inference_engine = inference_engine or os.getenv('INFERENCE_ENGINE', 'flat')
+        # 'model' runs the forest per request, 'lookup' interpolates in the
+        # precomputed hour x weekday x distance table
+        self.prediction_mode = prediction_mode or os.getenv('PREDICTION_MODE', 'model')
+        self._serving = ServingModel(None, None, None, {}, None)
+        self._reload_lock = threading.Lock()
+        self._reloading = False
+        self._pointer_mtime = None
+        self._pointer_checked_at = 0.0
+        self._engine_failed_version = None
+
+    @property
+    def model(self):
+        """The sklearn estimator, loaded on first use when serving from the flat engine"""
+        serving = self._serving
+        if serving.model is None and serving.version not in (None, 'legacy'):
+            model = model_store.load_sklearn_model(serving.version, self.model_dir)
+            if self._serving is serving:
+                self._serving = serving._replace(model=model)
+            return model
+        return serving.model
+
+    @property
+    def engine(self):
+        return self._serving.engine
+
+    @property
+    def version(self):
+        return self._serving.version
+
+    @property
+    def metadata(self):
+        return self._serving.metadata
+
+    @property
+    def is_trained(self):
+        serving = self._serving
+        return serving.model is not None or serving.engine is not None
+
+    @property
+    def lookup(self):
+        return self._serving.lookup
+
+    def set_model(self, model, version=None, engine=None, metadata=None, lookup=None):
+        """Atomically replace the serving model"""
+        self._serving = ServingModel(model, version, engine, metadata or {'version': version}, lookup)
+
+    def _load_engine(self, version, metadata):
+        """Open the flat engine for a version if it was verified against sklearn"""
+        if self.inference_engine != 'flat' or not metadata.get('engine_verified'):
+            return None
+        return FlatForest(model_store.load_forest(version, self.model_dir), metadata.get('max_depth'))
+
+    def load(self, version=None):
+        """Load a saved model version (LATEST by default). Returns True if loaded."""
+        self._pointer_mtime = model_store.pointer_mtime(self.model_dir)
+        version = version or model_store.latest_version(self.model_dir)
+
+        if version is not None:
+            metadata = model_store.load_metadata(version, self.model_dir)
+            engine = self._load_engine(version, metadata)
+            # The sklearn estimator is only deserialized when it is needed
+            model = None if engine is not None else model_store.load_sklearn_model(version, self.model_dir)
+            lookup = model_store.load_lookup(version, metadata, self.model_dir)
+            self.set_model(model, version, engine, metadata, lookup)
+            return True
+
+        model, version = model_store.load_model(None, self.model_dir)
+        if model is None:
+            return False
+        self.set_model(model, version)
+        return True
+
+    def maybe_reload(self, interval=None):
+        """
+        Pick up a newer published model without blocking the caller.
+
+        The LATEST pointer is stat'ed at most once per interval seconds; when
+        it changes the new version is loaded on a background thread and
+        swapped in once fully deserialized.
+        """
+        interval = float(interval if interval is not None else os.getenv('MODEL_RELOAD_INTERVAL', '5'))
+        now = time.monotonic()
+        if now - self._pointer_checked_at < interval:
+            return
+        self._pointer_checked_at = now
+
+        mtime = model_store.pointer_mtime(self.model_dir)
+        if mtime is None or mtime == self._pointer_mtime:
+            return
+
+        with self._reload_lock:
+            if self._reloading:
+                return
+            self._reloading = True
+
+        def reload():
+            try:
+                version = model_store.latest_version(self.model_dir)
+                if version != self.version:
+                    self.load(version)
+                self._pointer_mtime = mtime
+            finally:
+                self._reloading = False
+
+        threading.Thread(target=reload, daemon=True).start()
+
+    def generate_sample_data(self, n_samples=1000, seed=42):
+        """Generate sample delivery data for training"""
+        return generate_delivery_data(n_samples, seed=seed, with_order_ids=True)
+
+    def fit(self, sources=None, max_rows=None, chunksize=None):
+        """
+        Fit a new model without touching the serving one
+
+        sources is a list of 'synthetic', 'csv' and/or 'db'. Records are
+        streamed in chunks into a bounded reservoir sample of max_rows.
+        Returns (model, results, lookup_table).
+        """
+        from sklearn.ensemble import RandomForestRegressor
+        from sklearn.metrics import mean_absolute_error
+        from sklearn.model_selection import train_test_split
+
+        started_at = datetime.datetime.now()
+        sources = sources or os.getenv('TRAINING_SOURCES', 'synthetic').split(',')
+        max_rows = int(max_rows or os.getenv('TRAINING_MAX_ROWS', '5000000'))
+        chunksize = int(chunksize or os.getenv('TRAINING_CHUNK_SIZE', '100000'))
+
+        streams = []
+        watermark = {}
+        for source in sources:
+            if source == 'synthetic':
+                streams.append(training.iter_synthetic_chunks(
+                    int(os.getenv('TRAINING_SYNTHETIC_SAMPLES', '1000')), chunksize=chunksize
+                ))
+            elif source == 'csv':
+                streams.append(training.iter_csv_chunks(
+                    os.getenv('TRAINING_CSV_PATH', training.HISTORICAL_CSV), chunksize=chunksize
+                ))
+            elif source == 'db':
+                streams.append(training.iter_db_chunks(db_connection, chunksize=chunksize, watermark=watermark))
+            else:
+                raise ValueError(f"Unknown training source '{source}'")
+
+        df, rows_seen = training.collect_training_set(streams, max_rows=max_rows)
+        if len(df) < 2:
+            raise ValueError('Not enough training data')
+
+        # Features and target
+        X = df[training.FEATURE_COLUMNS]
+        y = df[training.TARGET_COLUMN]
+
+        # Split data
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+        # Train model
+        model = RandomForestRegressor(n_estimators=100, random_state=42)
+        model.fit(X_train, y_train)
+
+        # Evaluate
+        predictions = model.predict(X_test)
+        mae = mean_absolute_error(y_test, predictions)
+
+        checks, lookup = self._verify_and_build_lookup(model, X_test)
+
+        return model, dict({
+            'mode': 'full',
+            'mae': mae,
+            'baseline_mae': mae,
+            'samples_trained': len(df),
+            'test_samples': len(X_test),
+            'rows_seen': rows_seen,
+            'sources': sources,
+            'data_through': started_at.isoformat(),
+            'db_through': watermark.get('db_through')
+        }, **checks), lookup
+
+    def _verify_and_build_lookup(self, model, X_test):
+        """Flat-engine parity and the lookup table for a fitted model. Returns (results, lookup)."""
+        # Verify the flat inference engine reproduces sklearn's predictions
+        forest, max_depth = model_store.flatten_forest(model)
+        parity_error = max_parity_error(
+            FlatForest(forest, max_depth), model, X_test.iloc[:PARITY_SAMPLE_ROWS]
+        )
+
+        # Precompute the lookup table and measure its interpolation error on
+        # the held-out set
+        predict = lambda X: _sklearn_predict(model, X)
+        lookup = LookupTable.build(
+            predict,
+            max_distance=float(os.getenv('LOOKUP_MAX_DISTANCE', '50')),
+            distance_step=float(os.getenv('LOOKUP_DISTANCE_STEP', '0.05'))
+        )
+        lookup_error = lookup.error_against(predict, X_test.to_numpy())
+
+        return {
+            'engine_parity_error': parity_error,
+            'engine_verified': parity_error <= PARITY_TOLERANCE,
+            'lookup_max_error': lookup_error['max_error'],
+            'lookup_mean_error': lookup_error['mean_error']
+        }, lookup
+
+    def _incremental_streams(self, sources, since, chunksize, consumed):
+        streams = []
+        for source in sources:
+            if source == 'queue':
+                if self.redis_client is None:
+                    raise ValueError("The 'queue' source needs a Redis client")
+                streams.append(training.iter_queue_chunks(self.redis_client, chunksize=chunksize, consumed=consumed))
+            elif source == 'db':
+                streams.append(training.iter_db_chunks(
+                    db_connection, chunksize=chunksize, query=training.DB_RECENT_QUERY, params=(since,),
+                    watermark=consumed
+                ))
+            elif source == 'synthetic':
+                # Fresh random draws stand in for new deliveries
+                streams.append(training.iter_synthetic_chunks(
+                    int(os.getenv('TRAINING_SYNTHETIC_SAMPLES', '1000')), chunksize=chunksize, seed=None
+                ))
+            else:
+                raise ValueError(f"Unknown incremental source '{source}'")
+        return streams
+
+    def fit_incremental(self, base_version, sources=None, max_rows=None, chunksize=None, consumed=None):
+        """
+        Grow a published model with trees fitted on deliveries it has not seen
+
+        New rows come from the completed-deliveries queue ('queue') and/or
+        Postgres rows written (updated_at) after the base version's
+        db_through watermark ('db'). The queue is only read; consumed
+        receives the number of queue records read ('queue') and the new
+        database watermark ('db_through') for the caller to commit. The base forest is warm-started with
+        INCREMENTAL_TREES new trees fitted on those rows only, so cost scales
+        with the new data; past INCREMENTAL_MAX_TREES the oldest trees are
+        dropped. Before updating, the base model is scored on the new rows
+        and the result is appended to a sliding window of per-batch MAEs
+        (EVAL_WINDOW_BATCHES) carried in the metadata, whose ratio to the
+        last full retrain's MAE tracks drift.
+
+        Returns (model, results, lookup_table); model is None when there were
+        fewer than INCREMENTAL_MIN_ROWS new rows.
+        """
+        from sklearn.metrics import mean_absolute_error
+        from sklearn.model_selection import train_test_split
+
+        started_at = datetime.datetime.now()
+        sources = sources or os.getenv('INCREMENTAL_SOURCES', 'queue').split(',')
+        max_rows = int(max_rows or os.getenv('INCREMENTAL_MAX_ROWS', '500000'))
+        chunksize = int(chunksize or os.getenv('TRAINING_CHUNK_SIZE', '100000'))
+        consumed = {} if consumed is None else consumed
+        base_metadata = model_store.load_metadata(base_version, self.model_dir)
+        since = (base_metadata.get('db_through') or base_metadata.get('data_through')
+                 or base_metadata.get('created_at'))
+
+        df, rows_seen = training.collect_training_set(
+            self._incremental_streams(sources, since, chunksize, consumed), max_rows=max_rows
+        )
+        if len(df) < int(os.getenv('INCREMENTAL_MIN_ROWS', '50')):
+            return None, {
+                'mode': 'incremental', 'skipped': True, 'new_rows': len(df),
+                'base_version': base_version, 'sources': sources
+            }, None
+
+        X = df[training.FEATURE_COLUMNS]
+        y = df[training.TARGET_COLUMN]
+        model = model_store.load_sklearn_model(base_version, self.model_dir)
+
+        # Prequential evaluation: the serving model has not seen these rows yet
+        batch_mae = mean_absolute_error(y, _sklearn_predict(model, X))
+        window = list(base_metadata.get('eval_window') or [])
+        window.append({'at': started_at.isoformat(), 'rows': len(df), 'mae': batch_mae})
+        window = window[-int(os.getenv('EVAL_WINDOW_BATCHES', '20')):]
+        window_mae = sum(b['mae'] * b['rows'] for b in window) / sum(b['rows'] for b in window)
+        baseline_mae = base_metadata.get('baseline_mae', base_metadata.get('mae'))
+        drift_ratio = window_mae / baseline_mae if baseline_mae else None
+
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        trees_before = len(model.estimators_)
+        new_trees = int(os.getenv('INCREMENTAL_TREES', '20'))
+        model.set_params(warm_start=True, n_estimators=trees_before + new_trees)
+        model.fit(X_train, y_train)
+
+        max_trees = int(os.getenv('INCREMENTAL_MAX_TREES', '300'))
+        if len(model.estimators_) > max_trees:
+            model.estimators_ = model.estimators_[-max_trees:]
+            model.set_params(n_estimators=max_trees)
+
+        checks, lookup = self._verify_and_build_lookup(model, X_test)
+        return model, dict({
+            'mode': 'incremental',
+            'base_version': base_version,
+            'mae': mean_absolute_error(y_test, model.predict(X_test)),
+            'baseline_mae': baseline_mae,
+            'batch_mae': batch_mae,
+            'window_mae': window_mae,
+            'eval_window': window,
+            'drift_ratio': drift_ratio,
+            'drift_detected': drift_ratio is not None and drift_ratio > float(os.getenv('DRIFT_THRESHOLD', '1.25')),
+            'new_rows': len(df),
+            'rows_seen': rows_seen,
+            'trees_added': new_trees,
+            'trees_total': len(model.estimators_),
+            'sources': sources,
+            'data_through': started_at.isoformat(),
+            'db_through': consumed.get('db_through', since)
+        }, **checks), lookup
+
+    def _publish(self, model, results, lookup):
+        """Save a fitted model as a new version and start serving it"""
+        version = model_store.save_model(model, results, self.model_dir, lookup_table=lookup)
+        metadata = model_store.load_metadata(version, self.model_dir)
+        self.set_model(
+            model, version, self._load_engine(version, metadata), metadata,
+            model_store.load_lookup(version, metadata, self.model_dir)
+        )
+        self._pointer_mtime = model_store.pointer_mtime(self.model_dir)
+        results['version'] = version
+        return results
+
+    def train_model(self, sources=None, max_rows=None, chunksize=None):
+        """Train, publish and start serving a new model version"""
+        model, results, lookup = self.fit(sources=sources, max_rows=max_rows, chunksize=chunksize)
+        return self._publish(model, results, lookup)
+
+    def update_model(self, sources=None, max_rows=None, chunksize=None):
+        """
+        Incrementally update the latest published model; trains from scratch if there is none
+
+        Queue records are removed only after the new version is published,
+        so a skipped or failed update leaves them for the next one. A Redis
+        lock keeps two updates from reading (and trimming) the same records;
+        an update that finds it held is skipped.
+        """
+        from redis.exceptions import LockError
+
+        base_version = model_store.latest_version(self.model_dir)
+        if base_version is None:
+            return self.train_model(max_rows=max_rows, chunksize=chunksize)
+
+        sources = sources or os.getenv('INCREMENTAL_SOURCES', 'queue').split(',')
+        lock = None
+        if 'queue' in sources and self.redis_client is not None:
+            lock = self.redis_client.lock(
+                training.COMPLETED_QUEUE + ':lock',
+                timeout=int(os.getenv('TRAINING_JOB_TIMEOUT', '3600')), blocking=False
+            )
+            if not lock.acquire():
+                return {
+                    'mode': 'incremental', 'skipped': True, 'reason': 'another incremental update is running',
+                    'base_version': base_version, 'sources': sources, 'version': base_version
+                }
+
+        try:
+            consumed = {}
+            model, results, lookup = self.fit_incremental(
+                base_version, sources=sources, max_rows=max_rows, chunksize=chunksize, consumed=consumed
+            )
+            if model is None:
+                results['version'] = base_version
+                return results
+            results = self._publish(model, results, lookup)
+            if 'queue' in sources:
+                training.ack_queue(self.redis_client, consumed.get('queue', 0))
+            return results
+        finally:
+            if lock is not None:
+                try:
+                    lock.release()
+                except LockError:
+                    pass  # Expired after TRAINING_JOB_TIMEOUT
+
+    def _predict_model(self, features):
+        """
+        Run the flat engine when available, falling back to sklearn
+
+        Only errors a damaged or mismatched artifact produces are caught
+        (bad indices or shapes, unreadable mapped files). Each fallback is
+        counted in eta_engine_fallbacks_total and logged once per version,
+        because the sklearn path is far slower and loads the full forest.
+        """
+        serving = self._serving
+        if serving.engine is not None:
+            try:
+                return serving.engine.predict(features)
+            except (IndexError, ValueError, TypeError, OSError) as e:
+                ENGINE_FALLBACKS.inc(type(e).__name__)
+                if self._engine_failed_version != serving.version:
+                    self._engine_failed_version = serving.version
+                    logger.warning('Flat engine failed for model %s, falling back to sklearn: %r',
+                                   serving.version, e)
+        return _sklearn_predict(self.model, features)
+
+    def _predict(self, features):
+        with metrics.span('inference'):
+            return self._predict_lookup_or_model(features)
+
+    def _predict_lookup_or_model(self, features):
+        """Answer from the lookup table where it covers the input, else from the model"""
+        lookup = self._serving.lookup
+        if self.prediction_mode != 'lookup' or lookup is None:
+            return self._predict_model(features)
+
+        covered = lookup.covers(features[:, 0])
+        if covered.all():
+            return lookup.predict(features)
+        predictions = np.empty(len(features))
+        predictions[covered] = lookup.predict(features[covered])
+        predictions[~covered] = self._predict_model(features[~covered])
+        return predictions
+
+    def predict_eta(self, current_lat, current_lng, dropoff_lat, dropoff_lng, distance=None,
+                    hour=None, weekday=None):
+        """Predict ETA for delivery"""
+        if not self.is_trained:
+            return None
+
+        if distance is None:
+            with metrics.span('distance'):
+                distance = calculate_distance(current_lat, current_lng, dropoff_lat, dropoff_lng)
+        if hour is None or weekday is None:
+            now = datetime.datetime.now()
+            hour = now.hour
+            weekday = now.weekday()
+
+        features = np.array([[distance, hour, weekday]])
+        eta_minutes = float(self._predict(features)[0])
+
+        return max(eta_minutes, 1)  # Minimum 1 minute
+
+    def predict_eta_features(self, distances, hours, weekdays):
+        """ETAs for arbitrary (distance, hour, weekday) rows with a single model call"""
+        if not self.is_trained:
+            return None
+        features = np.column_stack([distances, hours, weekdays])
+        return np.maximum(self._predict(features), 1)  # Minimum 1 minute
+
+    def predict_eta_batch(self, current_lats, current_lngs, dropoff_lats, dropoff_lngs, distances=None):
+        """Predict ETAs for many deliveries with a single model call
+
+        distances may be passed when the caller already computed them.
+        Returns a tuple of (eta_minutes, distance_km) NumPy arrays.
+        """
+        if not self.is_trained:
+            return None
+
+        if distances is None:
+            with metrics.span('distance'):
+                distances = calculate_distances(current_lats, current_lngs, dropoff_lats, dropoff_lngs)
+        now = datetime.datetime.now()
+
+        features = np.column_stack([
+            distances,
+            np.full(len(distances), now.hour),
+            np.full(len(distances), now.weekday())
+        ])
+        eta_minutes = self._predict(features)
+
+        return np.maximum(eta_minutes, 1), distances  # Minimum 1 minute
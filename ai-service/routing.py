@@ -0,0 +1,184 @@
+"""
+Multi-stop route ETAs
+
+A route starts at the driver's position and visits every stop once (an open
+path; the driver does not return). plan_route:
+
+1. builds the full pairwise distance matrix in one vectorized pass, taking
+   pairs seen before from a DistanceMatrixCache
+2. orders the stops with nearest-neighbour, then improves the order with
+   2-opt
+3. predicts every leg for each of the next 24 hourly (hour, weekday) buckets
+   in a single model call, then walks the route picking each leg's bucket
+   from the arrival time so far
+
+The heuristics are not optimal, but they settle 20 stops in well under a
+millisecond of matrix work.
+"""
+import datetime
+import os
+
+import numpy as np
+
+from cache import LRUCache
+from utils import calculate_distances
+
+class DistanceMatrixCache:
+    """
+    Pairwise distances keyed by grid-snapped endpoints
+
+    Recurring locations such as depots and landmarks keep their rows across
+    requests, so only pairs involving new stops are computed.
+    """
+
+    def __init__(self, grid_deg=None, max_pairs=None, ttl=86400):
+        self.grid_deg = float(grid_deg if grid_deg is not None else os.getenv('ROUTE_MATRIX_GRID_DEG', '0.0001'))
+        self.ttl = ttl
+        self.pairs = LRUCache(int(max_pairs if max_pairs is not None else os.getenv('ROUTE_MATRIX_CACHE_SIZE', '200000')))
+        self.hits = 0
+        self.misses = 0
+
+    def _snap(self, lat, lng):
+        return (int(round(lat / self.grid_deg)), int(round(lng / self.grid_deg)))
+
+    def matrix(self, lats, lngs):
+        """Symmetric (n, n) distance matrix in km for the given points"""
+        lats = np.asarray(lats, dtype=float)
+        lngs = np.asarray(lngs, dtype=float)
+        n = len(lats)
+        keys = [self._snap(lat, lng) for lat, lng in zip(lats, lngs)]
+        matrix = np.zeros((n, n))
+
+        rows, cols = np.triu_indices(n, k=1)
+        missing = []
+        for index, (i, j) in enumerate(zip(rows, cols)):
+            value = self.pairs.get((keys[i], keys[j]))
+            if value is None:
+                missing.append(index)
+            else:
+                matrix[i, j] = value
+
+        if missing:
+            missing = np.asarray(missing)
+            i, j = rows[missing], cols[missing]
+            distances = np.asarray(calculate_distances(lats[i], lngs[i], lats[j], lngs[j]), dtype=float)
+            matrix[i, j] = distances
+            for a, b, value in zip(i, j, distances):
+                self.pairs.setex((keys[a], keys[b]), self.ttl, float(value))
+                self.pairs.setex((keys[b], keys[a]), self.ttl, float(value))
+
+        self.hits += len(rows) - len(missing)
+        self.misses += len(missing)
+        return matrix + matrix.T
+
+    def warm(self, points):
+        """Precompute all pairs among recurring (lat, lng) points"""
+        points = list(points)
+        self.matrix([p[0] for p in points], [p[1] for p in points])
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'pairs_cached': len(self.pairs),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+def nearest_neighbour_order(matrix, start=0):
+    """Greedy open path from start through every node"""
+    n = len(matrix)
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    order = [start]
+    for _ in range(n - 1):
+        distances = np.where(visited, np.inf, matrix[order[-1]])
+        nxt = int(np.argmin(distances))
+        visited[nxt] = True
+        order.append(nxt)
+    return order
+
+def path_length(order, matrix):
+    order = np.asarray(order)
+    return float(matrix[order[:-1], order[1:]].sum())
+
+def two_opt(order, matrix, max_passes=50):
+    """
+    Improve an open path by reversing segments while that shortens it.
+
+    The first node (the driver's position) stays fixed. For each i the gain
+    of every reversal end j is evaluated at once with NumPy.
+    """
+    order = np.asarray(order)
+    n = len(order)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n - 1):
+            a, b = order[i - 1], order[i]
+            j = np.arange(i + 1, n)
+            c = order[j]
+            # Reversing order[i..j] swaps edges (a,b),(c,d) for (a,c),(b,d);
+            # the last node has no successor d
+            d = order[np.minimum(j + 1, n - 1)]
+            has_next = j + 1 < n
+            before = matrix[a, b] + np.where(has_next, matrix[c, d], 0.0)
+            after = matrix[a, c] + np.where(has_next, matrix[b, d], 0.0)
+            gain = before - after
+            best = int(np.argmax(gain))
+            if gain[best] > 1e-9:
+                k = j[best]
+                order[i:k + 1] = order[i:k + 1][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return order.tolist()
+
+def plan_route(predictor, start, stops, matrix_cache, optimize=True, service_minutes=0.0, departure=None):
+    """
+    Order stops and predict cumulative ETAs.
+
+    start is (lat, lng); stops is a list of (lat, lng). Returns a dict with
+    the visiting order (indices into stops) and per-stop legs.
+    """
+    departure = departure or datetime.datetime.now()
+    points = [start] + list(stops)
+    matrix = matrix_cache.matrix([p[0] for p in points], [p[1] for p in points])
+
+    if optimize and len(stops) > 1:
+        order = two_opt(nearest_neighbour_order(matrix), matrix)
+    else:
+        order = list(range(len(points)))
+    leg_distances = matrix[order[:-1], order[1:]]
+    n_legs = len(leg_distances)
+
+    # One model call: every leg at each of the next 24 hourly buckets
+    buckets = [departure + datetime.timedelta(hours=h) for h in range(24)]
+    bucket_hours = np.array([b.hour for b in buckets])
+    bucket_weekdays = np.array([b.weekday() for b in buckets])
+    leg_etas = predictor.predict_eta_features(
+        np.repeat(leg_distances, 24), np.tile(bucket_hours, n_legs), np.tile(bucket_weekdays, n_legs)
+    ).reshape(n_legs, 24)
+
+    legs = []
+    elapsed = 0.0
+    minutes_into_hour = departure.minute + departure.second / 60
+    for leg in range(n_legs):
+        # Hours crossed since departure select the leg's (hour, weekday) bucket
+        bucket = min(int((minutes_into_hour + elapsed) // 60), 23)
+        eta = float(leg_etas[leg, bucket])
+        elapsed += eta
+        legs.append({
+            'stop_index': order[leg + 1] - 1,
+            'leg_distance_km': round(float(leg_distances[leg]), 3),
+            'leg_eta_minutes': round(eta, 2),
+            'cumulative_eta_minutes': round(elapsed, 2),
+            'arrival_time': (departure + datetime.timedelta(minutes=elapsed)).isoformat()
+        })
+        elapsed += service_minutes
+
+    return {
+        'order': [index - 1 for index in order[1:]],
+        'legs': legs,
+        'total_distance_km': round(float(leg_distances.sum()), 3),
+        'total_eta_minutes': round(legs[-1]['cumulative_eta_minutes'], 2) if legs else 0.0
+    }
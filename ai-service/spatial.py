@@ -0,0 +1,297 @@
+"""
+In-memory spatial index over live driver positions
+
+DriverIndex buckets drivers into a fixed lat/lng grid (DRIVER_INDEX_CELL_KM,
+default 1 km). An upsert or remove touches one or two cells. A radius query
+visits only the cells overlapping the circle's bounding box and filters
+those candidates with one vectorized distance call. k-nearest queries widen
+the radius until k drivers are found. Positions older than
+DRIVER_POSITION_TTL seconds are ignored.
+
+A BallTree would give similar query times, but it has to be rebuilt on every
+ping. The grid absorbs a constant stream of upserts.
+
+DriverLocations keeps one index per process in sync across gunicorn workers.
+Each ping is written to a Redis hash (the snapshot a new worker loads) and
+published on a channel that every worker's listener thread applies. Without
+Redis, pings only update this process.
+"""
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from cache import RedisBacked
+from utils import calculate_distances
+
+KM_PER_DEG_LAT = 111.32
+
+# Stale positions are swept out of the index once per this many upserts
+PURGE_EVERY = 1024
+
+POSITIONS_KEY = 'drivers:positions'
+POSITIONS_CHANNEL = 'drivers:positions:updates'
+
+class DriverIndex:
+    """Grid index of driver positions with radius and k-nearest queries"""
+
+    def __init__(self, cell_km=None, ttl=None, capacity=1024):
+        self.cell_km = float(cell_km if cell_km is not None else os.getenv('DRIVER_INDEX_CELL_KM', '1'))
+        self.ttl = float(ttl if ttl is not None else os.getenv('DRIVER_POSITION_TTL', '300'))
+        self.cell_deg = self.cell_km / KM_PER_DEG_LAT
+        # Positions live in flat arrays addressed by slot; freed slots are reused
+        self._lat = np.empty(capacity)
+        self._lng = np.empty(capacity)
+        self._updated = np.empty(capacity)
+        self._ids = [None] * capacity
+        self._free = list(range(capacity - 1, -1, -1))
+        self._slots = {}
+        self._cells = {}
+        self._upserts = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._slots)
+
+    @property
+    def cell_count(self):
+        return len(self._cells)
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def _grow(self):
+        capacity = len(self._ids)
+        self._lat = np.resize(self._lat, capacity * 2)
+        self._lng = np.resize(self._lng, capacity * 2)
+        self._updated = np.resize(self._updated, capacity * 2)
+        self._ids.extend([None] * capacity)
+        self._free.extend(range(capacity * 2 - 1, capacity - 1, -1))
+
+    def upsert(self, driver_id, lat, lng, updated_at=None):
+        """Insert or move a driver. Older updates than the stored one are ignored."""
+        updated_at = time.time() if updated_at is None else updated_at
+        cell = self._cell(lat, lng)
+        with self._lock:
+            slot = self._slots.get(driver_id)
+            if slot is None:
+                if not self._free:
+                    self._grow()
+                slot = self._free.pop()
+                self._slots[driver_id] = slot
+                self._ids[slot] = driver_id
+            else:
+                if updated_at < self._updated[slot]:
+                    return
+                old_cell = self._cell(self._lat[slot], self._lng[slot])
+                if old_cell != cell:
+                    self._discard_from_cell(old_cell, slot)
+            self._lat[slot] = lat
+            self._lng[slot] = lng
+            self._updated[slot] = updated_at
+            self._cells.setdefault(cell, set()).add(slot)
+
+            self._upserts += 1
+            if self._upserts % PURGE_EVERY == 0:
+                self._purge_stale()
+
+    def _purge_stale(self):
+        """Free the slots of drivers that stopped pinging (lock held)"""
+        cutoff = time.time() - self.ttl
+        stale = [driver_id for driver_id, slot in self._slots.items() if self._updated[slot] < cutoff]
+        for driver_id in stale:
+            self._release(self._slots.pop(driver_id))
+
+    def _discard_from_cell(self, cell, slot):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(slot)
+            if not members:
+                del self._cells[cell]
+
+    def remove(self, driver_id):
+        """Drop a driver, e.g. when going off shift. Returns True if it was indexed."""
+        with self._lock:
+            slot = self._slots.pop(driver_id, None)
+            if slot is None:
+                return False
+            self._release(slot)
+            return True
+
+    def _release(self, slot):
+        self._discard_from_cell(self._cell(self._lat[slot], self._lng[slot]), slot)
+        self._ids[slot] = None
+        self._free.append(slot)
+
+    def position(self, driver_id):
+        """(lat, lng, updated_at) of a driver or None"""
+        with self._lock:
+            slot = self._slots.get(driver_id)
+            if slot is None:
+                return None
+            return float(self._lat[slot]), float(self._lng[slot]), float(self._updated[slot])
+
+    def within(self, lat, lng, radius_km):
+        """
+        Drivers within radius_km of a point, nearest first.
+
+        Returns (driver_ids, lats, lngs, distances_km).
+        """
+        dlat = radius_km / KM_PER_DEG_LAT
+        dlng = radius_km / (KM_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01))
+        lat_lo, lng_lo = self._cell(lat - dlat, lng - dlng)
+        lat_hi, lng_hi = self._cell(lat + dlat, lng + dlng)
+
+        with self._lock:
+            slots = []
+            if (lat_hi - lat_lo + 1) * (lng_hi - lng_lo + 1) > len(self._cells):
+                # Large radius: scanning occupied cells beats probing empty ones
+                for (cell_lat, cell_lng), members in self._cells.items():
+                    if lat_lo <= cell_lat <= lat_hi and lng_lo <= cell_lng <= lng_hi:
+                        slots.extend(members)
+            else:
+                for cell_lat in range(lat_lo, lat_hi + 1):
+                    for cell_lng in range(lng_lo, lng_hi + 1):
+                        members = self._cells.get((cell_lat, cell_lng))
+                        if members:
+                            slots.extend(members)
+            slots = np.fromiter(slots, dtype=np.int64, count=len(slots))
+            slots = slots[self._updated[slots] >= time.time() - self.ttl]
+            lats = self._lat[slots]
+            lngs = self._lng[slots]
+            driver_ids = [self._ids[slot] for slot in slots]
+
+        distances = np.asarray(
+            calculate_distances(lats, lngs, np.full(len(lats), lat), np.full(len(lats), lng)), dtype=float
+        )
+        order = np.argsort(distances, kind='stable')
+        order = order[distances[order] <= radius_km]
+        return [driver_ids[i] for i in order], lats[order], lngs[order], distances[order]
+
+    def nearest(self, lat, lng, k, max_radius_km=50.0):
+        """Up to k nearest drivers within max_radius_km, nearest first"""
+        radius = self.cell_km
+        while True:
+            found = self.within(lat, lng, radius)
+            if len(found[0]) >= k or radius >= max_radius_km:
+                return tuple(part[:k] for part in found)
+            radius = min(radius * 2, max_radius_km)
+
+class DriverLocations(RedisBacked):
+    """A DriverIndex kept in sync across worker processes through Redis"""
+
+    def __init__(self, redis_client=None, index=None):
+        self._init_redis(redis_client)
+        self.index = index or DriverIndex()
+        self._listener = None
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {'upserts': 0, 'removes': 0, 'remote_updates': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def update(self, driver_id, lat, lng):
+        """Record a driver ping locally and for the other workers"""
+        updated_at = time.time()
+        self.index.upsert(driver_id, lat, lng, updated_at)
+        self._count('upserts')
+        self._broadcast(driver_id, {'lat': lat, 'lng': lng, 'ts': updated_at})
+
+    def remove(self, driver_id):
+        """Take a driver out of the index in every worker"""
+        removed = self.index.remove(driver_id)
+        self._count('removes')
+        self._broadcast(driver_id, None)
+        return removed
+
+    def _broadcast(self, driver_id, position):
+        if not self._use_redis():
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            if position is None:
+                pipe.hdel(POSITIONS_KEY, driver_id)
+            else:
+                pipe.hset(POSITIONS_KEY, driver_id, json.dumps(position))
+            pipe.publish(POSITIONS_CHANNEL, json.dumps({'id': driver_id, 'position': position}))
+            pipe.execute()
+        except Exception:
+            self._redis_failed()
+
+    def _apply(self, driver_id, position):
+        if position is None:
+            self.index.remove(driver_id)
+        else:
+            self.index.upsert(driver_id, position['lat'], position['lng'], position['ts'])
+
+    def _load_snapshot(self):
+        cutoff = time.time() - self.index.ttl
+        stale = []
+        for driver_id, raw in self.redis_client.hgetall(POSITIONS_KEY).items():
+            position = json.loads(raw)
+            if position['ts'] < cutoff:
+                stale.append(driver_id)
+            else:
+                self._apply(driver_id, position)
+        if stale:
+            self.redis_client.hdel(POSITIONS_KEY, *stale)
+
+    def _listen(self):
+        while not self._stop.is_set():
+            if not self._use_redis():
+                self._stop.wait(self.retry_interval)
+                continue
+            pubsub = None
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(POSITIONS_CHANNEL)
+                # Subscribe before reading the snapshot so no update falls in between
+                self._load_snapshot()
+                while not self._stop.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    update = json.loads(message['data'])
+                    self._apply(update['id'], update['position'])
+                    self._count('remote_updates')
+            except Exception:
+                self._redis_failed()
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def start(self):
+        """Start the background listener that applies other workers' pings"""
+        if self.redis_client is None or (self._listener is not None and self._listener.is_alive()):
+            return
+        self._stop.clear()
+        self._listener = threading.Thread(target=self._listen, name='driver-locations', daemon=True)
+        self._listener.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def set_redis_client(self, redis_client):
+        """Swap the Redis client and restart the listener, e.g. after a worker fork"""
+        self.stop()
+        if self._listener is not None:
+            self._listener.join(timeout=2)
+        super().set_redis_client(redis_client)
+        self._listener = None
+        self.start()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['drivers'] = len(self.index)
+        stats['cells'] = self.index.cell_count
+        stats['backend'] = self.backend
+        return stats
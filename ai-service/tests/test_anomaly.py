@@ -0,0 +1,145 @@
+import json
+
+import numpy as np
+import pytest
+
+from anomaly import CRITICAL, NORMAL, WARNING, SensorAnomalyDetector, classify_sensor_rows
+from ingest import INGEST_TABLES, BufferFull, Ingestor
+
+SENSOR_COLUMNS = INGEST_TABLES['sensor'][1]
+
+def _detector(**options):
+    options = {'alpha': 0.1, 'window': 4, 'warmup': 5, 'warning_z': 3, 'critical_z': 5, 'min_std': 0.05,
+               **options}
+    return SensorAnomalyDetector(**options)
+
+def _steady(detector, key, n=20, seed=0):
+    values = 20 + np.random.default_rng(seed).normal(0, 0.5, n)
+    detector.evaluate([key] * n, values)
+    return values
+
+def test_warmup_readings_are_normal():
+    detector = _detector()
+    statuses, z_scores, _, alerted = detector.evaluate([('s1', 'A')] * 5, [1, 100, -50, 7, 1000])
+    assert (statuses == NORMAL).all() and (z_scores == 0).all() and not alerted.any()
+
+def test_outliers_are_classified_by_z_score():
+    detector = _detector()
+    _steady(detector, ('s1', 'A'))
+    state = detector.state('s1', 'A')
+    std = state['std']
+
+    statuses, z_scores, expected, alerted = detector.evaluate([('s1', 'A')], [state['mean'] + 4 * std])
+    assert statuses[0] == WARNING and alerted[0]
+    assert z_scores[0] == pytest.approx(4, rel=1e-6)
+    assert expected[0] == pytest.approx(state['mean'])
+
+    statuses, _, _, alerted = detector.evaluate([('s1', 'A')], [state['mean'] + 50 * std])
+    assert statuses[0] == CRITICAL and alerted[0]
+
+def test_one_alert_per_worsening():
+    detector = _detector()
+    _steady(detector, ('s1', 'A'))
+    _, _, _, alerted = detector.evaluate([('s1', 'A')] * 3, [100, 110, 120])
+    assert alerted.tolist() == [True, False, False]
+
+def test_batch_matches_sequential_evaluation():
+    rng = np.random.default_rng(1)
+    keys = [(f's{i}', 'Z') for i in rng.integers(0, 5, 300)]
+    values = rng.normal(10, 2, 300)
+    values[::37] += 40
+
+    batched = _detector().evaluate(keys, values)
+    single = _detector()
+    sequential = [single.evaluate([key], [value]) for key, value in zip(keys, values)]
+    for i, result in enumerate(batched):
+        np.testing.assert_allclose(result, np.concatenate([r[i] for r in sequential]))
+
+def test_state_lists_recent_readings_oldest_first():
+    detector = _detector()
+    detector.evaluate([('s1', None)] * 6, [1, 2, 3, 4, 5, 6])
+    state = detector.state('s1')
+    assert state['readings'] == 6 and state['recent'] == [3, 4, 5, 6]
+    assert state['mean'] == pytest.approx(3.5)
+    assert detector.state('missing') is None
+
+def test_least_recently_seen_sensor_is_recycled():
+    detector = _detector(max_slots=3)
+    for sensor in ('a', 'b', 'c'):
+        detector.evaluate([(sensor, None)], [1.0])
+    detector.evaluate([('a', None)], [1.0])
+    detector.evaluate([('d', None)], [5.0])
+
+    assert len(detector) == 3
+    assert detector.state('b') is None
+    assert detector.state('a')['readings'] == 2
+    assert detector.state('d')['readings'] == 1 and detector.state('d')['mean'] == 5.0
+    stats = detector.stats()
+    assert stats['evictions'] == 1 and stats['sensors'] == 3 and stats['max_sensors'] == 3
+
+def test_sensors_of_the_current_batch_are_not_recycled():
+    detector = _detector(max_slots=3)
+    detector.evaluate([('a', None), ('b', None), ('c', None)], [1.0, 2.0, 3.0])
+    detector.evaluate([('c', None), ('d', None), ('e', None)], [3.0, 4.0, 5.0])
+    assert detector.state('c')['readings'] == 2
+    assert detector.state('a') is None and detector.state('b') is None
+    assert detector.state('d')['readings'] == detector.state('e')['readings'] == 1
+
+def test_batch_above_the_cap_is_rejected():
+    detector = _detector(max_slots=2)
+    with pytest.raises(ValueError):
+        detector.evaluate([('a', None), ('b', None), ('c', None)], [1.0, 2.0, 3.0])
+
+def test_reader_status_is_kept():
+    detector = _detector()
+    rows = [('s1', 'TEMPERATURE', 'A', 20.0, 'C', 'WARNING', '2024-01-01T00:00:00'),
+            ('s1', 'TEMPERATURE', 'A', None, 'C', None, '2024-01-01T00:00:01')]
+    rows, alerts = classify_sensor_rows(detector, rows, SENSOR_COLUMNS)
+    assert [row[5] for row in rows] == ['WARNING', 'NORMAL']
+    assert alerts == [] and detector.stats()['readings'] == 1
+
+def test_alert_rows_are_built_for_anomalies():
+    detector = _detector()
+    _steady(detector, ('s1', 'A'))
+    rows = [('s1', 'TEMPERATURE', 'A', 80.0, 'C', None, '2024-01-01T00:00:00')]
+    rows, alerts = classify_sensor_rows(detector, rows, SENSOR_COLUMNS)
+    assert rows[0][5] == 'CRITICAL'
+    assert len(alerts) == 1
+    assert alerts[0][6] == 'CRITICAL' and alerts[0][8] == 'SENSOR_ANOMALY'
+    assert alerts[0][7].startswith('Critical: s1 read 80.00 C')
+
+def test_rejected_batch_is_not_scored():
+    ingestor = Ingestor(connection=None, detector=_detector(), max_buffer_rows=4, block_timeout=0,
+                        flush_interval=60)
+    body = '\n'.join(json.dumps({'sensor_id': 's1', 'value': 20}) for _ in range(5))
+    try:
+        with pytest.raises(BufferFull):
+            ingestor.submit('sensor', body)
+        assert ingestor.detector.stats()['readings'] == 0
+        assert ingestor.submit('sensor', body.split('\n', 1)[1]) == 4
+        assert ingestor.detector.stats()['readings'] == 4
+    finally:
+        ingestor.writers['sensor']._buffer.clear()
+        ingestor.close()
+
+def test_non_finite_readings_do_not_poison_the_sensor():
+    detector = _detector()
+    _steady(detector, ('s1', 'A'))
+    before = detector.state('s1', 'A')
+
+    statuses, z_scores, _, alerted = detector.evaluate([('s1', 'A')] * 3, [np.nan, np.inf, 20.0])
+    assert statuses.tolist() == [NORMAL] * 3 and not alerted.any() and np.isfinite(z_scores).all()
+    assert detector.state('s1', 'A')['readings'] == before['readings'] + 1
+    assert detector.stats()['non_finite'] == 2
+
+    statuses, z_scores, _, alerted = detector.evaluate([('s1', 'A')], [1000.0])
+    assert statuses[0] == CRITICAL and alerted[0] and np.isfinite(z_scores[0])
+
+def test_non_finite_values_are_rejected_at_parse_time():
+    ingestor = Ingestor(connection=None, detector=_detector())
+    for raw in ('NaN', 'Infinity', '-Infinity'):
+        with pytest.raises(ValueError, match='Line 1: value must be a finite number'):
+            ingestor.parse('sensor', f'{{"sensor_id": "s1", "value": {raw}}}')
+    rows = [('s1', None, 'A', float('nan'), None, None, '2024-01-01T00:00:00')]
+    rows, alerts = classify_sensor_rows(ingestor.detector, rows, SENSOR_COLUMNS)
+    assert rows[0][5] == 'NORMAL' and alerts == [] and ingestor.detector.stats()['readings'] == 0
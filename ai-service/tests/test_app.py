@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+
+import app as service
+from training import FEATURE_COLUMNS
+
+@pytest.fixture(scope='module')
+def client():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame({
+        'distance_km': rng.uniform(0, 30, 500),
+        'hour': rng.integers(0, 24, 500),
+        'weekday': rng.integers(0, 7, 500)
+    }, columns=FEATURE_COLUMNS)
+    model = RandomForestRegressor(n_estimators=5, max_depth=6, random_state=0).fit(X, 3 * X['distance_km'] + 2)
+    previous = service.predictor._serving
+    service.predictor.set_model(model, 'test')
+    yield service.app.test_client()
+    service.predictor._serving = previous
+
+ROUTE = {'start': {'lat': 14.55, 'lng': 121.0}, 'stops': [{'lat': 14.6, 'lng': 121.0}, {'lat': 14.57, 'lng': 121.02}]}
+
+@pytest.mark.parametrize('options', [
+    {'service_minutes': -100}, {'service_minutes': 'x'}, {'service_minutes': 'nan'},
+    {'service_minutes': 1e9}, {'service_minutes': True}, {'optimize': 'false'}, {'optimize': 0}
+])
+def test_predict_route_rejects_bad_options(client, options):
+    response = client.post('/predict_route', json={**ROUTE, **options})
+    assert response.status_code == 400, response.get_json()
+
+def test_predict_route_applies_service_minutes(client):
+    response = client.post('/predict_route', json={**ROUTE, 'optimize': False, 'service_minutes': 5})
+    assert response.status_code == 200
+    route = response.get_json()
+    assert route['order'] == [0, 1]
+    first, second = route['legs']
+    assert second['cumulative_eta_minutes'] == pytest.approx(
+        first['cumulative_eta_minutes'] + 5 + second['leg_eta_minutes'], abs=0.02)
+
+ETA_REQUEST = {'current_lat': 14.5995, 'current_lng': 120.9842, 'dropoff_lat': 14.6091, 'dropoff_lng': 121.0223}
+
+def test_cache_hits_carry_their_own_timestamp(client):
+    first = client.post('/predict_eta', json=ETA_REQUEST).get_json()
+    second = client.post('/predict_eta', json=ETA_REQUEST).get_json()
+    assert second['eta_minutes'] == first['eta_minutes']
+    assert second['timestamp'] > first['timestamp']
+
+    ping = client.post('/deliveries/test-timestamp/location', json=ETA_REQUEST).get_json()
+    assert ping['eta']['eta_minutes'] == first['eta_minutes']
+    assert ping['eta']['timestamp'] > second['timestamp']
+
+@pytest.mark.parametrize('field, value', [('current_lat', 'nan'), ('dropoff_lng', 200), ('dropoff_lat', 'x')])
+def test_predict_eta_rejects_bad_coordinates(client, field, value):
+    response = client.post('/predict_eta', json={**ETA_REQUEST, field: value})
+    assert response.status_code == 400, response.get_json()
+
+@pytest.mark.parametrize('options', [
+    {'horizon': 'x'}, {'lead_time': None}, {'horizon': 1e999}, {'horizon': 0}, {'service_level': 'high'},
+    {'service_level': 'nan'}, {'service_level': 1}
+])
+def test_forecast_rejects_bad_parameters(client, options):
+    response = client.post('/forecast_demand/bulk', json={'product_ids': ['PROD001'], **options})
+    assert response.status_code == 400, response.get_json()
+
+@pytest.mark.parametrize('options', [{'k': 'x'}, {'k': 1e999}, {'k': 0}, {'radius_km': 'nan'}, {'radius_km': 1000}])
+def test_nearest_drivers_rejects_bad_parameters(client, options):
+    response = client.post('/nearest_drivers', json={'pickup_lat': 14.55, 'pickup_lng': 121.0, **options})
+    assert response.status_code == 400, response.get_json()
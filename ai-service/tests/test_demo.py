@@ -0,0 +1,19 @@
+import pytest
+
+from demo import build_load_payloads, parse_args
+
+def test_batches_cover_whole_batches_only():
+    payloads = build_load_payloads(10, batch_size=3, seed=0)
+    assert [len(p['deliveries']) for p in payloads] == [3, 3, 3]
+    assert set(payloads[0]['deliveries'][0]) == {'current_lat', 'current_lng', 'dropoff_lat', 'dropoff_lng'}
+
+def test_single_payloads_without_batch_size():
+    assert len(build_load_payloads(5, seed=0)) == 5
+    assert len(build_load_payloads(4, batch_size=4, seed=0)) == 1
+
+@pytest.mark.parametrize('routes, batch_size', [(5, 6), (0, 0), (5, -1)])
+def test_invalid_sizes_are_rejected(routes, batch_size):
+    with pytest.raises(ValueError):
+        build_load_payloads(routes, batch_size=batch_size)
+    with pytest.raises(SystemExit):
+        parse_args(['load', '--routes', str(routes), '--batch-size', str(batch_size)])
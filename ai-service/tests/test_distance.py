@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+import distance
+
+@pytest.mark.parametrize('method', distance.DISTANCE_METHODS)
+def test_error_within_documented_bound(method):
+    error = distance.measure_error(method, n_pairs=2000)
+    assert error['max_abs_error_km'] <= distance.MAX_ERROR_KM[method]
+
+def test_check_accuracy_reports_every_method():
+    report = distance.check_accuracy(n_pairs=500)
+    assert set(report) == set(distance.DISTANCE_METHODS)
+    assert all(error['within_bound'] for error in report.values())
+
+@pytest.mark.parametrize('method', distance.DISTANCE_METHODS)
+def test_array_kernel_matches_scalar(method):
+    rng = np.random.default_rng(1)
+    (lat_lo, lat_hi), (lng_lo, lng_hi) = distance.MANILA_BOUNDS
+    lat1, lat2 = rng.uniform(lat_lo, lat_hi, (2, 20))
+    lng1, lng2 = rng.uniform(lng_lo, lng_hi, (2, 20))
+    vectorized = distance._ARRAY_KERNELS[method](lat1, lng1, lat2, lng2)
+    scalar = [distance._SCALAR_KERNELS[method](*pair) for pair in zip(lat1, lng1, lat2, lng2)]
+    np.testing.assert_allclose(vectorized, scalar, rtol=1e-12, atol=1e-12)
+
+def test_unknown_method_is_rejected():
+    with pytest.raises(ValueError):
+        distance.set_distance_method('manhattan')
@@ -0,0 +1,189 @@
+import contextlib
+import os
+
+import numpy as np
+import pytest
+
+import forecasting
+from forecasting import DemandForecaster, ForecastModels, fit_holt
+
+class _FakeSales:
+    """
+    Answers the forecaster's three queries from {product_id: {period: quantity}}
+
+    Periods are already the integers PERIOD_SQL computes.
+    """
+
+    def __init__(self, sales):
+        self.sales = sales
+        self.queries = []
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield self
+
+    @contextlib.contextmanager
+    def cursor(self, cursor_factory=None):
+        yield self
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+        if 'array_agg' in query:
+            product_ids, after = params
+            self.rows = [
+                (product_id, *map(list, zip(*sorted((p, q) for p, q in self.sales[product_id].items() if p > after))))
+                for product_id in product_ids
+                if any(p > after for p in self.sales[product_id])
+            ]
+        elif 'SUM(quantity_sold) AS total_quantity' in query:
+            self.rows = [
+                {'product_id': product_id, 'last_period': max(periods), 'total_quantity': sum(periods.values())}
+                for product_id, periods in self.sales.items()
+            ]
+        else:
+            self.rows = []
+
+    def fetchall(self):
+        return self.rows
+
+    def history_queries(self):
+        return sum('array_agg' in query for query in self.queries)
+
+def test_fit_holt_recovers_a_linear_trend():
+    t = np.arange(30)
+    series = np.vstack([10 + 2.0 * t, np.r_[np.full(10, np.nan), 50 - 1.0 * t[:20]]])
+    level, trend, sigma, alpha, beta, observations = fit_holt(series)
+    np.testing.assert_allclose(trend, [2.0, -1.0], atol=0.05)
+    np.testing.assert_allclose(level, [10 + 2.0 * 29, 50 - 19.0], atol=0.5)
+    assert observations.tolist() == [30, 20]
+    assert (sigma < 2).all()
+    assert set(alpha) <= set(forecasting.ALPHAS) and set(beta) <= set(forecasting.BETAS)
+
+def test_fit_holt_picks_the_lowest_error_smoothing():
+    rng = np.random.default_rng(0)
+    noisy = 100 + rng.normal(0, 10, (1, 200))
+    level, trend, _, alpha, _, _ = fit_holt(noisy)
+    assert alpha[0] == forecasting.ALPHAS.min()
+    assert level[0] == pytest.approx(100, abs=8) and abs(trend[0]) < 1
+
+def test_short_series_fall_back_to_the_mean():
+    series = np.array([[np.nan, 4.0, 8.0, 6.0], [np.nan, np.nan, np.nan, 5.0], [np.nan] * 4])
+    level, trend, sigma, _, _, observations = fit_holt(series)
+    np.testing.assert_allclose(level, [6.0, 5.0, 0.0])
+    np.testing.assert_allclose(trend, 0.0)
+    np.testing.assert_allclose(sigma, [np.std([4.0, 8.0, 6.0]), 0.0, 0.0])
+    assert observations.tolist() == [3, 1, 0]
+
+def _models(**columns):
+    models = ForecastModels(capacity=1)
+    ids = list(columns.pop('product_ids'))
+    models.store(ids, {name: np.asarray(values, dtype=float) for name, values in columns.items()})
+    return models
+
+def test_stale_compares_period_and_total():
+    models = _models(product_ids=['a', 'b', 'c'], last_period=[10, 10, 9], total_quantity=[5, 7, 3])
+    watermarks = [('a', 10, 5), ('b', 10, 8), ('c', 11, 3), ('d', 1, 1)]
+    assert models.stale(watermarks) == ['b', 'c', 'd']
+    assert models.stale([('a', 10, 5.0)]) == []
+
+def test_advance_applies_zero_demand_updates():
+    models = _models(product_ids=['a', 'b'], level=[10, 4], trend=[1, 0], alpha=[0.5, 0.2], beta=[0.1, 0.3],
+                     end_period=[100, 102])
+    models.advance(102)
+
+    level, trend = 10.0, 1.0
+    for _ in range(2):
+        new_level = 0.5 * (level + trend)
+        trend = 0.1 * (new_level - level) + 0.9 * trend
+        level = new_level
+    a = models.arrays
+    np.testing.assert_allclose([a['level'][0], a['trend'][0]], [level, trend])
+    # Already fitted through period 102
+    assert a['level'][1] == 4 and a['trend'][1] == 0
+    assert a['end_period'][:2].tolist() == [102, 102]
+
+def test_models_round_trip_through_the_saved_file(tmp_path):
+    models = _models(product_ids=['a', 'b'], level=[1, 2], sigma=[0.5, 0.25])
+    path = str(tmp_path / 'forecast-week.npz')
+    models.save(path)
+    loaded = ForecastModels.load(path)
+    assert len(loaded) == 2 and loaded.slot('b') == 1
+    assert loaded.arrays['sigma'][1] == 0.25
+
+def _forecaster(sales, tmp_path, **options):
+    return DemandForecaster(sales.connection, model_dir=str(tmp_path), processes=1, history=20, **options)
+
+def test_refresh_fits_then_only_refits_changed_products(tmp_path):
+    sales = _FakeSales({
+        'up': {p: 10 + 2 * (p - 80) for p in range(80, 100)},
+        'flat': {p: 5 for p in range(85, 100, 2)},
+        'old': {40: 3}
+    })
+    forecaster = _forecaster(sales, tmp_path)
+    summary = forecaster.refresh()
+    assert summary['products'] == 3 and summary['refit'] == 3 and summary['end_period'] == 99
+    assert os.path.exists(forecaster.path)
+
+    forecasts, missing = forecaster.forecast(['up', 'flat', 'old', 'unknown'], horizon=3, lead_time=2)
+    assert missing == ['unknown']
+    up, flat, old = forecasts
+    np.testing.assert_allclose(up['forecast'], [50, 52, 54], atol=1.5)
+    assert up['lead_time_demand'] == pytest.approx(sum(up['forecast'][:2]), abs=0.02)
+    assert up['reorder_point'] >= up['lead_time_demand']
+    # Sales before the history window count as zero demand
+    assert old['forecast'] == [0, 0, 0]
+    assert 0 < flat['forecast'][0] < 5
+
+    # Unchanged sales: nothing is refit and no history is read
+    queries = sales.history_queries()
+    assert forecaster.refresh(force=True)['refit'] == 0
+    assert sales.history_queries() == queries
+
+    sales.sales['flat'][99] = 7
+    assert forecaster.refresh(force=True)['refit'] == 1
+
+def test_refresh_is_skipped_while_models_are_young(tmp_path):
+    sales = _FakeSales({'a': {1: 2, 2: 3}})
+    forecaster = _forecaster(sales, tmp_path, refresh_seconds=300)
+    forecaster.refresh()
+    assert forecaster.refresh()['skipped'] is True
+
+def test_new_periods_advance_products_without_sales(tmp_path):
+    sales = _FakeSales({'a': {p: 10 for p in range(10, 20)}, 'b': {p: 1 for p in range(10, 20)}})
+    forecaster = _forecaster(sales, tmp_path)
+    forecaster.refresh()
+    before = forecaster.forecast(['a'])[0][0]['forecast'][0]
+
+    sales.sales['b'][25] = 1
+    assert forecaster.refresh(force=True)['refit'] == 1
+    assert forecaster.models.arrays['end_period'][forecaster.models.slot('a')] == 25
+    assert forecaster.forecast(['a'])[0][0]['forecast'][0] < before
+
+class _FakeJobs:
+    def __init__(self):
+        self.submitted = []
+        self.statuses = {}
+
+    def submit_forecast_refresh(self, granularity, force=False):
+        job_id = f'job-{len(self.submitted)}'
+        self.submitted.append((granularity, force))
+        self.statuses[job_id] = {'job_id': job_id, 'status': 'queued'}
+        return job_id
+
+    def status(self, job_id):
+        return self.statuses.get(job_id)
+
+def test_serving_processes_load_saved_models_and_queue_refreshes(tmp_path):
+    jobs = _FakeJobs()
+    reader = _forecaster(_FakeSales({}), tmp_path, refresh_seconds=300)
+    refresh = reader.schedule_refresh(jobs)
+    assert refresh == {'models_age_seconds': None, 'job_id': 'job-0', 'status': 'queued'}
+    # A pending job is not submitted twice
+    assert reader.schedule_refresh(jobs, force=True)['job_id'] == 'job-0'
+
+    _forecaster(_FakeSales({'a': {p: 3 for p in range(10, 20)}}), tmp_path).refresh()
+    jobs.statuses['job-0']['status'] = 'finished'
+    refresh = reader.schedule_refresh(jobs)
+    assert refresh['status'] == 'finished' and refresh['models_age_seconds'] < 300
+    assert len(jobs.submitted) == 1
+    assert reader.forecast(['a'])[1] == [] and reader.stats()['products'] == 1
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+
+import model_store
+import predictor
+from inference import FlatForest, PARITY_TOLERANCE, max_parity_error
+from training import FEATURE_COLUMNS
+
+@pytest.fixture(scope='module')
+def fitted():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame({
+        'distance_km': rng.uniform(0, 30, 2000).astype(np.float32),
+        'hour': rng.integers(0, 24, 2000),
+        'weekday': rng.integers(0, 7, 2000)
+    }, columns=FEATURE_COLUMNS)
+    y = 5 + 2.5 * X['distance_km'] + 3 * X['hour'].between(7, 9) + rng.normal(0, 2, len(X))
+    model = RandomForestRegressor(n_estimators=12, max_depth=10, random_state=0).fit(X, y)
+    return model, X
+
+def test_flat_forest_matches_sklearn(fitted):
+    model, X = fitted
+    engine = FlatForest(*model_store.flatten_forest(model))
+    assert max_parity_error(engine, model, X) <= PARITY_TOLERANCE
+
+def test_predict_one_matches_batch(fitted):
+    model, X = fitted
+    engine = FlatForest(*model_store.flatten_forest(model))
+    row = X.to_numpy()[7]
+    assert engine.predict_one(row) == pytest.approx(engine.predict(row.reshape(1, -1))[0])
+
+def test_walk_without_depth_metadata(fitted):
+    model, X = fitted
+    forest, _ = model_store.flatten_forest(model)
+    assert max_parity_error(FlatForest(forest), model, X[:100]) <= PARITY_TOLERANCE
+
+def test_saved_forest_round_trips(fitted, tmp_path):
+    model, X = fitted
+    version = model_store.save_model(model, model_dir=str(tmp_path))
+    metadata = model_store.load_metadata(version, str(tmp_path))
+    engine = FlatForest(model_store.load_forest(version, str(tmp_path)), metadata['max_depth'])
+    assert max_parity_error(engine, model, X) <= PARITY_TOLERANCE
+
+class _FailingEngine:
+    def __init__(self, error):
+        self.error = error
+
+    def predict(self, X):
+        raise self.error
+
+def test_engine_failure_falls_back_and_is_counted(fitted):
+    model, X = fitted
+    eta = predictor.ETAPredictor()
+    eta.set_model(model, 'v-broken', engine=_FailingEngine(IndexError('index 99 is out of bounds')))
+    before = predictor.ENGINE_FALLBACKS.values().get('IndexError', 0)
+
+    features = X.to_numpy()[:5]
+    np.testing.assert_allclose(eta._predict_model(features), model.predict(X[:5]))
+    eta._predict_model(features)
+    assert predictor.ENGINE_FALLBACKS.values()['IndexError'] == before + 2
+
+def test_unexpected_engine_errors_propagate(fitted):
+    model, X = fitted
+    eta = predictor.ETAPredictor()
+    eta.set_model(model, 'v-bug', engine=_FailingEngine(RuntimeError('bug')))
+    with pytest.raises(RuntimeError):
+        eta._predict_model(X.to_numpy()[:1])
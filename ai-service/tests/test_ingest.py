@@ -0,0 +1,157 @@
+import contextlib
+import json
+import threading
+import time
+
+import pytest
+
+from ingest import BufferFull, BulkWriter, Ingestor, encode_copy_rows
+
+class _FakeDatabase:
+    """Records COPY payloads; the first `failures` COPYs raise"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.copies = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield self
+
+    @contextlib.contextmanager
+    def cursor(self):
+        yield self
+
+    def copy_expert(self, sql, data):
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+                raise OSError('connection reset')
+            self.copies.append((sql, data.read()))
+
+    def lines(self):
+        with self.lock:
+            return [line for _, payload in self.copies for line in payload.splitlines()]
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+def _writer(database, **options):
+    options = {'batch_rows': 100, 'flush_interval': 0.02, 'max_buffer_rows': 1000, 'block_timeout': 0, **options}
+    return BulkWriter('rfid_logs', ('product_id', 'zone'), connection=database.connection, **options)
+
+def test_copy_rows_escape_text_and_nulls():
+    assert encode_copy_rows([('a\tb', None), ('c\\d', 'e\nf')]) == 'a\\tb\t\\N\nc\\\\d\te\\nf\n'
+
+def test_rows_are_written_in_batches():
+    database = _FakeDatabase()
+    writer = _writer(database, batch_rows=3)
+    try:
+        writer.submit([(f'p{i}', 'A') for i in range(7)])
+        _wait_for(lambda: writer.stats()['rows_written'] == 7)
+    finally:
+        writer.close()
+    assert database.lines() == [f'p{i}\tA' for i in range(7)]
+    assert all(sql.startswith('COPY rfid_logs (product_id, zone) FROM STDIN') for sql, _ in database.copies)
+    assert writer.stats()['flushes'] >= 3
+
+def test_full_buffer_rejects_the_batch():
+    database = _FakeDatabase()
+    writer = _writer(database, max_buffer_rows=5, flush_interval=60, batch_rows=100)
+    try:
+        assert writer.submit([('p', 'A')] * 4) == 4
+        with pytest.raises(BufferFull):
+            writer.submit([('q', 'A')] * 2)
+        with pytest.raises(BufferFull):
+            writer.submit([('r', 'A')] * 6)
+        stats = writer.stats()
+        assert stats['rows_accepted'] == 4 and stats['rows_rejected'] == 8 and stats['batches_rejected'] == 2
+        assert stats['buffered_rows'] == 4 and stats['buffer_utilization'] == 0.8
+    finally:
+        writer.close()
+
+def test_submit_waits_for_the_flusher_to_make_room():
+    database = _FakeDatabase()
+    writer = _writer(database, max_buffer_rows=5, batch_rows=5, block_timeout=5)
+    try:
+        writer.submit([('p', 'A')] * 5)
+        assert writer.submit([('q', 'A')] * 5) == 5
+        _wait_for(lambda: writer.stats()['rows_written'] == 10)
+    finally:
+        writer.close()
+
+def test_failed_copy_requeues_rows_in_order(caplog):
+    database = _FakeDatabase(failures=2)
+    writer = _writer(database, batch_rows=2)
+    try:
+        writer.submit([(f'p{i}', 'A') for i in range(5)])
+        _wait_for(lambda: writer.stats()['rows_written'] == 5)
+    finally:
+        writer.close()
+    assert writer.stats()['flush_failures'] == 2
+    assert database.lines() == [f'p{i}\tA' for i in range(5)]
+    assert 'COPY into rfid_logs failed, 2 rows requeued' in caplog.text
+
+def test_close_flushes_what_is_buffered():
+    database = _FakeDatabase()
+    writer = _writer(database, flush_interval=60)
+    writer.submit([('p', 'A')] * 3)
+    writer.close()
+    assert len(database.lines()) == 3
+
+def test_bad_line_rejects_the_whole_batch():
+    database = _FakeDatabase()
+    ingestor = Ingestor(connection=database.connection, flush_interval=60)
+    body = '\n'.join([
+        json.dumps({'product_id': 'p1', 'action': 'scan'}),
+        '',
+        json.dumps({'product_id': 'p2', 'action': 'teleport'})
+    ])
+    try:
+        with pytest.raises(ValueError, match='Line 3: action must be one of'):
+            ingestor.submit('rfid', body)
+        with pytest.raises(ValueError, match='Line 1: product_id is required'):
+            ingestor.submit('rfid', '{"zone": "A"}')
+        assert ingestor.stats()['rfid']['rows_accepted'] == 0
+    finally:
+        ingestor.close()
+    assert database.copies == []
+
+@pytest.fixture
+def manila_time(monkeypatch):
+    monkeypatch.setenv('TZ', 'Asia/Manila')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def test_parsed_rows_follow_the_table_columns(manila_time):
+    ingestor = Ingestor(connection=_FakeDatabase().connection)
+    rows = ingestor.parse('sensor', json.dumps({
+        'sensor_id': 'temp-1', 'sensor_type': 'temperature', 'zone': 'A', 'value': 21.456,
+        'unit': 'C', 'timestamp': '2024-01-01T08:00:00Z'
+    }))
+    assert rows == [('temp-1', 'TEMPERATURE', 'A', 21.46, 'C', None, '2024-01-01T16:00:00')]
+
+@pytest.mark.parametrize('timestamp, expected', [
+    ('2024-01-01T00:00:00Z', '2024-01-01T08:00:00'),
+    ('2024-01-01T08:00:00+08:00', '2024-01-01T08:00:00'),
+    ('2023-12-31T20:00:00-05:00', '2024-01-01T09:00:00'),
+    ('2024-01-01T08:00:00', '2024-01-01T08:00:00'),
+    (1704067200, '2024-01-01T08:00:00')
+])
+def test_timestamps_are_stored_as_local_time(manila_time, timestamp, expected):
+    ingestor = Ingestor(connection=_FakeDatabase().connection)
+    rows = ingestor.parse('rfid', json.dumps({'product_id': 'p1', 'timestamp': timestamp}))
+    assert rows[0][5] == expected
+
+@pytest.mark.parametrize('timestamp', [1e20, -1e20, 'NaN', '"yesterday"', '"9999-12-31T23:00:00-05:00"'])
+def test_bad_timestamps_name_their_line(timestamp):
+    ingestor = Ingestor(connection=_FakeDatabase().connection)
+    body = '{"product_id": "p1"}\n' + f'{{"product_id": "p2", "timestamp": {timestamp}}}'
+    with pytest.raises(ValueError, match='^Line 2: '):
+        ingestor.parse('rfid', body)
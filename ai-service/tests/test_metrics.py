@@ -0,0 +1,39 @@
+import metrics
+
+def _family(text, name):
+    """The HELP, TYPE and sample lines of one metric"""
+    prefixes = (f'# HELP {name} ', f'# TYPE {name} ', f'{name} ', f'{name}{{')
+    return [line for line in text.splitlines() if line.startswith(prefixes)]
+
+def test_counter_is_exported_with_total_suffix():
+    counter = metrics.Counter('test_widget_events', 'Widget events', label='kind')
+    counter.inc('made')
+    counter.inc('made', 2)
+    counter.inc('lost "quoted"')
+
+    lines = _family(metrics.render(), 'test_widget_events_total')
+    assert lines == [
+        '# HELP test_widget_events_total Widget events',
+        '# TYPE test_widget_events_total counter',
+        'test_widget_events_total{kind="lost \\"quoted\\""} 1.0',
+        'test_widget_events_total{kind="made"} 3.0'
+    ]
+    assert counter.values() == {'made': 3, 'lost "quoted"': 1}
+
+def test_gauge_keeps_its_name_and_type():
+    metrics.register_gauge('test_widget_queue', 'Queued widgets', lambda: 4)
+    assert _family(metrics.render(), 'test_widget_queue') == [
+        '# HELP test_widget_queue Queued widgets',
+        '# TYPE test_widget_queue gauge',
+        'test_widget_queue 4.0'
+    ]
+
+def test_empty_and_failing_collectors_are_skipped():
+    metrics.Counter('test_widget_unused', 'Never incremented')
+
+    def broken():
+        raise RuntimeError('collector failed')
+
+    metrics.register_gauge('test_widget_broken', 'Raises', broken)
+    text = metrics.render()
+    assert 'test_widget_unused' not in text and 'test_widget_broken' not in text
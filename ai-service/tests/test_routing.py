@@ -0,0 +1,95 @@
+import datetime
+import itertools
+
+import numpy as np
+import pytest
+
+from routing import DistanceMatrixCache, nearest_neighbour_order, path_length, plan_route, two_opt
+from utils import calculate_distances
+
+def _random_matrix(n, seed):
+    points = np.random.default_rng(seed).uniform(0, 10, (n, 2))
+    return np.linalg.norm(points[:, None] - points[None], axis=-1)
+
+def _best_reversal_gain(order, matrix):
+    """Largest length reduction from reversing any segment after the start"""
+    length = path_length(order, matrix)
+    best = 0.0
+    for i in range(1, len(order) - 1):
+        for j in range(i + 1, len(order)):
+            reversed_order = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+            best = max(best, length - path_length(reversed_order, matrix))
+    return best
+
+@pytest.mark.parametrize('seed', range(10))
+def test_two_opt_reaches_a_local_optimum(seed):
+    matrix = _random_matrix(12, seed)
+    initial = nearest_neighbour_order(matrix)
+    order = two_opt(initial, matrix)
+    assert order[0] == 0 and sorted(order) == list(range(12))
+    assert path_length(order, matrix) <= path_length(initial, matrix) + 1e-9
+    assert _best_reversal_gain(order, matrix) <= 1e-9
+
+def test_small_routes_are_close_to_brute_force():
+    ratios = []
+    for seed in range(50):
+        matrix = _random_matrix(7, seed)
+        order = two_opt(nearest_neighbour_order(matrix), matrix)
+        optimum = min(path_length((0,) + rest, matrix) for rest in itertools.permutations(range(1, 7)))
+        ratios.append(path_length(order, matrix) / optimum)
+    assert min(ratios) >= 1 - 1e-9
+    assert max(ratios) <= 1.25 and np.mean(ratios) <= 1.05
+
+def test_collinear_stops_are_visited_in_order():
+    positions = np.array([0.0, 7, 2, 5, 1, 9, 3])
+    matrix = np.abs(positions[:, None] - positions[None])
+    order = two_opt(list(range(7)), matrix)
+    assert positions[order].tolist() == sorted(positions)
+
+def test_nearest_neighbour_visits_every_node_once():
+    matrix = _random_matrix(9, 0)
+    order = nearest_neighbour_order(matrix, start=4)
+    assert order[0] == 4 and sorted(order) == list(range(9))
+
+def test_matrix_cache_reuses_pairs():
+    cache = DistanceMatrixCache(grid_deg=0.0001)
+    lats = [14.55, 14.60, 14.65]
+    lngs = [121.00, 121.02, 121.05]
+    matrix = cache.matrix(lats, lngs)
+    assert np.allclose(matrix, matrix.T) and (np.diag(matrix) == 0).all()
+    assert matrix[0, 2] == pytest.approx(float(calculate_distances([lats[0]], [lngs[0]], [lats[2]], [lngs[2]])[0]))
+
+    again = cache.matrix(lats[::-1], lngs[::-1])
+    np.testing.assert_allclose(again, matrix[::-1, ::-1])
+    assert cache.stats()['hits'] == 3 and cache.stats()['misses'] == 3
+
+class _LinearPredictor:
+    """ETA of 2 minutes per km, plus 10 minutes from 11:00"""
+
+    def predict_eta_features(self, distances, hours, weekdays):
+        return 2 * np.asarray(distances) + np.where(np.asarray(hours) >= 11, 10.0, 0.0)
+
+def test_plan_route_picks_each_legs_hour_bucket():
+    start = (14.55, 121.00)
+    stops = [(14.70, 121.00), (14.60, 121.00)]
+    departure = datetime.datetime(2024, 1, 1, 10, 55)
+    route = plan_route(_LinearPredictor(), start, stops, DistanceMatrixCache(), departure=departure)
+
+    assert route['order'] == [1, 0]
+    first, second = route['legs']
+    assert first['stop_index'] == 1 and second['stop_index'] == 0
+    # The first leg departs at 10:55 and arrives after 11:00, so only the
+    # second leg falls in the 11:00 bucket
+    assert first['leg_eta_minutes'] == pytest.approx(2 * first['leg_distance_km'], abs=0.01)
+    assert first['cumulative_eta_minutes'] > 5
+    assert second['leg_eta_minutes'] == pytest.approx(2 * second['leg_distance_km'] + 10, abs=0.01)
+    assert route['total_eta_minutes'] == second['cumulative_eta_minutes']
+
+def test_plan_route_keeps_the_given_order_without_optimizing():
+    stops = [(14.60, 121.00), (14.56, 121.00), (14.58, 121.00)]
+    route = plan_route(_LinearPredictor(), (14.55, 121.00), stops, DistanceMatrixCache(), optimize=False,
+                       service_minutes=5, departure=datetime.datetime(2024, 1, 1, 8, 0))
+    assert route['order'] == [0, 1, 2]
+    legs = route['legs']
+    assert legs[1]['cumulative_eta_minutes'] == pytest.approx(
+        legs[0]['cumulative_eta_minutes'] + 5 + legs[1]['leg_eta_minutes'], abs=0.02)
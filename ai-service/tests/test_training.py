@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+from training import (
+    COMPLETED_QUEUE, TARGET_COLUMN, ReservoirSample, ack_queue, collect_training_set, enqueue_completed, iter_queue_chunks,
+    iter_synthetic_chunks
+)
+
+def _chunk(start, stop):
+    ids = np.arange(start, stop)
+    return pd.DataFrame({
+        'distance_km': ids.astype(np.float32),
+        'hour': (ids % 24).astype(np.int8),
+        'weekday': (ids % 7).astype(np.int8),
+        TARGET_COLUMN: ids.astype(np.float32) + 1
+    })
+
+def _stream(n, chunksize):
+    return [_chunk(start, min(start + chunksize, n)) for start in range(0, n, chunksize)]
+
+def test_keeps_everything_below_capacity():
+    sample = ReservoirSample(100)
+    for chunk in _stream(60, 25):
+        sample.add(chunk)
+    frame = sample.to_frame()
+    assert sample.seen == 60
+    assert frame['distance_km'].tolist() == list(range(60))
+
+def test_sample_is_bounded_and_rows_stay_intact():
+    sample = ReservoirSample(500)
+    for chunk in _stream(20_000, 3000):
+        sample.add(chunk)
+    frame = sample.to_frame()
+    assert len(frame) == 500 and sample.seen == 20_000
+    assert frame['distance_km'].nunique() == 500
+    ids = frame['distance_km'].to_numpy().astype(np.int64)
+    assert (frame['hour'].to_numpy() == ids % 24).all()
+    assert (frame[TARGET_COLUMN].to_numpy() == ids + 1).all()
+
+def test_sample_does_not_depend_on_chunking():
+    frames = []
+    for chunksize in (7, 1000, 10_000):
+        frame, seen = collect_training_set([_stream(10_000, chunksize)], max_rows=300, seed=3)
+        assert seen == 10_000
+        frames.append(frame)
+    pd.testing.assert_frame_equal(frames[0], frames[1])
+    pd.testing.assert_frame_equal(frames[0], frames[2])
+
+def test_inclusion_is_uniform():
+    # Each of n rows should be kept with probability k / n regardless of
+    # its position in the stream
+    n, k, trials = 1000, 100, 400
+    kept = np.zeros(n)
+    for seed in range(trials):
+        frame, _ = collect_training_set([_stream(n, 128)], max_rows=k, seed=seed)
+        kept[frame['distance_km'].to_numpy().astype(np.int64)] += 1
+    by_decile = kept.reshape(10, -1).sum(axis=1) / (trials * k / 10)
+    np.testing.assert_allclose(by_decile, 1.0, atol=0.05)
+
+def test_ignores_empty_chunks():
+    sample = ReservoirSample(10)
+    sample.add(_chunk(0, 0))
+    assert sample.seen == 0 and len(sample.to_frame()) == 0
+
+def test_synthetic_stream_feeds_the_sample():
+    frame, seen = collect_training_set([iter_synthetic_chunks(5000, chunksize=1200)], max_rows=1000)
+    assert seen == 5000 and len(frame) == 1000
+    assert (frame[TARGET_COLUMN] > 0).all()
+
+class _FakeRedisList:
+    """The list commands the completed-deliveries queue uses"""
+
+    def __init__(self):
+        self.lists = {}
+
+    def rpush(self, key, *values):
+        self.lists.setdefault(key, []).extend(values)
+        return len(self.lists[key])
+
+    def lrange(self, key, start, stop):
+        return self.lists.get(key, [])[start:stop + 1]
+
+    def ltrim(self, key, start, stop):
+        items = self.lists.get(key, [])
+        self.lists[key] = items[start:] if stop == -1 else items[start:stop + 1]
+
+def _completed(n, start=0):
+    return [{'distance_km': 1.0 + i, 'hour': 9, 'weekday': 2, TARGET_COLUMN: 10.0 + i}
+            for i in range(start, start + n)]
+
+def test_reading_the_queue_leaves_it_intact():
+    redis_client = _FakeRedisList()
+    enqueue_completed(redis_client, _completed(5))
+    consumed = {}
+    chunks = list(iter_queue_chunks(redis_client, chunksize=2, consumed=consumed))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert consumed['queue'] == 5
+    assert len(redis_client.lists[COMPLETED_QUEUE]) == 5
+
+def test_ack_removes_only_consumed_records():
+    redis_client = _FakeRedisList()
+    enqueue_completed(redis_client, _completed(3))
+    consumed = {}
+    list(iter_queue_chunks(redis_client, consumed=consumed))
+    # Records arriving while the update runs stay for the next one
+    enqueue_completed(redis_client, _completed(2, start=3))
+    ack_queue(redis_client, consumed['queue'])
+
+    remaining = pd.concat(iter_queue_chunks(redis_client))
+    assert remaining['distance_km'].tolist() == [4.0, 5.0]
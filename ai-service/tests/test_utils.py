@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+import utils
+from utils import generate_delivery_data, iter_delivery_data
+
+def test_empty_frame_keeps_columns_and_dtypes():
+    empty = generate_delivery_data(0, seed=1, with_order_ids=True)
+    sample = generate_delivery_data(3, seed=1, with_order_ids=True)
+    assert len(empty) == 0
+    assert list(empty.columns) == list(sample.columns)
+    assert (empty.dtypes == sample.dtypes).all()
+    assert list(iter_delivery_data(0)) == []
+
+def test_rows_do_not_depend_on_chunk_size():
+    n = utils.SYNTHETIC_BLOCK_ROWS + 5000
+    whole = generate_delivery_data(n, seed=7, with_order_ids=True)
+    for chunk_size in (7000, utils.SYNTHETIC_BLOCK_ROWS, n + 1):
+        chunks = list(iter_delivery_data(n, chunk_size=chunk_size, seed=7, with_order_ids=True))
+        assert all(len(chunk) <= chunk_size for chunk in chunks)
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), whole)
+
+def test_order_ids_number_rows_across_chunks():
+    chunks = list(iter_delivery_data(10, chunk_size=4, seed=0, with_order_ids=True))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert chunks[1]['order_id'].iloc[0] == 'ORDER_0005'
+
+def test_generated_values_stay_in_range():
+    frame = generate_delivery_data(2000, seed=3)
+    assert frame['pickup_lat'].between(*utils.MANILA_LAT_RANGE).all()
+    assert frame['dropoff_lng'].between(*utils.MANILA_LNG_RANGE).all()
+    assert frame['hour'].between(0, 23).all() and frame['weekday'].between(0, 6).all()
+    assert (frame['travel_time_minutes'] >= 1).all()
+    assert not np.array_equal(frame['hour'], generate_delivery_data(2000, seed=4)['hour'])
@@ -0,0 +1,229 @@
+"""
+Streaming training data pipeline for the ETA model
+
+Delivery history is read in bounded-memory chunks from CSV (pandas chunked
+reader) or Postgres (server-side named cursor). Each chunk is reduced to the
+model features (distance_km, hour, weekday) and target
+(travel_time_minutes) before it is folded into a fixed-capacity reservoir
+sample, so memory stays proportional to max_rows no matter how large the
+history is.
+"""
+import json
+import os
+
+import numpy as np
+
+from utils import calculate_distances, iter_delivery_data
+
+FEATURE_COLUMNS = ['distance_km', 'hour', 'weekday']
+TARGET_COLUMN = 'travel_time_minutes'
+
+HISTORICAL_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'historical_deliveries.csv')
+
+DB_QUERY = """
+    SELECT pickup_lat, pickup_lng, dropoff_lat, dropoff_lng,
+           pickup_time, dropoff_time, actual_time AS travel_time_minutes
+    FROM deliveries
+    WHERE status = 'completed' AND pickup_time IS NOT NULL
+"""
+
+# Deliveries written after a watermark, for incremental updates. Keyed on
+# updated_at rather than dropoff_time: a delivery marked completed late, or
+# corrected afterwards, still has an earlier dropoff_time
+DB_RECENT_QUERY = DB_QUERY.rstrip() + " AND updated_at > %s\n"
+
+# Redis list of completed delivery records awaiting an incremental update
+COMPLETED_QUEUE = 'eta:training:completed'
+
+def prepare_features(df):
+    """
+    Reduce a chunk of raw delivery records to compact feature/target columns.
+
+    distance_km is derived from coordinates unless already present, hour
+    and weekday from pickup_time, and the target falls back to
+    dropoff_time - pickup_time when travel_time_minutes is missing. Rows
+    without a usable target are dropped.
+    """
+    import pandas as pd
+
+    if 'distance_km' in df.columns:
+        distance = df['distance_km'].to_numpy()
+    else:
+        distance = calculate_distances(
+            df['pickup_lat'].astype(float), df['pickup_lng'].astype(float),
+            df['dropoff_lat'].astype(float), df['dropoff_lng'].astype(float)
+        )
+
+    if 'hour' in df.columns and 'weekday' in df.columns:
+        hour = df['hour'].to_numpy()
+        weekday = df['weekday'].to_numpy()
+    else:
+        pickup_time = pd.to_datetime(df['pickup_time'])
+        hour = pickup_time.dt.hour.to_numpy()
+        weekday = pickup_time.dt.weekday.to_numpy()
+
+    target = pd.to_numeric(df[TARGET_COLUMN], errors='coerce') if TARGET_COLUMN in df.columns else None
+    if 'dropoff_time' in df.columns and 'pickup_time' in df.columns:
+        elapsed = (pd.to_datetime(df['dropoff_time']) - pd.to_datetime(df['pickup_time'])).dt.total_seconds() / 60
+        target = elapsed if target is None else target.fillna(elapsed)
+
+    out = pd.DataFrame({
+        'distance_km': np.asarray(distance, dtype=np.float32),
+        'hour': np.asarray(hour, dtype=np.int8),
+        'weekday': np.asarray(weekday, dtype=np.int8),
+        TARGET_COLUMN: np.asarray(target, dtype=np.float32)
+    })
+    return out[np.isfinite(out[TARGET_COLUMN]) & (out[TARGET_COLUMN] > 0)]
+
+def iter_csv_chunks(path=HISTORICAL_CSV, chunksize=100_000):
+    """
+    Stream feature chunks from a delivery history CSV.
+
+    The CSV's own distance_km column is ignored in favour of a distance
+    derived from the coordinates, matching what is used at serving time.
+    """
+    import pandas as pd
+
+    usecols = lambda c: c in {
+        'pickup_lat', 'pickup_lng', 'dropoff_lat', 'dropoff_lng',
+        'pickup_time', 'dropoff_time', TARGET_COLUMN
+    }
+    for chunk in pd.read_csv(path, chunksize=chunksize, usecols=usecols):
+        yield prepare_features(chunk)
+
+def iter_db_chunks(connection, chunksize=100_000, query=DB_QUERY, params=None, watermark=None):
+    """
+    Stream feature chunks from Postgres through a server-side named cursor.
+
+    connection is a context-manager factory such as db.db_connection. Rows
+    are fetched chunksize at a time, so the full result set is never held
+    client-side. When a watermark dict is given, watermark['db_through'] is
+    set to the database clock at the start of the read, the bound for the
+    next DB_RECENT_QUERY.
+    """
+    import pandas as pd
+    from psycopg2.extensions import cursor as TupleCursor
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            # Named cursors live inside a transaction; keep it read-only
+            cur.execute('SET TRANSACTION READ ONLY')
+            if watermark is not None:
+                # updated_at is a timestamp without time zone
+                cur.execute('SELECT LOCALTIMESTAMP')
+                watermark['db_through'] = cur.fetchone()[0].isoformat()
+        with conn.cursor(name='eta_training_stream', cursor_factory=TupleCursor) as cur:
+            cur.itersize = chunksize
+            cur.execute(query, params)
+            while True:
+                rows = cur.fetchmany(chunksize)
+                if not rows:
+                    break
+                columns = [desc[0] for desc in cur.description]
+                yield prepare_features(pd.DataFrame(rows, columns=columns))
+
+def enqueue_completed(redis_client, records, key=COMPLETED_QUEUE):
+    """Append completed delivery records to the update queue. Returns the queue length."""
+    return redis_client.rpush(key, *[json.dumps(record, default=str) for record in records])
+
+def iter_queue_chunks(redis_client, chunksize=100_000, key=COMPLETED_QUEUE, consumed=None):
+    """
+    Read the completed-deliveries queue as feature chunks without removing them.
+
+    Producers only append, so the records at the head of the list stay put
+    until the consumer acknowledges them with ack_queue once the model built
+    from them is published; a job that skips or fails leaves them queued.
+    consumed['queue'] is set to the number of records read.
+    """
+    import pandas as pd
+
+    offset = 0
+    while True:
+        records = redis_client.lrange(key, offset, offset + chunksize - 1)
+        if not records:
+            break
+        offset += len(records)
+        if consumed is not None:
+            consumed['queue'] = offset
+        yield prepare_features(pd.DataFrame([json.loads(record) for record in records]))
+
+def ack_queue(redis_client, count, key=COMPLETED_QUEUE):
+    """Remove the first count records of the queue, consumed by a published update"""
+    if count:
+        redis_client.ltrim(key, count, -1)
+
+def iter_synthetic_chunks(n_samples, chunksize=100_000, seed=42):
+    """Stream synthetic feature chunks"""
+    for chunk in iter_delivery_data(n_samples, chunk_size=chunksize, seed=seed):
+        yield prepare_features(chunk)
+
+class ReservoirSample:
+    """
+    Fixed-capacity uniform sample over a stream of feature chunks.
+
+    Columns are stored as preallocated compact NumPy arrays
+    (float32/int8), about 10 bytes per retained row.
+    """
+
+    def __init__(self, max_rows, seed=42):
+        self.max_rows = max_rows
+        self.rng = np.random.default_rng(seed)
+        self.seen = 0
+        self.size = 0
+        self.distance_km = np.empty(max_rows, dtype=np.float32)
+        self.hour = np.empty(max_rows, dtype=np.int8)
+        self.weekday = np.empty(max_rows, dtype=np.int8)
+        self.target = np.empty(max_rows, dtype=np.float32)
+
+    def _columns(self, chunk):
+        return (
+            chunk['distance_km'].to_numpy(), chunk['hour'].to_numpy(),
+            chunk['weekday'].to_numpy(), chunk[TARGET_COLUMN].to_numpy()
+        )
+
+    def _store(self, slots, columns):
+        for arr, values in zip((self.distance_km, self.hour, self.weekday, self.target), columns):
+            arr[slots] = values
+
+    def add(self, chunk):
+        n = len(chunk)
+        if n == 0:
+            return
+        columns = self._columns(chunk)
+
+        # Fill free capacity directly
+        fill = min(self.max_rows - self.size, n)
+        if fill:
+            self._store(slice(self.size, self.size + fill), [c[:fill] for c in columns])
+            self.size += fill
+
+        # Algorithm R for the remainder, vectorized over the chunk
+        if fill < n:
+            positions = np.arange(self.seen + fill, self.seen + n) + 1
+            slots = (self.rng.random(n - fill) * positions).astype(np.int64)
+            keep = slots < self.max_rows
+            self._store(slots[keep], [c[fill:][keep] for c in columns])
+
+        self.seen += n
+
+    def to_frame(self):
+        import pandas as pd
+
+        return pd.DataFrame({
+            'distance_km': self.distance_km[:self.size],
+            'hour': self.hour[:self.size],
+            'weekday': self.weekday[:self.size],
+            TARGET_COLUMN: self.target[:self.size]
+        })
+
+def collect_training_set(chunk_iterables, max_rows=5_000_000, seed=42):
+    """
+    Fold one or more chunk streams into a bounded training set.
+
+    Returns (DataFrame, rows_seen).
+    """
+    sample = ReservoirSample(max_rows, seed=seed)
+    for chunks in chunk_iterables:
+        for chunk in chunks:
+            sample.add(chunk)
+    return sample.to_frame(), sample.seen
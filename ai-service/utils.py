@@ -1,12 +1,24 @@
-from geopy.distance import geodesic
 import datetime
 import numpy as np
+import distance
+
+# Manila area coordinates
+MANILA_LAT_RANGE = (14.5, 14.7)
+MANILA_LNG_RANGE = (120.9, 121.1)
 
 def calculate_distance(lat1, lng1, lat2, lng2):
     """
-    Calculate distance between two points using Haversine formula
+    Calculate distance in km between two points using the configured
+    distance method (see distance.py; ellipsoid-corrected by default)
+    """
+    return distance.distance(lat1, lng1, lat2, lng2)
+
+def calculate_distances(lat1, lng1, lat2, lng2):
+    """
+    Calculate distances in km between arrays of points using the configured
+    distance method
     """
-    return geodesic((lat1, lng1), (lat2, lng2)).km
+    return distance.distances(lat1, lng1, lat2, lng2)
 
 def get_time_features():
     """
@@ -78,6 +90,97 @@ def format_eta_response(eta_minutes, distance_km, message, timestamp=None):
         'timestamp': timestamp
     }
 
+# Rows drawn from each random stream. Every block has its own generator
+# derived from the seed, so rows do not depend on how they are chunked
+SYNTHETIC_BLOCK_ROWS = 65_536
+
+def _delivery_columns(rng, n, lat_range, lng_range):
+    """Feature and target arrays for n synthetic deliveries"""
+    pickup_lat = rng.uniform(*lat_range, n)
+    pickup_lng = rng.uniform(*lng_range, n)
+    dropoff_lat = rng.uniform(*lat_range, n)
+    dropoff_lng = rng.uniform(*lng_range, n)
+    distance = calculate_distances(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng)
+
+    hour = rng.integers(0, 24, n, dtype=np.int8)
+    weekday = rng.integers(0, 7, n, dtype=np.int8)
+
+    # Base time per km (with traffic factors)
+    base_time_per_km = 3  # minutes
+    rush_hour = ((hour >= 7) & (hour <= 9)) | ((hour >= 17) & (hour <= 19))
+    traffic_multiplier = np.where(rush_hour, 1.5, 1.0)
+    weekend_multiplier = np.where(weekday >= 5, 0.8, 1.0)
+
+    travel_time = distance * base_time_per_km * traffic_multiplier * weekend_multiplier
+    travel_time += rng.normal(0, 2, n)  # Add noise
+    travel_time = np.maximum(travel_time, 1)  # Minimum 1 minute
+
+    return {
+        'pickup_lat': pickup_lat,
+        'pickup_lng': pickup_lng,
+        'dropoff_lat': dropoff_lat,
+        'dropoff_lng': dropoff_lng,
+        'distance_km': np.asarray(distance, dtype=float),
+        'hour': hour,
+        'weekday': weekday,
+        'travel_time_minutes': travel_time
+    }
+
+def _delivery_frame(columns, start, with_order_ids):
+    import pandas as pd
+
+    if with_order_ids:
+        n = len(columns['hour'])
+        # dtype=str keeps the column textual when the frame is empty
+        order_ids = pd.Series([f'ORDER_{i:04d}' for i in range(start + 1, start + n + 1)], dtype=str)
+        columns = dict({'order_id': order_ids}, **columns)
+    return pd.DataFrame(columns)
+
+def iter_delivery_data(n_samples, chunk_size=1_000_000, seed=None,
+                       lat_range=MANILA_LAT_RANGE, lng_range=MANILA_LNG_RANGE,
+                       with_order_ids=False):
+    """
+    Generate synthetic delivery data as DataFrame chunks of at most chunk_size rows.
+
+    All coordinates, time features and noise are drawn as NumPy arrays, so
+    memory is bounded by chunk_size rather than n_samples. Rows are drawn
+    in blocks of SYNTHETIC_BLOCK_ROWS, each from its own stream derived from
+    seed. For a given seed the rows are therefore the same whatever the
+    chunk_size.
+    """
+    entropy = np.random.SeedSequence(seed).entropy
+    pending, pending_rows, start = [], 0, 0
+    for block, block_start in enumerate(range(0, n_samples, SYNTHETIC_BLOCK_ROWS)):
+        rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(block,)))
+        n = min(SYNTHETIC_BLOCK_ROWS, n_samples - block_start)
+        pending.append(_delivery_columns(rng, n, lat_range, lng_range))
+        pending_rows += n
+        last = block_start + n == n_samples
+        while pending_rows >= chunk_size or (last and pending_rows):
+            columns = {name: np.concatenate([p[name] for p in pending]) for name in pending[0]}
+            take = min(chunk_size, pending_rows)
+            yield _delivery_frame({name: values[:take] for name, values in columns.items()}, start, with_order_ids)
+            start += take
+            pending_rows -= take
+            pending = [{name: values[take:] for name, values in columns.items()}] if pending_rows else []
+
+def generate_delivery_data(n_samples, seed=None, **kwargs):
+    """
+    Generate synthetic delivery data as a single DataFrame
+    """
+    import pandas as pd
+
+    chunks = list(iter_delivery_data(n_samples, chunk_size=max(n_samples, 1), seed=seed, **kwargs))
+    if not chunks:
+        # Same columns and dtypes, no rows
+        rng = np.random.default_rng(seed)
+        columns = _delivery_columns(rng, 0, kwargs.get('lat_range', MANILA_LAT_RANGE),
+                                    kwargs.get('lng_range', MANILA_LNG_RANGE))
+        return _delivery_frame(columns, 0, kwargs.get('with_order_ids', False))
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks, ignore_index=True)
+
 class DeliveryDataGenerator:
     """
     Utility class for generating synthetic delivery data
@@ -85,8 +188,8 @@ class DeliveryDataGenerator:
     
     def __init__(self, manila_bounds=True):
         if manila_bounds:
-            self.lat_range = (14.5, 14.7)
-            self.lng_range = (120.9, 121.1)
+            self.lat_range = MANILA_LAT_RANGE
+            self.lng_range = MANILA_LNG_RANGE
         else:
             # Global bounds
             self.lat_range = (-90, 90)
@@ -100,34 +203,20 @@ class DeliveryDataGenerator:
     
     def generate_delivery_route(self):
         """Generate a realistic delivery route"""
-        pickup_lat, pickup_lng = self.generate_random_coordinate()
-        dropoff_lat, dropoff_lng = self.generate_random_coordinate()
-        
-        distance = calculate_distance(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng)
-        
-        # Generate realistic travel time based on distance
-        base_time_per_km = 3  # minutes
-        hour = np.random.randint(0, 24)
-        weekday = np.random.randint(0, 7)
-        
-        # Traffic factors
-        traffic_multiplier = 1.5 if 7 <= hour <= 9 or 17 <= hour <= 19 else 1.0
-        weekend_multiplier = 0.8 if weekday >= 5 else 1.0
-        
-        travel_time = distance * base_time_per_km * traffic_multiplier * weekend_multiplier
-        travel_time += np.random.normal(0, 2)  # Add noise
-        travel_time = max(travel_time, 1)  # Minimum 1 minute
-        
-        return {
-            'pickup_lat': pickup_lat,
-            'pickup_lng': pickup_lng,
-            'dropoff_lat': dropoff_lat,
-            'dropoff_lng': dropoff_lng,
-            'distance_km': distance,
-            'hour': hour,
-            'weekday': weekday,
-            'travel_time_minutes': travel_time
-        }
+        return self.generate_delivery_routes(1).to_dict('records')[0]
+
+    def generate_delivery_routes(self, n_routes, seed=None):
+        """Generate many delivery routes as a DataFrame"""
+        return generate_delivery_data(
+            n_routes, seed=seed, lat_range=self.lat_range, lng_range=self.lng_range
+        )
+
+    def iter_delivery_routes(self, n_routes, chunk_size=1_000_000, seed=None):
+        """Generate delivery routes as DataFrame chunks of bounded size"""
+        return iter_delivery_data(
+            n_routes, chunk_size=chunk_size, seed=seed,
+            lat_range=self.lat_range, lng_range=self.lng_range
+        )
 
 # Manila landmarks for testing
 MANILA_LANDMARKS = {
@@ -0,0 +1,123 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\DB;
+use Illuminate\Support\Facades\Schema;
+
+/**
+ * Per-driver delivery aggregates, maintained incrementally by a trigger on
+ * deliveries so driver analytics are a single-row lookup instead of a scan.
+ */
+return new class extends Migration
+{
+    public function up()
+    {
+        Schema::create('driver_delivery_stats', function (Blueprint $table) {
+            $table->foreignId('driver_id')->primary()->constrained()->cascadeOnDelete();
+            $table->integer('total_deliveries')->default(0);
+            $table->integer('completed_deliveries')->default(0);
+            $table->integer('cancelled_deliveries')->default(0);
+            $table->integer('timed_deliveries')->default(0); // completed with actual_time
+            $table->integer('on_time_deliveries')->default(0); // actual_time <= estimated_time
+            $table->bigInteger('sum_actual_time')->default(0); // minutes
+            $table->decimal('sum_distance_km', 14, 3)->default(0);
+            $table->timestamp('last_completed_at')->nullable();
+            $table->timestamp('updated_at')->nullable();
+        });
+
+        // Add (sign = 1) or remove (sign = -1) one delivery's contribution
+        DB::unprepared(<<<'SQL'
+            CREATE INDEX deliveries_driver_completed_index
+            ON deliveries (driver_id, dropoff_time)
+            WHERE status = 'completed';
+
+            CREATE OR REPLACE FUNCTION apply_driver_delivery_stats(d deliveries, sign integer)
+            RETURNS void AS $$
+            DECLARE
+                is_completed integer := (d.status = 'completed')::integer;
+                is_timed integer := (d.status = 'completed' AND d.actual_time IS NOT NULL)::integer;
+            BEGIN
+                INSERT INTO driver_delivery_stats (driver_id, updated_at)
+                VALUES (d.driver_id, now())
+                ON CONFLICT (driver_id) DO NOTHING;
+
+                UPDATE driver_delivery_stats SET
+                    total_deliveries = total_deliveries + sign,
+                    completed_deliveries = completed_deliveries + sign * is_completed,
+                    cancelled_deliveries = cancelled_deliveries + sign * (d.status = 'cancelled')::integer,
+                    timed_deliveries = timed_deliveries + sign * is_timed,
+                    on_time_deliveries = on_time_deliveries
+                        + sign * (is_timed = 1 AND d.actual_time <= d.estimated_time)::integer,
+                    sum_actual_time = sum_actual_time + sign * is_timed * COALESCE(d.actual_time, 0),
+                    sum_distance_km = sum_distance_km + sign * is_completed * d.distance_km,
+                    last_completed_at = CASE
+                        WHEN is_completed = 0 THEN last_completed_at
+                        -- GREATEST ignores NULLs: like the backfill and the
+                        -- recompute below, a completion without dropoff_time
+                        -- does not count towards last_completed_at
+                        WHEN sign > 0 THEN GREATEST(last_completed_at, d.dropoff_time)
+                        -- A completed delivery was deleted or left 'completed' (AFTER
+                        -- trigger: the table already reflects it); take the latest of
+                        -- the driver's remaining completed deliveries
+                        ELSE (
+                            SELECT MAX(dropoff_time) FROM deliveries
+                            WHERE driver_id = d.driver_id AND status = 'completed'
+                        )
+                    END,
+                    updated_at = now()
+                WHERE driver_id = d.driver_id;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION deliveries_update_driver_stats()
+            RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    PERFORM apply_driver_delivery_stats(OLD, -1);
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    PERFORM apply_driver_delivery_stats(NEW, 1);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER deliveries_driver_stats
+            AFTER INSERT OR DELETE OR UPDATE OF driver_id, status, actual_time, estimated_time, distance_km, dropoff_time
+            ON deliveries
+            FOR EACH ROW EXECUTE FUNCTION deliveries_update_driver_stats();
+
+            INSERT INTO driver_delivery_stats (
+                driver_id, total_deliveries, completed_deliveries, cancelled_deliveries,
+                timed_deliveries, on_time_deliveries, sum_actual_time, sum_distance_km,
+                last_completed_at, updated_at
+            )
+            SELECT
+                driver_id,
+                COUNT(*),
+                COUNT(*) FILTER (WHERE status = 'completed'),
+                COUNT(*) FILTER (WHERE status = 'cancelled'),
+                COUNT(*) FILTER (WHERE status = 'completed' AND actual_time IS NOT NULL),
+                COUNT(*) FILTER (WHERE status = 'completed' AND actual_time <= estimated_time),
+                COALESCE(SUM(actual_time) FILTER (WHERE status = 'completed'), 0),
+                COALESCE(SUM(distance_km) FILTER (WHERE status = 'completed'), 0),
+                MAX(dropoff_time) FILTER (WHERE status = 'completed'),
+                now()
+            FROM deliveries
+            GROUP BY driver_id;
+        SQL);
+    }
+
+    public function down()
+    {
+        DB::unprepared(<<<'SQL'
+            DROP TRIGGER IF EXISTS deliveries_driver_stats ON deliveries;
+            DROP FUNCTION IF EXISTS deliveries_update_driver_stats();
+            DROP FUNCTION IF EXISTS apply_driver_delivery_stats(deliveries, integer);
+            DROP INDEX IF EXISTS deliveries_driver_completed_index;
+        SQL);
+
+        Schema::dropIfExists('driver_delivery_stats');
+    }
+};
@@ -24,6 +24,9 @@ export default function ETAPage() {
   const [loading, setLoading] = useState(false)
   const [training, setTraining] = useState(false)
   const [modelStatus, setModelStatus] = useState<ModelStatus | null>(null)
+  const [trackedDeliveryId, setTrackedDeliveryId] = useState('')
+  const [liveUpdate, setLiveUpdate] = useState<ETAResult | null>(null)
+  const eventSourceRef = React.useRef<EventSource | null>(null)
 
   const predictETA = async () => {
     setLoading(true)
@@ -73,7 +76,18 @@ export default function ETAPage() {
         throw new Error('Failed to train model')
       }
 
-      const data = await response.json()
+      // Training runs as a background job; poll until it finishes
+      const { job_id } = await response.json()
+      let data
+      do {
+        await new Promise((resolve) => setTimeout(resolve, 1000))
+        const statusResponse = await fetch(`http://localhost:5000/train_model/${job_id}`)
+        data = await statusResponse.json()
+      } while (['queued', 'started', 'deferred', 'scheduled'].includes(data.status))
+
+      if (data.status !== 'finished') {
+        throw new Error(data.error || 'Training failed')
+      }
       alert(`Model trained successfully! MAE: ${data.results.mae.toFixed(2)} minutes`)
       checkModelStatus()
     } catch (error) {
@@ -100,6 +114,24 @@ export default function ETAPage() {
     checkModelStatus()
   }, [])
 
+  // Subscribe to pushed ETA updates instead of polling /predict_eta; the
+  // service recomputes only when the driver's pings move the position
+  const trackDelivery = () => {
+    eventSourceRef.current?.close()
+    setLiveUpdate(null)
+    if (!trackedDeliveryId) return
+
+    const source = new EventSource(
+      `http://localhost:5000/deliveries/${encodeURIComponent(trackedDeliveryId)}/stream`
+    )
+    const onUpdate = (event: MessageEvent) => setLiveUpdate(JSON.parse(event.data))
+    source.addEventListener('eta', onUpdate)
+    source.addEventListener('proximity', onUpdate)
+    eventSourceRef.current = source
+  }
+
+  React.useEffect(() => () => eventSourceRef.current?.close(), [])
+
   const handleInputChange = (field: string, value: string) => {
     setCoordinates(prev => ({ ...prev, [field]: value }))
   }
@@ -196,6 +228,34 @@ export default function ETAPage() {
             </div>
           )}
 
+          <div className="mt-6 p-4 border border-gray-200 rounded-lg">
+            <h3 className="font-medium text-gray-900 mb-3">Live Tracking</h3>
+            <div className="flex space-x-2">
+              <input
+                type="text"
+                placeholder="Delivery ID"
+                value={trackedDeliveryId}
+                onChange={(e: any) => setTrackedDeliveryId(e.target.value)}
+                className="flex-1 px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500"
+              />
+              <button
+                onClick={trackDelivery}
+                className="bg-blue-500 text-white px-4 py-2 rounded-md hover:bg-blue-600"
+              >
+                Track
+              </button>
+            </div>
+            {liveUpdate ? (
+              <div className="mt-3 space-y-1 text-gray-800">
+                <p><strong>ETA:</strong> {liveUpdate.eta_minutes.toFixed(1)} minutes</p>
+                <p><strong>Distance:</strong> {liveUpdate.distance_km.toFixed(1)} km</p>
+                <p><strong>Status:</strong> {liveUpdate.message}</p>
+              </div>
+            ) : eventSourceRef.current && (
+              <p className="mt-3 text-sm text-gray-600">Waiting for the driver&apos;s next location update...</p>
+            )}
+          </div>
+
           <div className="mt-6 p-4 bg-gray-50 rounded-lg">
             <h3 className="font-medium text-gray-900 mb-2">Sample Coordinates (Manila Area)</h3>
             <div className="text-sm text-gray-600 space-y-1">
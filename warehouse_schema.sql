@@ -53,6 +53,21 @@ CREATE TABLE IF NOT EXISTS sensor_data (
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Alerts raised by the AI service's streaming sensor anomaly detector
+CREATE TABLE IF NOT EXISTS sensor_alerts (
+    id SERIAL PRIMARY KEY,
+    sensor_id VARCHAR(100) NOT NULL,
+    sensor_type VARCHAR(50),
+    zone VARCHAR(100),
+    value DECIMAL(10,2),
+    expected_value DECIMAL(10,2),
+    z_score DECIMAL(10,2),
+    status VARCHAR(50) NOT NULL, -- WARNING, CRITICAL
+    alert TEXT,
+    alert_type VARCHAR(50) DEFAULT 'SENSOR_ANOMALY',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Insert sample warehouse data
 INSERT INTO inventory_alerts (product_id, product_name, stock, min_threshold, alert, zone) VALUES
 ('PROD001', 'Electronics - Smartphone', 15, 20, 'Low stock alert: Only 15 units remaining', 'Zone A'),